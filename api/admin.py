@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import TissueMaskingJob, ReferenceStainProfile
+from .models import TissueMaskingJob, ReferenceStainProfile, TissueMaskRecord
 
 admin.site.register(TissueMaskingJob)
 admin.site.register(ReferenceStainProfile)
+admin.site.register(TissueMaskRecord)
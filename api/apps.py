@@ -1,6 +1,14 @@
+import threading
+
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        if getattr(settings, 'PIPELINE_WARMUP_ON_STARTUP', False):
+            from pipeline import runtime
+            threading.Thread(target=runtime.warm_up, name='pipeline-warmup', daemon=True).start()
@@ -0,0 +1,64 @@
+"""
+Bounded, completion-ordered execution of batch jobs.
+
+Items are pulled from their iterable only when a slot frees up, and at most
+`max_in_flight` of them are submitted to the shared PipelineExecutor at any
+time, so a batch holds decoded images and encoded results for its in-flight
+items only. Results are yielded as jobs finish, not in submission order.
+"""
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from api.executor import QueueFullError
+
+_END = object()
+
+
+def iter_completed(items, job, cost, executor, max_in_flight=4, max_backoff_seconds=1.0):
+    """
+    Run `job(item)` for every item; yield the results as they complete.
+
+    When the executor's pixel budget is exhausted by other requests the
+    batch waits for its own jobs to finish (or, with none running, backs
+    off) instead of failing.
+
+    Args:
+        items: iterable, consumed lazily
+        job: callable(item) -> result, run on the executor; should not raise
+        cost: callable(item) -> int, estimated pixels for admission
+        executor: PipelineExecutor
+        max_in_flight: int, items submitted but not yet yielded
+        max_backoff_seconds: float, longest sleep while nothing of this
+            batch is running and the executor is full
+
+    Yields:
+        results of `job`, in completion order
+    """
+    items = iter(items)
+    in_flight = set()
+    item = None
+    try:
+        while True:
+            while len(in_flight) < max_in_flight:
+                if item is None:
+                    item = next(items, _END)
+                if item is _END:
+                    break
+                try:
+                    in_flight.add(executor.submit(job, cost(item), item))
+                except QueueFullError as e:
+                    if in_flight:
+                        break
+                    time.sleep(min(e.retry_after, max_backoff_seconds))
+                    continue
+                item = None
+
+            if not in_flight:
+                return
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        # Client went away or a job raised: drop work that has not started
+        for future in in_flight:
+            future.cancel()
@@ -0,0 +1,157 @@
+"""
+Bounded executor for running the CPU-bound pipeline off the request thread.
+
+Admission is controlled by estimated pixel cost: when the pixels already
+queued or running plus the new request exceed the budget, the request is
+rejected with a Retry-After estimate instead of being queued behind
+everyone else.
+"""
+import asyncio
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFullError(Exception):
+    """Raised when a job would exceed the executor's pending pixel budget."""
+
+    def __init__(self, retry_after, pending_pixels):
+        super().__init__(
+            f"Pipeline queue is full ({pending_pixels} pixels pending), retry in {retry_after}s"
+        )
+        self.retry_after = retry_after
+        self.pending_pixels = pending_pixels
+
+
+class PipelineExecutor:
+    """
+    Thread pool with a cap on pending work measured in pixels.
+
+    A single job larger than the whole budget is still admitted when the
+    executor is idle, so oversized images are slow rather than impossible.
+    """
+
+    def __init__(self, max_workers=2, max_pending_pixels=200_000_000,
+                 initial_pixels_per_second=20_000_000):
+        """
+        Args:
+            max_workers: int, pipeline jobs running concurrently
+            max_pending_pixels: int, budget for queued + running pixels
+            initial_pixels_per_second: float, throughput estimate used for
+                Retry-After until jobs have been timed
+        """
+        self.max_workers = max_workers
+        self.max_pending_pixels = max_pending_pixels
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='pipeline-job')
+        self._lock = threading.Lock()
+        self._pending_pixels = 0
+        self._pending_jobs = 0
+        self._pixels_per_second = float(initial_pixels_per_second)
+        self._completed = 0
+        self._rejected = 0
+
+    def retry_after(self):
+        """Seconds until the current backlog is expected to drain (>= 1)."""
+        with self._lock:
+            return self._retry_after_locked()
+
+    def _retry_after_locked(self):
+        drain_rate = self._pixels_per_second * self.max_workers
+        return max(1, math.ceil(self._pending_pixels / drain_rate))
+
+    def submit(self, fn, cost_pixels, *args, **kwargs):
+        """
+        Schedule `fn(*args, **kwargs)` if the pixel budget allows it.
+
+        Args:
+            fn: callable to run on the pool
+            cost_pixels: int, estimated cost (image width * height)
+
+        Returns:
+            future: concurrent.futures.Future
+
+        Raises:
+            QueueFullError: if the job does not fit in the budget
+        """
+        cost_pixels = max(1, int(cost_pixels))
+        with self._lock:
+            over_budget = self._pending_pixels + cost_pixels > self.max_pending_pixels
+            if over_budget and self._pending_jobs > 0:
+                self._rejected += 1
+                raise QueueFullError(self._retry_after_locked(), self._pending_pixels)
+            self._pending_pixels += cost_pixels
+            self._pending_jobs += 1
+
+        release_lock = threading.Lock()
+        released = []
+
+        def _release(seconds=None):
+            # Exactly once per job, whether it ran, failed or was cancelled
+            with release_lock:
+                if released:
+                    return
+                released.append(True)
+            self._job_done(cost_pixels, seconds)
+
+        def _run():
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                # Before the result is visible, so callers see the budget freed
+                _release(time.perf_counter() - start)
+
+        try:
+            future = self._pool.submit(_run)
+        except BaseException:
+            _release()
+            raise
+        # A cancelled future never runs `_run`
+        future.add_done_callback(lambda _: _release())
+        return future
+
+    def _job_done(self, cost_pixels, seconds):
+        with self._lock:
+            self._pending_pixels -= cost_pixels
+            self._pending_jobs -= 1
+            if seconds:
+                self._completed += 1
+                # Exponential moving average of single-job throughput
+                rate = cost_pixels / seconds
+                self._pixels_per_second = 0.8 * self._pixels_per_second + 0.2 * rate
+
+    async def run(self, fn, cost_pixels, *args, **kwargs):
+        """Async wrapper around `submit`; awaits the job's result."""
+        future = self.submit(fn, cost_pixels, *args, **kwargs)
+        return await asyncio.wrap_future(future)
+
+    def stats(self):
+        """Snapshot of queue state for status reporting."""
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'max_pending_pixels': self.max_pending_pixels,
+                'pending_pixels': self._pending_pixels,
+                'pending_jobs': self._pending_jobs,
+                'completed_jobs': self._completed,
+                'rejected_jobs': self._rejected,
+                'pixels_per_second': self._pixels_per_second,
+            }
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Process-wide executor configured from Django settings."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            from django.conf import settings
+            _executor = PipelineExecutor(
+                max_workers=settings.PIPELINE_EXECUTOR_WORKERS,
+                max_pending_pixels=settings.PIPELINE_MAX_PENDING_PIXELS,
+            )
+        return _executor
@@ -0,0 +1,24 @@
+"""
+Per-process access to the flat-field registry.
+
+Gain maps live in FLAT_FIELD_DIR, shared by all worker processes; each
+process keeps its own cache of resized copies.
+"""
+import threading
+
+from pipeline.preprocess import FlatFieldRegistry
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_flat_field_registry():
+    """Registry for the configured FLAT_FIELD_DIR (created on first use)."""
+    from django.conf import settings
+    directory = str(settings.FLAT_FIELD_DIR)
+    with _registries_lock:
+        registry = _registries.get(directory)
+        if registry is None:
+            registry = FlatFieldRegistry(directory, max_cached=settings.FLAT_FIELD_CACHE_ENTRIES)
+            _registries[directory] = registry
+        return registry
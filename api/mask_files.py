@@ -0,0 +1,24 @@
+"""
+Per-process access to the mask file store.
+
+Mask TIFFs live in MASK_FILE_DIR, shared by all worker processes, so any
+worker can serve a download written by another.
+"""
+import threading
+
+from pipeline.mask_tiff import MaskFileStore
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_mask_file_store():
+    """Store for the configured MASK_FILE_DIR (created on first use)."""
+    from django.conf import settings
+    directory = str(settings.MASK_FILE_DIR)
+    with _stores_lock:
+        store = _stores.get(directory)
+        if store is None:
+            store = MaskFileStore(directory, ttl_seconds=settings.MASK_FILE_TTL_SECONDS)
+            _stores[directory] = store
+        return store
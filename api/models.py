@@ -49,3 +49,24 @@ class ReferenceStainProfile(models.Model):
 
     def __str__(self):
         return f"{self.stain_type} Profile - {self.created_at}"
+
+
+class TissueMaskRecord(models.Model):
+    """Per-request metrics and QC flags, written in bulk by api.recorder"""
+    created_at = models.DateTimeField(db_index=True)
+    endpoint = models.CharField(max_length=50)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    params = models.JSONField()
+    timings = models.JSONField()  # Seconds per stage
+    metrics = models.JSONField()
+    qc_flags = models.JSONField(default=list)
+    # Denormalized for dashboard queries
+    tissue_area_fraction = models.FloatField(null=True, blank=True)
+    session_id = models.CharField(max_length=255, null=True, blank=True, db_index=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.endpoint} {self.width}x{self.height} - {self.created_at}"
@@ -0,0 +1,169 @@
+"""
+Write-behind persistence of per-request metrics.
+
+Request handlers hand a small record (params, image size, stage timings,
+metrics) to the process-wide MetricsRecorder and return immediately. A
+background thread writes the buffered records as TissueMaskRecord rows in
+one bulk transaction every METRICS_FLUSH_INTERVAL_SECONDS, or sooner once
+METRICS_FLUSH_SIZE records are waiting, so requests never wait on the
+database or contend for the SQLite write lock.
+
+Records are dropped only when the buffer already holds
+METRICS_BUFFER_SIZE records (the database cannot keep up); drops are
+counted in `stats()`.
+"""
+import atexit
+import threading
+import time
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def write_records(records):
+    """Insert records as TissueMaskRecord rows in a single transaction."""
+    from django.db import transaction
+    from api.models import TissueMaskRecord
+
+    with transaction.atomic():
+        TissueMaskRecord.objects.bulk_create([TissueMaskRecord(**record) for record in records])
+
+
+class MetricsRecorder:
+    """
+    Bounded in-memory buffer flushed in bulk by a background thread.
+
+    Thread-safe. The flush thread starts with the first record, so
+    processes that never record (or fork after import) run no thread.
+    """
+
+    def __init__(self, flush_interval=5.0, flush_size=200, max_buffered=10_000, writer=write_records):
+        """
+        Args:
+            flush_interval: float, seconds between timed flushes
+            flush_size: int, buffered records that trigger an early flush
+            max_buffered: int, records held before new ones are dropped
+            writer: callable(list of dicts), persists one batch
+        """
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_buffered = max_buffered
+        self.writer = writer
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._buffer = []
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._recorded = 0
+        self._written = 0
+        self._dropped = 0
+        self._flushes = 0
+        self._failed_flushes = 0
+        self._last_error = None
+        self._last_flush_seconds = None
+
+    def record(self, record):
+        """
+        Buffer one record (a dict of TissueMaskRecord fields).
+
+        Returns:
+            accepted: bool, False if the buffer is full and it was dropped
+        """
+        with self._lock:
+            if len(self._buffer) >= self.max_buffered:
+                self._dropped += 1
+                return False
+            self._buffer.append(record)
+            self._recorded += 1
+            flush_now = len(self._buffer) >= self.flush_size
+            if self._thread is None and not self._stopping:
+                self._thread = threading.Thread(target=self._run, name='metrics-recorder', daemon=True)
+                self._thread.start()
+        if flush_now:
+            self._wakeup.set()
+        return True
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+        from django.db import connection
+        connection.close()
+
+    def flush(self):
+        """
+        Write everything buffered so far as one batch.
+
+        On failure the batch is put back in front of newer records (up to
+        the buffer limit, the rest counted as dropped) and retried on the
+        next flush.
+
+        Returns:
+            written: int, records persisted
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+            if not batch:
+                return 0
+
+            start = time.perf_counter()
+            try:
+                self.writer(batch)
+            except Exception as e:
+                with self._lock:
+                    self._failed_flushes += 1
+                    self._last_error = f"{type(e).__name__}: {e}"
+                    room = max(0, self.max_buffered - len(self._buffer))
+                    self._dropped += max(0, len(batch) - room)
+                    self._buffer = batch[:room] + self._buffer
+                return 0
+
+            with self._lock:
+                self._flushes += 1
+                self._written += len(batch)
+                self._last_flush_seconds = time.perf_counter() - start
+            return len(batch)
+
+    def close(self):
+        """Stop the flush thread and write what is left."""
+        with self._lock:
+            self._stopping = True
+            thread = self._thread
+        self._wakeup.set()
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+    def stats(self):
+        """Snapshot of recorder counters."""
+        with self._lock:
+            return {
+                'buffered': len(self._buffer),
+                'recorded': self._recorded,
+                'written': self._written,
+                'dropped': self._dropped,
+                'flushes': self._flushes,
+                'failed_flushes': self._failed_flushes,
+                'last_flush_seconds': self._last_flush_seconds,
+                'last_error': self._last_error,
+            }
+
+
+def get_recorder():
+    """Process-wide recorder configured from Django settings, or None if disabled."""
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            from django.conf import settings
+            if not settings.METRICS_RECORDER_ENABLED:
+                return None
+            _recorder = MetricsRecorder(
+                flush_interval=settings.METRICS_FLUSH_INTERVAL_SECONDS,
+                flush_size=settings.METRICS_FLUSH_SIZE,
+                max_buffered=settings.METRICS_BUFFER_SIZE,
+            )
+            atexit.register(_recorder.close)
+        return _recorder
@@ -0,0 +1,111 @@
+"""
+Slide session contexts and recent results.
+
+Tiles sent with the same `session_id` (and the same pipeline options) share
+one SlideContext until it has been idle for SLIDE_SESSION_TTL_SECONDS.
+Contexts live in a per-process cache; once established, their parameters
+are saved to SLIDE_SESSION_DIR, so tiles of the slide served by any worker
+process reuse the same parameters.
+Results requested with `cache_result=true` keep their image and mask in
+RESULT_CACHE_DIR for RESULT_CACHE_TTL_SECONDS so ROI edits, sent to any
+worker process, can re-mask them incrementally.
+"""
+import threading
+
+from pipeline.result_store import ResultStore
+from pipeline.session import SlideContext, SlideParameterStore, TTLCache
+
+_cache = None
+_cache_lock = threading.Lock()
+_parameter_stores = {}
+_result_stores = {}
+
+
+def get_session_cache():
+    """Process-wide TTL cache configured from Django settings."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            from django.conf import settings
+            _cache = TTLCache(
+                ttl_seconds=settings.SLIDE_SESSION_TTL_SECONDS,
+                max_entries=settings.SLIDE_SESSION_MAX_ENTRIES,
+            )
+        return _cache
+
+
+def get_parameter_store():
+    """Store for the configured SLIDE_SESSION_DIR (shared by all workers)."""
+    from django.conf import settings
+    directory = str(settings.SLIDE_SESSION_DIR)
+    with _cache_lock:
+        store = _parameter_stores.get(directory)
+        if store is None:
+            store = SlideParameterStore(directory, ttl_seconds=settings.SLIDE_SESSION_TTL_SECONDS)
+            _parameter_stores[directory] = store
+        return store
+
+
+def _session_key(session_id, params):
+    # Options that change the estimated parameters are part of the key, so a
+    # session never mixes thresholds from different methods
+    return (session_id, params['stain_method'], params['threshold_method'], params['normalize'],
+            params.get('adaptive_white_reference', False), params.get('white_reference_percentile'),
+            params.get('color_lut'), params.get('stain_type', 'HE'))
+
+
+def get_slide_context(session_id, params):
+    """
+    SlideContext for a session, created on first use.
+
+    A context not yet established in this process picks up parameters
+    another worker has saved for the session.
+
+    Returns:
+        (context, created): tuple
+    """
+    key = _session_key(session_id, params)
+    context, created = get_session_cache().get_or_create(key, SlideContext)
+    if not context.is_established:
+        stored = get_parameter_store().load(key)
+        if stored is not None:
+            context.establish(**stored)
+    return context, created
+
+
+def share_slide_context(session_id, params, context):
+    """
+    Save parameters this process established for other workers.
+
+    If another worker saved the session first, the context adopts its
+    parameters, so later tiles of the slide all use the same set.
+    """
+    stored, saved = get_parameter_store().save(_session_key(session_id, params), context.parameters)
+    if not saved:
+        context.adopt(stored)
+
+
+def get_result_store():
+    """Store for the configured RESULT_CACHE_DIR (shared by all workers)."""
+    from django.conf import settings
+    directory = str(settings.RESULT_CACHE_DIR)
+    with _cache_lock:
+        store = _result_stores.get(directory)
+        if store is None:
+            store = ResultStore(
+                directory,
+                ttl_seconds=settings.RESULT_CACHE_TTL_SECONDS,
+                max_entries=settings.RESULT_CACHE_MAX_ENTRIES,
+            )
+            _result_stores[directory] = store
+        return store
+
+
+def cache_result(image, mask, slide_parameters, params):
+    """
+    Keep a result for later ROI edits.
+
+    Returns:
+        result_id: str
+    """
+    return get_result_store().add(image, mask, slide_parameters, params)
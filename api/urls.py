@@ -2,21 +2,38 @@
 from django.urls import path
 from api.views.tissue_views import (
     tissue_mask_view,
+    tissue_mask_async_view,
+    tissue_mask_roi_view,
+    tissue_mask_file_view,
     tissue_mask_batch_view,
     get_pipeline_status_view
 )
-from api.views.health_views import health_check_view
+from api.views.flat_field_views import flat_field_view
+from api.views.health_views import health_check_view, readiness_check_view
 
 urlpatterns = [
     # Main endpoint: single image tissue masking
     path('tissue/mask/', tissue_mask_view, name='tissue-mask'),
     
-    # Batch processing (optional, for multiple images)
+    # Async variant for ASGI servers: bounded executor with load shedding
+    path('tissue/mask/async/', tissue_mask_async_view, name='tissue-mask-async'),
+    
+    # Incremental re-masking of a region of a cached result
+    path('tissue/mask/roi/', tissue_mask_roi_view, name='tissue-mask-roi'),
+    
+    # Masks written to disk as tiled TIFFs (mask_output=tiff)
+    path('tissue/mask/files/<str:file_id>/', tissue_mask_file_view, name='tissue-mask-file'),
+    
+    # Batch processing: JSON, or NDJSON streamed in completion order
     path('tissue/mask/batch/', tissue_mask_batch_view, name='tissue-mask-batch'),
     
+    # Flat-field (illumination) references per scanner
+    path('flat-fields/', flat_field_view, name='flat-fields'),
+    
     # Pipeline status/health
     path('tissue/status/', get_pipeline_status_view, name='pipeline-status'),
     
     # Health check
     path('health/', health_check_view, name='health-check'),
+    path('health/ready/', readiness_check_view, name='readiness-check'),
 ]
@@ -0,0 +1,74 @@
+"""
+Flat-field registry endpoints.
+"""
+from django.http import JsonResponse
+from rest_framework.decorators import api_view
+from rest_framework import status
+from django.views.decorators.csrf import csrf_exempt
+
+from pipeline.io import decode_image
+
+from api.flat_fields import get_flat_field_registry
+
+
+@api_view(['GET', 'POST'])
+@csrf_exempt
+def flat_field_view(request):
+    """
+    GET /api/v1/flat-fields/
+    
+    List registered scanner ids.
+    
+    POST /api/v1/flat-fields/
+    
+    Register (or replace) the flat field of a scanner. The blank-slide
+    reference is converted once into a reciprocal gain map; mask requests
+    then pass `flat_field_id=<scanner_id>`.
+    
+    Request (multipart/form-data):
+    - scanner_id: str - Letters, digits, '_', '.' or '-' (max 64)
+    - image: JPG/PNG/TIFF blank slide reference
+    
+    Response (JSON):
+    {
+        "success": true,
+        "scanner_id": "scanner-01",
+        "width": 2048,
+        "height": 1536
+    }
+    """
+    registry = get_flat_field_registry()
+    if request.method == 'GET':
+        return JsonResponse({"success": True, "scanner_ids": registry.scanner_ids()})
+    
+    try:
+        if 'image' not in request.FILES:
+            return JsonResponse(
+                {"success": False, "error": "No image file provided"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        scanner_id = request.POST.get('scanner_id', '')
+        image_file = request.FILES['image']
+        try:
+            flat_field = decode_image(image_file)
+        except (OSError, ValueError) as e:
+            return JsonResponse(
+                {"success": False, "error": f"Cannot read {image_file.name}: {e}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        height, width = registry.register(scanner_id, flat_field)
+        return JsonResponse(
+            {"success": True, "scanner_id": scanner_id, "width": width, "height": height},
+            status=status.HTTP_201_CREATED
+        )
+    except ValueError as e:
+        return JsonResponse(
+            {"success": False, "error": str(e)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    except Exception as e:
+        import traceback
+        return JsonResponse(
+            {"success": False, "error": str(e), "traceback": traceback.format_exc()},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
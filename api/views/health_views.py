@@ -1,10 +1,12 @@
 """
 Health check endpoints.
 """
+from django.http import JsonResponse
 from rest_framework.decorators import api_view
-from rest_framework.response import JsonResponse
 from rest_framework import status
 
+from pipeline import runtime
+
 
 @api_view(['GET'])
 def health_check_view(request):
@@ -18,3 +20,19 @@ def health_check_view(request):
         'service': 'tissue-masking-service',
         'version': '1.0.0'
     }, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def readiness_check_view(request):
+    """
+    Readiness endpoint: 200 once this worker has warmed up the pipeline.
+    
+    GET /api/v1/health/ready/
+    """
+    runtime_status = runtime.runtime_status()
+    ready = runtime_status['ready']
+    return JsonResponse({
+        'status': 'ready' if ready else 'warming_up',
+        'warmup_seconds': runtime_status['warmup_seconds'],
+        'threads_per_worker': runtime_status['threads_per_worker'],
+    }, status=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE)
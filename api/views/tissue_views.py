@@ -2,25 +2,463 @@
 Main tissue masking API endpoints.
 """
 import base64
-import io
-import numpy as np
-from PIL import Image
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
 from rest_framework.decorators import api_view
-from rest_framework.response import JsonResponse
 from rest_framework import status
 from django.views.decorators.csrf import csrf_exempt
 
 from pipeline.pipeline import TissueMaskingPipeline
-from pipeline.io import decode_image, encode_mask_png, encode_image_png
-from pipeline.metrics import compute_qc_metrics
+from pipeline.io import (
+    IMAGE_FORMATS, decode_image, encode_image, encode_image_base64, encode_mask_png,
+    iter_buffer_chunks, probe_image_size
+)
+from pipeline.preview import preview_size, render_overlay, render_previews
+from pipeline.slide import is_tiff, read_slide_for_masking, selected_level_size
+from pipeline.roi import splice_roi
+from pipeline.preprocess import UnknownFlatFieldError, apply_gain, validate_scanner_id
+from pipeline.regions import RegionIndex, regions_to_json
+from pipeline.lut import COLOR_LUT_MODES
+from pipeline.occupancy import OCCUPANCY_DTYPES, encode_occupancy
+from pipeline.precheck import fast_path_counts
+from pipeline.mask_tiff import MASK_TIFF_COMPRESSIONS, iter_mask_tiles
+from pipeline.archive import archive_format, iter_archive_images
+
+from api.batch import iter_completed
+from api.executor import QueueFullError, get_executor
+from api.flat_fields import get_flat_field_registry
+from api.mask_files import get_mask_file_store
+from api.recorder import get_recorder
+from api.sessions import cache_result, get_result_store, get_slide_context, share_slide_context
+
+
+# Mask response bodies: JSON with base64 fields, or the raw mask PNG
+RESPONSE_FORMATS = ('json', 'png')
+# Where the full-resolution mask goes: in the response, or a TIFF on disk
+MASK_OUTPUTS = ('inline', 'tiff')
+# Extra outputs that only fit in a JSON body
+PNG_RESPONSE_EXCLUDED = (
+    'return_overlay', 'return_mask_thumbnail', 'return_regions', 'return_region_index', 'tile_size'
+)
 
 
-def create_overlay(image, mask):
+class BadRequestError(ValueError):
+    """Invalid request parameters or an unreadable upload (400)."""
+
+
+def create_overlay(image, mask, max_dimension=None):
     """Create overlay visualization: green mask on original image"""
-    overlay = image.copy().astype(np.float32)
-    mask_bool = mask > 0
-    overlay[mask_bool] = overlay[mask_bool] * 0.7 + np.array([0, 255, 0]) * 0.3
-    return overlay.astype(np.uint8)
+    return render_overlay(image, mask, max_dimension=max_dimension)
+
+
+def _optional_number(data, key, cast, default=None):
+    value = data.get(key)
+    if value in (None, ''):
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        raise BadRequestError(f"{key} must be {cast.__name__}, got {value!r}") from None
+
+
+def parse_mask_params(data):
+    """
+    Extract pipeline/response options from request form data.
+    
+    Raises:
+        BadRequestError: if an option is malformed or options conflict
+    """
+    color_lut = data.get('color_lut', 'none').lower()
+    params = {
+        'normalize': data.get('normalize', 'false').lower() == 'true',
+        'stain_method': data.get('stain_method', 'macenko'),
+        'threshold_method': data.get('threshold_method', 'auto'),
+        'return_overlay': data.get('return_overlay', 'false').lower() == 'true',
+        'target_mpp': _optional_number(data, 'target_mpp', float),
+        'max_dimension': _optional_number(data, 'max_dimension', int),
+        'session_id': data.get('session_id') or None,
+        'session_thumbnail': data.get('session_thumbnail', 'false').lower() == 'true',
+        'min_area': _optional_number(data, 'min_area', int, default=100),
+        'kernel_size': _optional_number(data, 'kernel_size', int, default=3),
+        'cache_result': data.get('cache_result', 'false').lower() == 'true',
+        'color_lut': None if color_lut == 'none' else color_lut,
+        'flat_field_id': data.get('flat_field_id') or None,
+        'return_mask_thumbnail': data.get('return_mask_thumbnail', 'false').lower() == 'true',
+        'preview_max_dimension': _optional_number(data, 'preview_max_dimension', int),
+        'preview_format': data.get('preview_format', 'png').lower(),
+        'preview_quality': _optional_number(data, 'preview_quality', int, default=85),
+        'return_regions': data.get('return_regions', 'false').lower() == 'true',
+        'return_region_index': data.get('return_region_index', 'false').lower() == 'true',
+        'region_epsilon': _optional_number(data, 'region_epsilon', float),
+        'tile_size': _optional_number(data, 'tile_size', int),
+        'stride': _optional_number(data, 'stride', int),
+        'tile_dtype': data.get('tile_dtype', 'uint8').lower(),
+        'adaptive_white_reference': data.get('adaptive_white_reference', 'false').lower() == 'true',
+        'white_reference_percentile': _optional_number(
+            data, 'white_reference_percentile', float, default=99.5
+        ),
+        'fast_paths': data.get('fast_paths', 'false').lower() == 'true',
+        'response_format': data.get('response_format', 'json').lower(),
+        'mask_output': data.get('mask_output', 'inline').lower(),
+        'mask_tile_size': _optional_number(data, 'mask_tile_size', int, default=512),
+        'mask_compression': data.get('mask_compression', 'deflate').lower(),
+        'mask_pyramid': data.get('mask_pyramid', 'false').lower() == 'true',
+    }
+    validate_mask_params(params)
+    return params
+
+
+def validate_mask_params(params):
+    """Raise BadRequestError for options the pipeline or encoders would reject."""
+    if params['min_area'] < 0 or params['kernel_size'] < 0:
+        raise BadRequestError("min_area and kernel_size must not be negative")
+    if not 0 <= params['preview_quality'] <= 100:
+        raise BadRequestError("preview_quality must be between 0 and 100")
+    if not 0 <= params['white_reference_percentile'] <= 100:
+        raise BadRequestError("white_reference_percentile must be between 0 and 100")
+    if params['color_lut'] is not None and params['color_lut'] not in COLOR_LUT_MODES:
+        raise BadRequestError(f"color_lut must be 'none' or one of {list(COLOR_LUT_MODES)}")
+    if params['flat_field_id'] is not None:
+        try:
+            validate_scanner_id(params['flat_field_id'])
+        except ValueError as e:
+            raise BadRequestError(f"flat_field_id: {e}") from None
+    if params['preview_format'] not in IMAGE_FORMATS:
+        raise BadRequestError(f"preview_format must be one of {sorted(IMAGE_FORMATS)}")
+    if params['tile_size'] is not None and params['tile_size'] <= 0:
+        raise BadRequestError("tile_size must be positive")
+    if params['stride'] is not None and (params['tile_size'] is None or params['stride'] <= 0):
+        raise BadRequestError("stride must be positive and needs tile_size")
+    if params['tile_dtype'] not in OCCUPANCY_DTYPES:
+        raise BadRequestError(f"tile_dtype must be one of {list(OCCUPANCY_DTYPES)}")
+    if params['response_format'] not in RESPONSE_FORMATS:
+        raise BadRequestError(f"response_format must be one of {list(RESPONSE_FORMATS)}")
+    if params['response_format'] == 'png' and any(params[key] for key in PNG_RESPONSE_EXCLUDED):
+        raise BadRequestError(f"response_format=png returns only the mask; drop {list(PNG_RESPONSE_EXCLUDED)}")
+    if params['mask_output'] not in MASK_OUTPUTS:
+        raise BadRequestError(f"mask_output must be one of {list(MASK_OUTPUTS)}")
+    if params['mask_output'] == 'tiff' and params['response_format'] == 'png':
+        raise BadRequestError("response_format=png needs mask_output=inline")
+    if params['mask_compression'] not in MASK_TIFF_COMPRESSIONS:
+        raise BadRequestError(f"mask_compression must be one of {list(MASK_TIFF_COMPRESSIONS)}")
+    if params['mask_tile_size'] <= 0 or params['mask_tile_size'] % 16:
+        raise BadRequestError("mask_tile_size must be a positive multiple of 16")
+
+
+def add_previews(response_data, image_array, result, params):
+    """
+    Add downsampled overlay / mask thumbnail / normalized-RGB previews.
+    
+    Previews are rendered at `preview_max_dimension` (default
+    PREVIEW_MAX_DIMENSION; 0 for full resolution) and encoded as
+    `preview_format`. Mask thumbnails are always PNG.
+    """
+    # A PNG response body has no room for the normalized preview
+    include_normalized = params['normalize'] and params['response_format'] == 'json'
+    normalized_rgb = result.get('normalized_rgb') if include_normalized else None
+    if not (params['return_overlay'] or params['return_mask_thumbnail'] or normalized_rgb is not None):
+        return
+    
+    image_format = params['preview_format']
+    max_dimension = params['preview_max_dimension']
+    if max_dimension is None:
+        max_dimension = settings.PREVIEW_MAX_DIMENSION
+    
+    previews = render_previews(
+        image_array, result['mask'],
+        normalized_rgb=normalized_rgb,
+        max_dimension=max_dimension,
+        overlay=params['return_overlay'],
+        mask_thumbnail=params['return_mask_thumbnail'],
+        channel_order='bgr'
+    )
+    for name, preview in previews.items():
+        if name == 'mask_thumbnail':
+            response_data["mask_thumbnail_png_base64"] = encode_mask_png(preview)
+        else:
+            response_data[f"{name}_{image_format}_base64"] = encode_image_base64(
+                preview, image_format=image_format, quality=params['preview_quality'],
+                channel_order='bgr'
+            )
+    
+    width, height = preview_size(image_array.shape, max_dimension)
+    response_data["preview"] = {
+        "format": image_format,
+        "width": width,
+        "height": height,
+        # Mask pixels per preview pixel
+        "scale_factor": image_array.shape[1] / width,
+    }
+
+
+def _uses_slide_reader(image_file, params):
+    """Pyramidal TIFF uploads with a level request go through the slide reader."""
+    wants_level = params['target_mpp'] is not None or params['max_dimension'] is not None
+    return wants_level and is_tiff(image_file)
+
+
+def decode_upload(image_file, params):
+    """
+    Decode an uploaded image, picking a pyramid level for slide TIFFs.
+    
+    Returns:
+        image_array: (H, W, 3) uint8 RGB
+        slide_info: dict from `read_slide_for_masking`, or None
+    
+    Raises:
+        BadRequestError: if the upload cannot be decoded, or the requested
+            level cannot be selected (e.g. target_mpp without metadata)
+    """
+    try:
+        if _uses_slide_reader(image_file, params):
+            return read_slide_for_masking(
+                image_file,
+                target_mpp=params['target_mpp'],
+                max_dimension=params['max_dimension']
+            )
+        return decode_image(image_file), None
+    except (OSError, ValueError) as e:
+        raise BadRequestError(f"Cannot read {getattr(image_file, 'name', 'image')}: {e}") from e
+
+
+def upload_pixel_cost(image_file, params):
+    """Pixels the pipeline will process for an upload (header only)."""
+    try:
+        if _uses_slide_reader(image_file, params):
+            position = image_file.tell()
+            try:
+                width, height = selected_level_size(
+                    image_file,
+                    target_mpp=params['target_mpp'],
+                    max_dimension=params['max_dimension']
+                )
+            finally:
+                image_file.seek(position)
+        else:
+            width, height = probe_image_size(image_file)
+    except (OSError, ValueError) as e:
+        raise BadRequestError(f"Cannot read {getattr(image_file, 'name', 'image')}: {e}") from e
+    return width * height
+
+
+def build_mask_response(image_array, params, slide_info=None, timings=None):
+    """
+    Run the pipeline on a decoded image and build the JSON response body.
+    
+    Args:
+        image_array: (H, W, 3) uint8 RGB
+        params: dict from `parse_mask_params`
+        slide_info: dict describing the pyramid level masked, if any
+        timings: optional dict receiving 'pipeline' and 'postprocess' seconds
+    
+    Returns:
+        response_data: dict
+    """
+    start = time.perf_counter()
+    pipeline = TissueMaskingPipeline(
+        normalize=params['normalize'],
+        stain_method=params['stain_method'],
+        threshold_method=params['threshold_method'],
+        num_threads=settings.PIPELINE_INTRA_IMAGE_THREADS,
+        min_area=params['min_area'],
+        kernel_size=params['kernel_size'],
+        color_lut=params['color_lut'],
+        regions=params['return_regions'] or params['return_region_index'],
+        region_epsilon=1.0 if params['region_epsilon'] is None else params['region_epsilon'],
+        tile_size=params['tile_size'],
+        tile_stride=params['stride'],
+        adaptive_white_reference=params['adaptive_white_reference'],
+        white_reference_percentile=params['white_reference_percentile'],
+        fast_paths=params['fast_paths']
+    )
+    
+    if params['flat_field_id']:
+        # Correct up front so previews and cached results see the same pixels
+        gain = get_flat_field_registry().get_gain(params['flat_field_id'], image_array.shape)
+        image_array = apply_gain(image_array, gain)
+    
+    context = None
+    if params['session_id']:
+        context, _ = get_slide_context(params['session_id'], params)
+    reused = context is not None and context.is_established
+    
+    if context is not None and params['session_thumbnail'] and not reused:
+        # Thumbnail establishes the slide parameters whatever its tissue content
+        result = pipeline.process(image_array, allow_fast_path=False)
+        context.establish(**result['slide_parameters'])
+    else:
+        result = pipeline.process(image_array, context=context)
+    if context is not None and not reused and context.is_established:
+        share_slide_context(params['session_id'], params, context)
+    pipeline_done = time.perf_counter()
+    
+    response_data = {"success": True}
+    if params['mask_output'] == 'tiff':
+        # No inline copy: the client downloads the file by id
+        response_data["mask_tiff"] = write_mask_file(result['mask'], params)
+    elif params['response_format'] == 'png':
+        # Encoded buffer, streamed as the response body by `mask_response`
+        response_data["mask_png"] = encode_image(result['mask'], image_format='png')
+    else:
+        response_data["mask_png_base64"] = encode_mask_png(result['mask'])
+    response_data["metrics"] = result['metrics']
+    
+    if context is not None:
+        response_data["session"] = {
+            "id": params['session_id'],
+            "established": context.is_established,
+            "reused": reused,
+            # Tiles of the session processed by this worker process
+            "tiles_processed": context.tiles_processed,
+        }
+    
+    # Optional: normalized RGB, overlay and mask thumbnail previews
+    add_previews(response_data, image_array, result, params)
+    
+    # Optional: region geometry and its spatial index (mask pixel coordinates)
+    if params['return_regions']:
+        response_data["regions"] = regions_to_json(result['regions'])
+    if params['return_region_index']:
+        index = RegionIndex.build(result['regions'], result['mask'].shape)
+        response_data["region_index_npz_base64"] = base64.b64encode(index.to_bytes()).decode('ascii')
+    
+    # Optional: tissue fraction per tile, row-major
+    if params['tile_size'] is not None:
+        occupancy = result['tile_occupancy']
+        response_data["tile_occupancy"] = {
+            "tile_size": params['tile_size'],
+            "stride": params['stride'] or params['tile_size'],
+            "rows": occupancy.shape[0],
+            "cols": occupancy.shape[1],
+            "dtype": params['tile_dtype'],
+            "data_base64": base64.b64encode(
+                encode_occupancy(occupancy, params['tile_dtype'])
+            ).decode('ascii'),
+        }
+    
+    if params['cache_result']:
+        response_data["result_id"] = cache_result(
+            image_array, result['mask'], result['slide_parameters'], params
+        )
+    
+    # Mask pixel (x, y) covers level-0 pixels scaled by slide.scale_factor
+    if slide_info is not None:
+        response_data["slide"] = slide_info
+    
+    if timings is not None:
+        timings['pipeline'] = pipeline_done - start
+        timings['postprocess'] = time.perf_counter() - pipeline_done
+    return response_data
+
+
+def write_mask_file(mask, params):
+    """
+    Write a mask tile by tile as a tiled TIFF in MASK_FILE_DIR.
+    
+    Returns:
+        info: dict with 'file_id', 'url', 'bytes', 'width', 'height',
+            'tile_size', 'compression' and 'levels'
+    """
+    tile_size = params['mask_tile_size']
+    info = get_mask_file_store().write(
+        iter_mask_tiles(mask, tile_size), mask.shape,
+        tile_size=tile_size,
+        compression=params['mask_compression'],
+        pyramid=params['mask_pyramid']
+    )
+    info['url'] = reverse('tissue-mask-file', args=[info['file_id']])
+    return info
+
+
+def record_mask_request(endpoint, image_array, params, response_data, timings):
+    """
+    Hand a processed request to the metrics recorder (if enabled).
+    
+    Never blocks on the database: the record is buffered and written in
+    bulk later, or dropped and counted if the buffer is full.
+    """
+    recorder = get_recorder()
+    if recorder is None:
+        return
+    metrics = response_data['metrics']
+    recorder.record({
+        'created_at': timezone.now(),
+        'endpoint': endpoint,
+        'width': image_array.shape[1],
+        'height': image_array.shape[0],
+        'params': dict(params),
+        'timings': dict(timings, total=sum(timings.values())),
+        'metrics': metrics,
+        'qc_flags': list(metrics.get('qc_flags', [])),
+        'tissue_area_fraction': metrics.get('tissue_area_fraction'),
+        'session_id': params['session_id'],
+    })
+
+
+def decode_and_build_response(endpoint, image_file, params):
+    """
+    Decode an upload, run the pipeline and record the request.
+    
+    Returns:
+        response_data: dict from `build_mask_response`
+    """
+    start = time.perf_counter()
+    image_array, slide_info = decode_upload(image_file, params)
+    timings = {'decode': time.perf_counter() - start}
+    response_data = build_mask_response(image_array, params, slide_info, timings=timings)
+    record_mask_request(endpoint, image_array, params, response_data, timings)
+    return response_data
+
+
+def mask_response(response_data):
+    """
+    HTTP response for `build_mask_response` output.
+    
+    JSON by default. For response_format=png the mask PNG is streamed as
+    the body straight from the encoder's buffer (no base64 or JSON copy)
+    and the remaining fields (metrics, session, slide, result_id) travel
+    as JSON in the X-Tissue-Mask-Info header.
+    """
+    mask_png = response_data.pop("mask_png", None)
+    if mask_png is None:
+        return JsonResponse(response_data)
+    response = StreamingHttpResponse(iter_buffer_chunks(mask_png), content_type='image/png')
+    response['Content-Length'] = str(mask_png.nbytes)
+    response['X-Tissue-Mask-Info'] = json.dumps(response_data)
+    return response
+
+
+def _unknown_flat_field_response(exc):
+    """JSON 404 response for a flat_field_id that is not registered."""
+    return JsonResponse(
+        {"success": False, "error": f"No flat field registered for scanner id {exc.args[0]!r}"},
+        status=status.HTTP_404_NOT_FOUND
+    )
+
+
+def _bad_request_response(exc):
+    """JSON 400 response for invalid parameters or an unreadable upload."""
+    return JsonResponse(
+        {"success": False, "error": str(exc)},
+        status=status.HTTP_400_BAD_REQUEST
+    )
+
+
+def _error_response(exc):
+    """JSON 500 response with traceback for an unexpected error."""
+    import traceback
+    error_trace = traceback.format_exc()
+    return JsonResponse(
+        {"success": False, "error": str(exc), "traceback": error_trace},
+        status=status.HTTP_500_INTERNAL_SERVER_ERROR
+    )
 
 
 @api_view(['POST'])
@@ -35,6 +473,59 @@ def tissue_mask_view(request):
     - stain_method: str (default: 'macenko') - 'macenko' or 'none'
     - threshold_method: str (default: 'auto') - 'otsu', 'sauvola', or 'auto'
     - return_overlay: bool (default: false) - Return overlay visualization
+    - return_mask_thumbnail: bool (default: false) - Return the mask at the
+      preview size
+    - preview_max_dimension: int (default: PREVIEW_MAX_DIMENSION, 0) - Size of
+      overlay, mask thumbnail and normalized-RGB previews; 0 = full size
+    - preview_format: str (default: 'png') - 'png', 'jpeg' or 'webp'
+    - preview_quality: int (default: 85) - JPEG/WebP quality
+    - target_mpp: float (optional) - Pyramidal TIFF: mask at the coarsest
+      level with at least this resolution (microns per pixel)
+    - max_dimension: int (optional) - Pyramidal TIFF: mask at the finest
+      level that fits in this many pixels
+    - session_id: str (optional) - Slide id; tiles of one slide reuse the
+      stain vectors, normalization statistics and threshold established by
+      the first tile with enough tissue
+    - session_thumbnail: bool (default: false) - With session_id: this image
+      is a slide thumbnail and establishes the session parameters
+    - min_area: int (default: 100) - Minimum tissue component area (pixels);
+      0 keeps every component
+    - kernel_size: int (default: 3) - Morphological smoothing kernel size;
+      0 disables smoothing
+    - cache_result: bool (default: false) - Keep the image and mask for
+      ROI edits via /api/v1/tissue/mask/roi/; returns a result_id
+    - flat_field_id: str (optional) - Scanner id registered via
+      /api/v1/flat-fields/; the image is flat-field corrected first
+    - color_lut: str (default: 'none') - 'unique' evaluates the per-pixel
+      stages once per distinct color; 'quantized' through a 3D LUT checked
+      against exact values (falls back to 'unique' when off)
+    - return_regions: bool (default: false) - Return per-region geometry
+    - region_epsilon: float (default: 1.0) - Region polygon simplification
+      tolerance (pixels)
+    - return_region_index: bool (default: false) - Return the persisted
+      spatial index of the regions (pipeline.regions.RegionIndex .npz)
+    - tile_size: int (optional, > 0) - Return the tissue fraction of every
+      complete tile_size x tile_size tile of the mask
+    - stride: int (default: tile_size, > 0) - Offset between tiles
+    - tile_dtype: str (default: 'uint8') - 'uint8' (fraction * 255) or
+      'float32' (little-endian)
+    - adaptive_white_reference: bool (default: false) - Estimate a
+      per-channel white reference from the background instead of 255
+    - white_reference_percentile: float (default: 99.5) - Channel
+      percentile above which pixels count as background glass
+    - fast_paths: bool (default: false) - Return blank, fully covered and
+      too-small images without thresholding; flagged BLANK_IMAGE,
+      FULL_TISSUE_COVERAGE or DEGENERATE_IMAGE in qc_flags
+    - response_format: str (default: 'json') - 'png' streams the mask PNG
+      as the response body, with the other fields as JSON in the
+      X-Tissue-Mask-Info header (previews, regions and tiles not allowed)
+    - mask_output: str (default: 'inline') - 'tiff' writes the mask tile by
+      tile to a tiled TIFF in MASK_FILE_DIR and returns "mask_tiff" (with a
+      download url) instead of "mask_png_base64"
+    - mask_tile_size: int (default: 512) - TIFF tile size (multiple of 16)
+    - mask_compression: str (default: 'deflate') - 'deflate', 'packbits'
+      or 'none'
+    - mask_pyramid: bool (default: false) - Add 2x reduced TIFF levels
     
     Response (JSON):
     {
@@ -45,7 +536,59 @@ def tissue_mask_view(request):
             "mean_total_od": 0.23,
             "qc_flags": []
         },
-        "normalized_rgb_png_base64": "..."  # Optional, if normalize=true
+        "normalized_rgb_png_base64": "...",  # Optional, if normalize=true
+        "overlay_png_base64": "...",  # Optional, if return_overlay=true
+        "mask_thumbnail_png_base64": "...",  # Optional
+        "preview": {  # Optional, with any preview ({format} = preview_format)
+            "format": "png",
+            "width": 1024,
+            "height": 768,
+            "scale_factor": 4.0  # Mask pixels per preview pixel
+        },
+        "slide": {  # Optional, pyramidal TIFF with target_mpp/max_dimension
+            "level": 2,
+            "level_count": 4,
+            "level_dimensions": [3000, 2000],
+            "scale_factor": [16.0, 16.0],  # Level-0 pixels per mask pixel
+            "mpp": [4.0, 4.0]
+        },
+        "result_id": "...",  # Optional, if cache_result=true
+        "regions": [  # Optional, if return_regions=true (mask pixel coordinates)
+            {
+                "id": 0,
+                "bbox": [x, y, width, height],
+                "area": 5120,
+                "centroid": [x, y],
+                "mean_od": 0.62,  # Mean total OD
+                "polygon": [[x, y], ...],
+                "holes": [[[x, y], ...]]
+            }
+        ],
+        "region_index_npz_base64": "...",  # Optional, if return_region_index=true
+        "mask_tiff": {  # Instead of mask_png_base64, if mask_output=tiff
+            "file_id": "...",
+            "url": "/api/v1/tissue/mask/files/<file_id>/",
+            "bytes": 40801,
+            "width": 5000,
+            "height": 3000,
+            "tile_size": 512,
+            "compression": "deflate",
+            "levels": [[5000, 3000], [2500, 1500]]  # Full resolution first
+        },
+        "tile_occupancy": {  # Optional, if tile_size was given
+            "tile_size": 256,
+            "stride": 256,
+            "rows": 12,  # Tile (i, j) starts at (i * stride, j * stride)
+            "cols": 16,
+            "dtype": "uint8",
+            "data_base64": "..."  # rows * cols values, row-major
+        },
+        "session": {  # Optional, if session_id was given
+            "id": "slide-42",
+            "established": true,
+            "reused": true,  # Parameters came from earlier tiles
+            "tiles_processed": 12  # By this worker process
+        }
     }
     """
     try:
@@ -56,57 +599,255 @@ def tissue_mask_view(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        image_file = request.FILES['image']
-        image_array = decode_image(image_file)  # Returns numpy array (H, W, 3) RGB
-        
         # 2. Extract optional parameters
-        normalize = request.POST.get('normalize', 'false').lower() == 'true'
-        stain_method = request.POST.get('stain_method', 'macenko')
-        threshold_method = request.POST.get('threshold_method', 'auto')
-        return_overlay = request.POST.get('return_overlay', 'false').lower() == 'true'
+        params = parse_mask_params(request.POST)
         
-        # 3. Initialize pipeline
-        pipeline = TissueMaskingPipeline(
-            normalize=normalize,
-            stain_method=stain_method,
-            threshold_method=threshold_method
+        # 3. Decode (numpy array (H, W, 3) RGB), process and record metrics
+        return mask_response(decode_and_build_response('mask', request.FILES['image'], params))
+        
+    except BadRequestError as e:
+        return _bad_request_response(e)
+    except UnknownFlatFieldError as e:
+        return _unknown_flat_field_response(e)
+    except Exception as e:
+        return _error_response(e)
+
+
+async def tissue_mask_async_view(request):
+    """
+    POST /api/v1/tissue/mask/async/
+    
+    Same request and response as `tissue_mask_view`, for ASGI servers.
+    The upload is received without blocking the event loop, and decoding
+    plus the pipeline run on a bounded executor. When the estimated pixel
+    cost of queued work exceeds PIPELINE_MAX_PENDING_PIXELS the request is
+    rejected with 429 and a Retry-After header.
+    """
+    if request.method != 'POST':
+        return JsonResponse(
+            {"success": False, "error": "Method not allowed"},
+            status=status.HTTP_405_METHOD_NOT_ALLOWED
+        )
+    
+    try:
+        # Multipart parsing may touch a spooled temp file: keep it off the loop
+        files, form = await sync_to_async(lambda: (request.FILES, request.POST))()
+        if 'image' not in files:
+            return JsonResponse(
+                {"success": False, "error": "No image file provided"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        image_file = files['image']
+        params = parse_mask_params(form)
+        cost_pixels = await sync_to_async(upload_pixel_cost)(image_file, params)
+        
+        response_data = await get_executor().run(
+            decode_and_build_response, cost_pixels, 'mask_async', image_file, params
         )
+        return mask_response(response_data)
+        
+    except QueueFullError as e:
+        response = JsonResponse(
+            {"success": False, "error": str(e), "retry_after": e.retry_after},
+            status=status.HTTP_429_TOO_MANY_REQUESTS
+        )
+        response['Retry-After'] = str(e.retry_after)
+        return response
+    except BadRequestError as e:
+        return _bad_request_response(e)
+    except UnknownFlatFieldError as e:
+        return _unknown_flat_field_response(e)
+    except Exception as e:
+        return _error_response(e)
+
+
+# Django 3.2's csrf_exempt wraps async views in a sync function
+tissue_mask_async_view.csrf_exempt = True
+
+
+@api_view(['POST'])
+@csrf_exempt
+def tissue_mask_roi_view(request):
+    """
+    POST /api/v1/tissue/mask/roi/
+    
+    Re-mask a region of a cached result (see `cache_result`) with changed
+    parameters. Only the ROI plus a halo is recomputed, reusing the image's
+    stain vectors and threshold; the new ROI mask is spliced into the
+    cached mask so successive edits accumulate.
+    
+    Request (form data):
+    - result_id: str - From a mask request with cache_result=true
+    - roi: str - "x,y,width,height" in image pixels
+    - threshold: float (optional) - Override the image's threshold
+    - min_area: int (optional) - Minimum component area (default: as cached)
+    - kernel_size: int (optional) - Smoothing kernel size (default: as cached)
+    - halo: int (default: 32) - Context pixels around the ROI (>= 0)
+    - return_full_mask: bool (default: false) - Also return the full mask
+    
+    Response (JSON):
+    {
+        "success": true,
+        "result_id": "...",
+        "roi": [x, y, width, height],  # Clipped to the image
+        "roi_mask_png_base64": "...",
+        "metrics": {"tissue_area_fraction": 0.41},
+        "mask_png_base64": "..."  # Optional, if return_full_mask=true
+    }
+    """
+    try:
+        data = request.POST
+        result_id = data.get('result_id')
+        entry = get_result_store().get(result_id) if result_id else None
+        if entry is None:
+            return JsonResponse(
+                {"success": False, "error": "Unknown or expired result_id"},
+                status=status.HTTP_404_NOT_FOUND
+            )
         
-        # 4. Process image
-        result = pipeline.process(image_array)
+        try:
+            roi = tuple(int(v) for v in data.get('roi', '').split(','))
+            if len(roi) != 4:
+                raise ValueError
+        except ValueError:
+            return JsonResponse(
+                {"success": False, "error": "roi must be 'x,y,width,height'"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        # 5. Compute metrics
-        metrics = compute_qc_metrics(image_array, result['mask'], result.get('od_image'))
+        cached_params = entry.params
+        pipeline = TissueMaskingPipeline(
+            normalize=cached_params['normalize'],
+            stain_method=cached_params['stain_method'],
+            threshold_method=cached_params['threshold_method'],
+            min_area=_optional_number(data, 'min_area', int, default=cached_params['min_area']),
+            kernel_size=_optional_number(data, 'kernel_size', int, default=cached_params['kernel_size'])
+        )
+        halo = _optional_number(data, 'halo', int, default=32)
+        if halo < 0:
+            raise BadRequestError("halo must not be negative")
         
-        # 6. Prepare response
-        mask_png_base64 = encode_mask_png(result['mask'])
+        with entry.lock():
+            roi_mask, roi = pipeline.remask_roi(
+                entry.image, roi, entry.slide_parameters,
+                threshold=_optional_number(data, 'threshold', float),
+                halo=halo
+            )
+            mask = entry.mask
+            entry.tissue_pixels += splice_roi(mask, roi_mask, roi)
+            tissue_area_fraction = entry.tissue_pixels / mask.size
+            full_mask_png = None
+            if data.get('return_full_mask', 'false').lower() == 'true':
+                full_mask_png = encode_mask_png(mask)
         
         response_data = {
             "success": True,
-            "mask_png_base64": mask_png_base64,
-            "metrics": metrics
+            "result_id": result_id,
+            "roi": list(roi),
+            "roi_mask_png_base64": encode_mask_png(roi_mask),
+            "metrics": {"tissue_area_fraction": tissue_area_fraction},
         }
-        
-        # Optional: Add normalized RGB if requested
-        if normalize and 'normalized_rgb' in result:
-            normalized_png_base64 = encode_image_png(result['normalized_rgb'])
-            response_data["normalized_rgb_png_base64"] = normalized_png_base64
-        
-        # Optional: Add overlay visualization
-        if return_overlay:
-            overlay = create_overlay(image_array, result['mask'])
-            overlay_png_base64 = encode_image_png(overlay)
-            response_data["overlay_png_base64"] = overlay_png_base64
-        
+        if full_mask_png is not None:
+            response_data["mask_png_base64"] = full_mask_png
         return JsonResponse(response_data)
-        
+    
+    except ValueError as e:
+        return JsonResponse(
+            {"success": False, "error": str(e)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
     except Exception as e:
-        import traceback
-        error_trace = traceback.format_exc()
+        return _error_response(e)
+
+
+@api_view(['GET'])
+def tissue_mask_file_view(request, file_id):
+    """
+    GET /api/v1/tissue/mask/files/<file_id>/
+    
+    Download a mask written with mask_output=tiff (streamed from disk).
+    Files expire MASK_FILE_TTL_SECONDS after they were written.
+    """
+    try:
+        mask_file = open(get_mask_file_store().path(file_id), 'rb')
+    except (KeyError, FileNotFoundError):
         return JsonResponse(
-            {"success": False, "error": str(e), "traceback": error_trace},
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            {"success": False, "error": f"No mask file {file_id!r} (unknown or expired)"},
+            status=status.HTTP_404_NOT_FOUND
         )
+    return FileResponse(
+        mask_file, content_type='image/tiff', as_attachment=True, filename=f"{file_id}_mask.tif"
+    )
+
+
+def batch_item_cost(item):
+    """Pixel cost of a batch item; unreadable headers fail later, in the job."""
+    _, _, image_file, params, error = item
+    if error is not None:
+        return 1
+    try:
+        return upload_pixel_cost(image_file, params)
+    except Exception:
+        return 1
+
+
+def process_batch_item(item):
+    """
+    Executor job for one batch image: never raises.
+    
+    Returns:
+        record: dict with the client's 'index' and 'filename' plus the
+            `build_mask_response` fields, or 'success': False and 'error'
+    """
+    index, filename, image_file, params, error = item
+    try:
+        if error is not None:
+            raise ValueError(error)
+        response_data = decode_and_build_response('batch', image_file, params)
+    except UnknownFlatFieldError as e:
+        response_data = {"success": False, "error": f"No flat field registered for scanner id {e.args[0]!r}"}
+    except Exception as e:
+        response_data = {"success": False, "error": str(e)}
+    return dict({"index": index, "filename": filename}, **response_data)
+
+
+def iter_batch_uploads(images, archives):
+    """
+    (filename, file, error) for each uploaded image, then for each image
+    entry of each archive, read from the archive one entry at a time.
+    """
+    for image_file in images:
+        yield image_file.name, image_file, None
+    for archive in archives:
+        for entry in iter_archive_images(archive, max_entry_bytes=settings.BATCH_MAX_ENTRY_BYTES):
+            yield entry.name, entry.file, entry.error
+
+
+def iter_batch_records(uploads, params):
+    """Batch records in completion order, with bounded in-flight work."""
+    items = (
+        (index, filename, image_file, params, error)
+        for index, (filename, image_file, error) in enumerate(uploads)
+    )
+    return iter_completed(
+        items, process_batch_item, batch_item_cost, get_executor(),
+        max_in_flight=settings.BATCH_MAX_IN_FLIGHT
+    )
+
+
+def ndjson_lines(records):
+    """
+    One JSON document per line for each record.
+    
+    A failure after streaming started (e.g. a truncated archive) ends the
+    stream with a record holding only 'success': False and 'error'.
+    """
+    try:
+        for record in records:
+            yield json.dumps(record) + '\n'
+    except Exception as e:
+        yield json.dumps({"success": False, "error": str(e)}) + '\n'
 
 
 @api_view(['POST'])
@@ -115,13 +856,84 @@ def tissue_mask_batch_view(request):
     """
     POST /api/v1/tissue/mask/batch/
     
-    Batch processing endpoint (for multiple images).
+    Mask several images with the same parameters.
+    
+    Request (multipart/form-data):
+    - images: JPG/PNG/TIFF files (repeat the field for each image)
+    - archive: zip or tar (.tar, .tar.gz, .tar.bz2, .tar.xz) of images;
+      entries are streamed out one at a time, never extracted to disk,
+      and numbered after the `images` files (filename = entry path)
+    - stream: bool (default: false) - Stream one NDJSON record per image as
+      it completes (application/x-ndjson), in completion order; WSGI only
+      (rejected with 400 under ASGI, where Django would run the blocking
+      stream on the event loop)
+    - Any `tissue_mask_view` parameter except response_format=png
+    
+    At most BATCH_MAX_IN_FLIGHT images are decoded or processed at a time,
+    on the shared pipeline executor; with stream=true finished records are
+    sent and released immediately.
+    
+    Record (one per image):
+    {
+        "index": 3,  # Position of the image in the request
+        "filename": "tile_3.png",
+        "success": true,
+        ...  # Same fields as the tissue_mask_view response
+    }
+    Failed images get {"index", "filename", "success": false, "error"}.
+    
+    Response (JSON, stream=false):
+    {
+        "success": true,  # All images succeeded
+        "count": 2,
+        "results": [{...}, {...}]  # Records in request order
+    }
     """
-    # TODO: Implement batch processing
-    return JsonResponse(
-        {"success": False, "error": "Batch processing not yet implemented"},
-        status=status.HTTP_501_NOT_IMPLEMENTED
-    )
+    try:
+        stream = request.POST.get('stream', 'false').lower() == 'true'
+        if stream and isinstance(request._request, ASGIRequest):
+            # Django runs a synchronous streaming body on the event loop,
+            # which would block the worker's async endpoint for the batch
+            return JsonResponse(
+                {"success": False, "error": "stream=true needs WSGI serving; omit it under ASGI"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        images = request.FILES.getlist('images')
+        archives = request.FILES.getlist('archive')
+        if not images and not archives:
+            return JsonResponse(
+                {"success": False, "error": "No image files or archive provided"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        for archive in archives:
+            if archive_format(archive) is None:
+                return JsonResponse(
+                    {"success": False, "error": f"{archive.name} is not a zip or tar archive"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        
+        params = parse_mask_params(request.POST)
+        if params['response_format'] != 'json':
+            return JsonResponse(
+                {"success": False, "error": "Batch records are JSON: use stream=true to stream them"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        records = iter_batch_records(iter_batch_uploads(images, archives), params)
+        
+        if stream:
+            return StreamingHttpResponse(ndjson_lines(records), content_type='application/x-ndjson')
+        
+        results = sorted(records, key=lambda record: record['index'])
+        return JsonResponse({
+            "success": all(record['success'] for record in results),
+            "count": len(results),
+            "results": results,
+        })
+        
+    except BadRequestError as e:
+        return _bad_request_response(e)
+    except Exception as e:
+        return _error_response(e)
 
 
 @api_view(['GET'])
@@ -131,9 +943,13 @@ def get_pipeline_status_view(request):
     
     Get pipeline status and configuration.
     """
+    recorder = get_recorder()
     return JsonResponse({
         "status": "operational",
         "pipeline_version": "1.0.0",
+        "executor": get_executor().stats(),
+        "metrics_recorder": recorder.stats() if recorder is not None else None,
+        "fast_paths": fast_path_counts(),
         "supported_stains": ["HE", "IHC", "PAP"],
         "supported_methods": {
             "stain_estimation": ["macenko", "none"],
@@ -2,6 +2,13 @@
 Tissue masking pipeline - scanner-agnostic, label-free processing.
 """
 
-from .pipeline import TissueMaskingPipeline
-
 __all__ = ['TissueMaskingPipeline']
+
+
+def __getattr__(name):
+    # Resolved lazily so `from pipeline import runtime` can set thread limits
+    # before numpy is imported
+    if name == 'TissueMaskingPipeline':
+        from .pipeline import TissueMaskingPipeline
+        return TissueMaskingPipeline
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,111 @@
+"""
+Image entries streamed out of zip and tar archives.
+
+Entries are read one at a time, straight from the archive stream into an
+in-memory file (the encoded image bytes only), and the next entry is not
+touched until the caller asks for it; nothing is extracted to disk. Tar
+archives (plain, gzip, bzip2, xz) are read strictly front to back; zip
+archives are read through their central directory, entry by entry.
+"""
+import io
+import posixpath
+import tarfile
+import time
+import zipfile
+from collections import namedtuple
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff')
+
+# file: seekable in-memory file, or None when `error` says why it was not read
+ArchiveEntry = namedtuple('ArchiveEntry', ['name', 'size', 'mtime', 'file', 'error'])
+
+_ZIP_MAGIC = (b'PK\x03\x04', b'PK\x05\x06')
+# gzip, bzip2, xz; tarfile detects the compression itself
+_COMPRESSED_MAGIC = (b'\x1f\x8b', b'BZh', b'\xfd7zXZ\x00')
+
+
+def archive_format(fileobj):
+    """
+    'zip', 'tar' or None, from the leading bytes (file position kept).
+
+    Compressed streams are reported as 'tar' without decompressing them.
+    """
+    position = fileobj.tell()
+    try:
+        header = fileobj.read(512)
+    finally:
+        fileobj.seek(position)
+    if header.startswith(_ZIP_MAGIC):
+        return 'zip'
+    if header.startswith(_COMPRESSED_MAGIC) or header[257:262] == b'ustar':
+        return 'tar'
+    return None
+
+
+def is_image_name(name, extensions=IMAGE_EXTENSIONS):
+    """Image entries only: no hidden files or macOS resource forks."""
+    if name.startswith('__MACOSX/') or posixpath.basename(name).startswith('.'):
+        return False
+    return posixpath.splitext(name)[1].lower() in extensions
+
+
+def iter_archive_images(fileobj, max_entry_bytes=None, extensions=IMAGE_EXTENSIONS):
+    """
+    Yield image entries of a zip or tar archive one at a time, in archive order.
+
+    Args:
+        fileobj: seekable binary file-like object
+        max_entry_bytes: int, entries larger than this are yielded with
+            an error instead of being read (None: no limit)
+        extensions: tuple of lower-case extensions to yield
+
+    Yields:
+        ArchiveEntry(name, size, mtime, file, error); `file` is an
+        in-memory file of the entry's bytes, named after the entry
+
+    Raises:
+        ValueError: if the file is not a zip or tar archive
+    """
+    kind = archive_format(fileobj)
+    if kind == 'zip':
+        entries = _iter_zip(fileobj, extensions)
+    elif kind == 'tar':
+        entries = _iter_tar(fileobj, extensions)
+    else:
+        raise ValueError("Not a zip or tar archive")
+
+    for name, size, mtime, open_entry in entries:
+        if max_entry_bytes is not None and size > max_entry_bytes:
+            yield ArchiveEntry(name, size, mtime, None,
+                               f"Entry is larger than {max_entry_bytes} bytes")
+            continue
+        with open_entry() as stream:
+            data = stream.read() if max_entry_bytes is None else stream.read(max_entry_bytes + 1)
+        if max_entry_bytes is not None and len(data) > max_entry_bytes:
+            # Declared size was wrong
+            yield ArchiveEntry(name, size, mtime, None,
+                               f"Entry is larger than {max_entry_bytes} bytes")
+            continue
+        entry_file = io.BytesIO(data)
+        entry_file.name = name
+        del data
+        yield ArchiveEntry(name, size, mtime, entry_file, None)
+
+
+def _iter_zip(fileobj, extensions):
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            if info.is_dir() or not is_image_name(info.filename, extensions):
+                continue
+            mtime = time.mktime(info.date_time + (0, 0, -1))
+            yield info.filename, info.file_size, mtime, lambda info=info: archive.open(info)
+
+
+def _iter_tar(fileobj, extensions):
+    # Stream mode: members are read in order, never seeking back
+    with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+        for member in archive:
+            if not member.isfile() or not is_image_name(member.name, extensions):
+                continue
+            yield member.name, member.size, member.mtime, \
+                lambda member=member: archive.extractfile(member)
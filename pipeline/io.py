@@ -2,7 +2,6 @@
 Image I/O utilities for decoding and encoding images.
 """
 import numpy as np
-import cv2
 from PIL import Image
 import base64
 import io
@@ -12,23 +11,71 @@ def decode_image(image_file):
     """
     Decode uploaded image file to numpy array.
     
+    In-memory uploads are decoded straight from their buffer and other
+    files are read once, so the decoded array is the only full-size
+    allocation. OpenCV decodes directly to RGB; formats it cannot read
+    fall back to PIL. EXIF orientation is ignored, as with PIL.
+    
     Args:
         image_file: Django UploadedFile or file-like object
     
     Returns:
         rgb_image: numpy array (H, W, 3) uint8 RGB [0-255]
     """
-    # Read image using PIL (handles various formats)
-    pil_image = Image.open(image_file)
+    raw = getattr(image_file, 'file', image_file)
+    if hasattr(raw, 'getbuffer'):
+        # In-memory upload: no copy of the encoded bytes
+        with raw.getbuffer() as view:
+            return _decode_bytes(view, raw.tell())
+    return _decode_bytes(image_file.read())
+
+
+def _decode_bytes(data, offset=0):
+    """Decode encoded image bytes (any buffer) from `offset` to RGB."""
+    import cv2
+    
+    # IMREAD_COLOR_RGB needs OpenCV 4.10; older versions decode to BGR
+    rgb_flag = getattr(cv2, 'IMREAD_COLOR_RGB', None)
+    encoded = np.frombuffer(data, dtype=np.uint8, offset=offset)
+    try:
+        rgb_array = cv2.imdecode(encoded, (cv2.IMREAD_COLOR if rgb_flag is None else rgb_flag)
+                                 | cv2.IMREAD_IGNORE_ORIENTATION)
+    finally:
+        # Release the view so the caller's buffer can be closed
+        del encoded
+    if rgb_array is not None:
+        if rgb_flag is None:
+            # The channel swap is symmetric, so this turns BGR into RGB
+            rgb_to_bgr_inplace(rgb_array)
+        return rgb_array
+    
+    # Read image using PIL (handles formats OpenCV does not)
+    pil_image = Image.open(io.BytesIO(bytes(data[offset:])))
     
     # Convert to RGB if needed
     if pil_image.mode != 'RGB':
         pil_image = pil_image.convert('RGB')
     
     # Convert to numpy array
-    rgb_array = np.array(pil_image)
+    return np.array(pil_image)
+
+
+def probe_image_size(image_file):
+    """
+    Read image dimensions from the file header without decoding pixels.
     
-    return rgb_array
+    Args:
+        image_file: Django UploadedFile or file-like object
+    
+    Returns:
+        (width, height): tuple of ints
+    """
+    position = image_file.tell()
+    try:
+        with Image.open(image_file) as pil_image:
+            return pil_image.size
+    finally:
+        image_file.seek(position)
 
 
 def encode_mask_png(mask):
@@ -41,18 +88,7 @@ def encode_mask_png(mask):
     Returns:
         base64_string: Base64 encoded PNG
     """
-    # Ensure mask is uint8
-    mask_uint8 = mask.astype(np.uint8)
-    
-    # Encode as PNG
-    success, buffer = cv2.imencode('.png', mask_uint8)
-    if not success:
-        raise ValueError("Failed to encode mask as PNG")
-    
-    # Convert to base64
-    base64_string = base64.b64encode(buffer).decode('utf-8')
-    
-    return base64_string
+    return base64.b64encode(encode_image(mask, image_format='png')).decode('ascii')
 
 
 def encode_image_png(image):
@@ -65,18 +101,90 @@ def encode_image_png(image):
     Returns:
         base64_string: Base64 encoded PNG
     """
-    # Ensure image is uint8
-    image_uint8 = image.astype(np.uint8)
+    return encode_image_base64(image, image_format='png')
+
+
+IMAGE_FORMATS = {'png': '.png', 'jpeg': '.jpg', 'webp': '.webp'}
+
+
+def rgb_to_bgr_inplace(image):
+    """
+    Swap an owned (H, W, 3) uint8 array from RGB to BGR order in place.
+    
+    Returns:
+        image: the same array, now BGR
+    """
+    import cv2
+    
+    return cv2.cvtColor(image, cv2.COLOR_RGB2BGR, dst=image)
+
+
+def encode_image(image, image_format='png', quality=90, channel_order='rgb'):
+    """
+    Encode an image without copying it into another array.
+    
+    OpenCV encoders take BGR: callers that own a 3-channel image can swap
+    it in place with `rgb_to_bgr_inplace` and pass channel_order='bgr';
+    'rgb' input costs one converted copy.
+    
+    Args:
+        image: numpy array (H, W, 3) uint8 or (H, W) uint8
+        image_format: 'png', 'jpeg' or 'webp'
+        quality: int 1-100, for JPEG and WebP
+        channel_order: 'rgb' or 'bgr', order of a 3-channel image
+    
+    Returns:
+        encoded: 1-D uint8 array of the file bytes (a buffer, usable with
+            base64, file writes and HTTP responses without conversion)
+    """
+    import cv2
+    
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unsupported image format: {image_format}")
+    
+    # No copy for arrays that are already uint8
+    image_uint8 = image.astype(np.uint8, copy=False)
+    
+    if image_uint8.ndim == 3 and channel_order == 'rgb':
+        image_uint8 = cv2.cvtColor(image_uint8, cv2.COLOR_RGB2BGR)
     
-    # Convert RGB to BGR for OpenCV
-    image_bgr = cv2.cvtColor(image_uint8, cv2.COLOR_RGB2BGR)
+    params = []
+    if image_format == 'jpeg':
+        params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    elif image_format == 'webp':
+        params = [cv2.IMWRITE_WEBP_QUALITY, int(quality)]
     
-    # Encode as PNG
-    success, buffer = cv2.imencode('.png', image_bgr)
+    success, buffer = cv2.imencode(IMAGE_FORMATS[image_format], image_uint8, params)
     if not success:
-        raise ValueError("Failed to encode image as PNG")
+        raise ValueError(f"Failed to encode image as {image_format}")
+    return buffer.reshape(-1)
+
+
+def encode_image_base64(image, image_format='png', quality=90, channel_order='rgb'):
+    """
+    Encode an RGB or grayscale image as a base64 string.
     
-    # Convert to base64
-    base64_string = base64.b64encode(buffer).decode('utf-8')
+    Args:
+        image: numpy array (H, W, 3) uint8 RGB or (H, W) uint8
+        image_format: 'png', 'jpeg' or 'webp'
+        quality: int 1-100, for JPEG and WebP
+        channel_order: 'rgb' or 'bgr' (see `encode_image`)
+    
+    Returns:
+        base64_string: Base64 encoded image
+    """
+    encoded = encode_image(image, image_format=image_format, quality=quality, channel_order=channel_order)
+    return base64.b64encode(encoded).decode('ascii')
+
+
+def iter_buffer_chunks(buffer, chunk_size=64 * 1024):
+    """
+    Yield consecutive memoryview slices of a buffer (for streaming responses).
     
-    return base64_string
+    Args:
+        buffer: bytes-like object, e.g. from `encode_image`
+        chunk_size: int, bytes per chunk
+    """
+    view = memoryview(buffer).cast('B')
+    for start in range(0, len(view), chunk_size):
+        yield view[start:start + chunk_size]
@@ -0,0 +1,210 @@
+"""
+Masks written to disk as tiled, compressed (optionally pyramidal) TIFFs.
+
+The API and batch script write the pipeline's in-memory mask: the writer
+takes it as a row-major stream of tile views (`iter_mask_tiles`),
+compressing and writing each one as it arrives, so no PNG or base64 copy
+of the mask is made. Pyramid levels are 2x area downsamples re-binarized
+at 50% coverage, as for mask thumbnails; only the first reduced level (a
+quarter of the mask) is accumulated while the full-resolution tiles
+stream through.
+
+`MaskFileStore` keeps written masks in a result directory under random
+ids and removes them after a TTL.
+
+Requires `tifffile` (and `imagecodecs` for packbits).
+"""
+import math
+import os
+import re
+import time
+import uuid
+
+import numpy as np
+
+# Request names → tifffile compression
+MASK_TIFF_COMPRESSIONS = {'deflate': 'zlib', 'packbits': 'packbits', 'none': None}
+
+_FILE_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+def iter_mask_tiles(mask, tile_size):
+    """
+    Row-major tiles of an in-memory mask (views, no copies).
+
+    Edge tiles are smaller than `tile_size`; the writer pads them.
+    """
+    height, width = mask.shape[:2]
+    for top in range(0, height, tile_size):
+        for left in range(0, width, tile_size):
+            yield mask[top:top + tile_size, left:left + tile_size]
+
+
+def halve_mask(mask):
+    """
+    2x area downsample of a 0/255 mask, re-binarized at 50% coverage.
+
+    Args:
+        mask: (H, W) uint8
+
+    Returns:
+        (ceil(H / 2), ceil(W / 2)) uint8, 0 or 255
+    """
+    import cv2
+
+    height, width = mask.shape
+    half = cv2.resize(mask, (math.ceil(width / 2), math.ceil(height / 2)), interpolation=cv2.INTER_AREA)
+    cv2.threshold(half, 127, 255, cv2.THRESH_BINARY, dst=half)
+    return half
+
+
+def pyramid_shapes(shape, tile_size):
+    """(H, W) of every level: halved until the level fits in one tile."""
+    shapes = [tuple(shape[:2])]
+    while max(shapes[-1]) > tile_size:
+        height, width = shapes[-1]
+        shapes.append((math.ceil(height / 2), math.ceil(width / 2)))
+    return shapes
+
+
+def write_mask_tiff(target, tiles, shape, tile_size=512, compression='deflate', pyramid=False):
+    """
+    Write a mask tile by tile as a tiled TIFF.
+
+    Args:
+        target: path or writable binary file-like object
+        tiles: iterable of (h, w) uint8 tiles in row-major order, each
+            `tile_size` square except at the right and bottom edges
+            (e.g. `iter_mask_tiles`)
+        shape: (H, W) of the full mask
+        tile_size: int, TIFF tile width/height (multiple of 16)
+        compression: 'deflate', 'packbits' or 'none'
+        pyramid: bool, add 2x reduced levels as SubIFDs down to one tile
+
+    Returns:
+        info: dict with 'width', 'height', 'tile_size', 'compression' and
+            'levels' ([width, height] per level, full resolution first)
+    """
+    import tifffile
+
+    if compression not in MASK_TIFF_COMPRESSIONS:
+        raise ValueError(f"compression must be one of {list(MASK_TIFF_COMPRESSIONS)}")
+    if tile_size <= 0 or tile_size % 16:
+        raise ValueError("tile_size must be a positive multiple of 16")
+
+    height, width = shape[:2]
+    shapes = pyramid_shapes((height, width), tile_size) if pyramid else [(height, width)]
+    options = {
+        'tile': (tile_size, tile_size),
+        'compression': MASK_TIFF_COMPRESSIONS[compression],
+        'photometric': 'minisblack',
+    }
+
+    reduced = None
+    if len(shapes) > 1:
+        reduced = np.empty(shapes[1], dtype=np.uint8)
+        tiles = _collect_reduced(tiles, width, tile_size, reduced)
+
+    with tifffile.TiffWriter(target, bigtiff=height * width > 2 ** 31) as tif:
+        tif.write(tiles, shape=(height, width), dtype=np.uint8, subifds=len(shapes) - 1, **options)
+        level = reduced
+        for _ in shapes[1:]:
+            tif.write(level, subfiletype=1, **options)
+            if max(level.shape) > tile_size:
+                level = halve_mask(level)
+
+    return {
+        'width': width,
+        'height': height,
+        'tile_size': tile_size,
+        'compression': compression,
+        'levels': [[level_width, level_height] for level_height, level_width in shapes],
+    }
+
+
+def _collect_reduced(tiles, width, tile_size, reduced):
+    """Pass tiles through, filling `reduced` with their halved copies."""
+    tiles_across = math.ceil(width / tile_size)
+    half_tile = tile_size // 2
+    for index, tile in enumerate(tiles):
+        row, col = divmod(index, tiles_across)
+        half = halve_mask(np.asarray(tile, dtype=np.uint8))
+        top, left = row * half_tile, col * half_tile
+        reduced[top:top + half.shape[0], left:left + half.shape[1]] = half
+        yield tile
+
+
+class MaskFileStore:
+    """
+    Directory of mask TIFFs addressed by random file ids.
+
+    Files are written under a temporary name and renamed when complete,
+    so readers never see partial files. Files older than `ttl_seconds`
+    are removed whenever a new one is written.
+    """
+
+    def __init__(self, directory, ttl_seconds=3600):
+        """
+        Args:
+            directory: str, result directory (created on first write)
+            ttl_seconds: float, age after which files are removed
+        """
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+
+    def path(self, file_id):
+        """
+        Path of a stored mask.
+
+        Raises:
+            KeyError: if the id is malformed or the file does not exist
+                (never written, or expired)
+        """
+        if not _FILE_ID.match(file_id or ''):
+            raise KeyError(file_id)
+        path = os.path.join(self.directory, file_id + '.tif')
+        if not os.path.isfile(path):
+            raise KeyError(file_id)
+        return path
+
+    def write(self, tiles, shape, **options):
+        """
+        Write a mask (see `write_mask_tiff` for tiles and options).
+
+        Returns:
+            info: `write_mask_tiff` info plus 'file_id' and 'bytes'
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.prune()
+        file_id = uuid.uuid4().hex
+        path = os.path.join(self.directory, file_id + '.tif')
+        tmp_path = path + '.partial'
+        try:
+            info = write_mask_tiff(tmp_path, tiles, shape, **options)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        info['file_id'] = file_id
+        info['bytes'] = os.path.getsize(path)
+        return info
+
+    def prune(self):
+        """Remove expired files (and partial files left by crashed writers)."""
+        cutoff = time.time() - self.ttl_seconds
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return 0
+        removed = 0
+        for entry in entries:
+            if not entry.name.endswith(('.tif', '.tif.partial')):
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
@@ -28,6 +28,62 @@ def compute_qc_metrics(rgb_image, mask, od_image=None):
     else:
         mean_total_od = None
     
+    # Check for saturation
+    saturated_pixels = np.sum(np.any(rgb_image >= 250, axis=2))
+    
+    return _qc_metrics(tissue_area_fraction, mean_total_od, saturated_pixels / rgb_image.size)
+
+
+def compute_qc_metrics_batch(rgb_batch, masks, od_batch=None):
+    """
+    `compute_qc_metrics` for a stack of same-shaped images.
+    
+    Args:
+        rgb_batch: (N, H, W, 3) uint8 RGB images
+        masks: (N, H, W) uint8 binary masks
+        od_batch: (N, H, W, 3) float32 OD images (optional)
+    
+    Returns:
+        metrics: list of N metrics dicts
+    """
+    tissue = masks.reshape(len(masks), -1) > 0
+    tissue_pixels = np.count_nonzero(tissue, axis=1)
+    tissue_area_fraction = tissue_pixels / tissue.shape[1]
+    
+    mean_total_od = [None] * len(masks)
+    if od_batch is not None:
+        pixels = od_batch.reshape(len(od_batch), -1, 3)
+        total_od = pixels[..., 0] + pixels[..., 1] + pixels[..., 2]
+        # Masked sums as one batched matrix-vector product
+        tissue_od = np.matmul(total_od[:, np.newaxis, :], tissue[:, :, np.newaxis].astype(total_od.dtype))
+        mean_total_od = [
+            float(od_sum / count) if count else 0.0
+            for od_sum, count in zip(tissue_od[:, 0, 0], tissue_pixels)
+        ]
+    
+    # Channel max via slices: reducing over a length-3 axis is slow
+    rgb_pixels = rgb_batch.reshape(len(rgb_batch), -1, 3)
+    saturated = np.maximum(np.maximum(rgb_pixels[..., 0], rgb_pixels[..., 1]), rgb_pixels[..., 2]) >= 250
+    saturated_fraction = np.count_nonzero(saturated, axis=1) / (saturated.shape[1] * 3)
+    
+    return [
+        _qc_metrics(tissue_area_fraction[i], mean_total_od[i], saturated_fraction[i])
+        for i in range(len(masks))
+    ]
+
+
+def _qc_metrics(tissue_area_fraction, mean_total_od, saturated_fraction):
+    """
+    Metrics dict and QC flags from the raw measurements.
+    
+    Args:
+        tissue_area_fraction: float
+        mean_total_od: float, or None without an OD image
+        saturated_fraction: float, saturated pixels per RGB value
+    
+    Returns:
+        metrics: dict with QC flags and statistics
+    """
     # QC flags
     qc_flags = []
     
@@ -37,9 +93,7 @@ def compute_qc_metrics(rgb_image, mask, od_image=None):
     if mean_total_od is not None and mean_total_od < 0.1:
         qc_flags.append("LOW_OD_POOR_STAINING")
     
-    # Check for saturation
-    saturated_pixels = np.sum(np.any(rgb_image >= 250, axis=2))
-    if saturated_pixels / rgb_image.size > 0.1:
+    if saturated_fraction > 0.1:
         qc_flags.append("SATURATION_DETECTED")
     
     metrics = {
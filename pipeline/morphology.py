@@ -2,8 +2,6 @@
 Morphological cleanup operations for binary masks.
 """
 import numpy as np
-import cv2
-from scipy import ndimage
 
 
 def morphological_cleanup(mask, min_area=100, kernel_size=3):
@@ -17,12 +15,16 @@ def morphological_cleanup(mask, min_area=100, kernel_size=3):
     
     Args:
         mask: (H, W) uint8 binary mask, 0=background, 255=tissue
-        min_area: minimum area for connected components
-        kernel_size: size of morphological kernel
+        min_area: minimum area for connected components (0 keeps all)
+        kernel_size: size of morphological kernel (0 skips smoothing)
     
     Returns:
         cleaned_mask: (H, W) uint8 cleaned binary mask
     """
+    # Imported lazily to keep `import pipeline` cheap
+    import cv2
+    from scipy import ndimage
+    
     # Step 1: Remove small connected components
     num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
     
@@ -36,6 +38,9 @@ def morphological_cleanup(mask, min_area=100, kernel_size=3):
     # Step 2: Fill holes
     cleaned_mask = ndimage.binary_fill_holes(cleaned_mask).astype(np.uint8) * 255
     
+    if kernel_size == 0:
+        return cleaned_mask
+    
     # Step 3: Morphological operations to smooth
     kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
     
@@ -5,45 +5,232 @@ Normalizes stain concentrations to match reference distribution.
 import numpy as np
 import json
 import os
-from django.conf import settings
+import sys
+import warnings
 
+# Used when the pipeline runs outside Django (scripts, CLI)
+DEFAULT_REFERENCE_PROFILES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'configs', 'reference_stain_profiles'
+)
 
-def normalize_stain_concentrations(concentrations, reference_stats):
+# Profile format: 2 = tissue-only statistics, matching how images are measured.
+# Profiles without 'profile_version' hold whole-image statistics.
+REFERENCE_PROFILE_VERSION = 2
+
+
+def concentration_statistics(concentrations):
     """
-    Normalize concentrations to match reference distribution.
+    Per-stain mean and std of a concentration map.
     
-    Uses histogram matching: (x - μ_current) * (σ_ref / σ_current) + μ_ref
+    Args:
+        concentrations: (H, W, 2) concentration maps
+    
+    Returns:
+        stats: dict with 'stain_{i}_mean' and 'stain_{i}_std', the same
+            keys as a reference profile
+    """
+    stats = {}
+    for i in range(2):
+        stats[f'stain_{i}_mean'] = float(np.mean(concentrations[:, :, i]))
+        stats[f'stain_{i}_std'] = float(np.std(concentrations[:, :, i]))
+    return stats
+
+
+def sample_tissue_concentrations(concentrations, od_image, beta=0.15, max_samples=100_000):
+    """
+    Strided subsample of the concentrations of tissue pixels.
+    
+    Background glass would otherwise dominate the statistics and pull every
+    image's mean towards zero; a regular subsample of a few hundred thousand
+    pixels estimates mean and std as well as the full image does.
     
     Args:
         concentrations: (H, W, 2) concentration maps
-        reference_stats: dict with 'mean' and 'std' for each stain
+        od_image: (H, W, 3) OD image used to find tissue (total OD > beta)
+        beta: float, total OD threshold for tissue
+        max_samples: int, approximate number of pixels to sample
     
     Returns:
-        normalized_concentrations: (H, W, 2)
+        samples: (N, 2) concentrations of sampled tissue pixels (all
+            sampled pixels if fewer than 100 are tissue)
+    """
+    height, width = concentrations.shape[:2]
+    stride = max(1, int(np.sqrt(height * width / max_samples)))
+    sampled = concentrations[::stride, ::stride].reshape(-1, 2)
+    sampled_od = od_image[::stride, ::stride]
+    tissue = (sampled_od[..., 0] + sampled_od[..., 1] + sampled_od[..., 2]).reshape(-1) > beta
+    if np.count_nonzero(tissue) < 100:
+        return sampled
+    return sampled[tissue]
+
+
+def tissue_concentration_statistics(concentrations, od_image, beta=0.15, max_samples=100_000,
+                                    weights=None):
     """
-    normalized = np.zeros_like(concentrations)
+    Per-stain mean and std over a tissue-only subsample.
     
-    for i in range(2):  # For each stain
-        conc_channel = concentrations[:, :, i]
-        
-        # Current statistics
-        current_mean = np.mean(conc_channel)
-        current_std = np.std(conc_channel)
-        
-        # Reference statistics
+    Args:
+        concentrations: (H, W, 2) concentration maps
+        od_image: (H, W, 3) OD image
+        beta: float, total OD threshold for tissue
+        max_samples: int, approximate number of pixels to sample
+        weights: optional (H, W) pixel weights (per-color tables, see
+            pipeline.lut); all tissue entries are used, weighted, instead
+            of a subsample
+    
+    Returns:
+        stats: dict with 'stain_{i}_mean' and 'stain_{i}_std'
+    """
+    if weights is None:
+        samples = sample_tissue_concentrations(concentrations, od_image, beta, max_samples)
+        return concentration_statistics(samples[:, np.newaxis, :])
+    
+    values = concentrations.reshape(-1, 2).astype(np.float64)
+    weights = weights.reshape(-1).astype(np.float64)
+    tissue = od_image.reshape(-1, 3).sum(axis=1) > beta
+    if weights[tissue].sum() >= 100:
+        values, weights = values[tissue], weights[tissue]
+    
+    mean = np.average(values, axis=0, weights=weights)
+    std = np.sqrt(np.average(np.square(values - mean), axis=0, weights=weights))
+    stats = {}
+    for i in range(2):
+        stats[f'stain_{i}_mean'] = float(mean[i])
+        stats[f'stain_{i}_std'] = float(std[i])
+    return stats
+
+
+def normalization_affine(reference_stats, current_stats):
+    """
+    Per-stain scale and offset of the normalization transform.
+    
+    (x - μ_current) * (σ_ref / σ_current) + μ_ref = x * scale + offset
+    
+    Args:
+        reference_stats: dict with 'stain_{i}_mean' / 'stain_{i}_std'
+        current_stats: dict with the same keys for the image or slide
+    
+    Returns:
+        scale: (2,) float32
+        offset: (2,) float32
+    """
+    scale = np.ones(2, dtype=np.float32)
+    offset = np.zeros(2, dtype=np.float32)
+    for i in range(2):
+        current_mean = current_stats[f'stain_{i}_mean']
+        current_std = current_stats[f'stain_{i}_std']
         ref_mean = reference_stats.get(f'stain_{i}_mean', current_mean)
         ref_std = reference_stats.get(f'stain_{i}_std', current_std)
         
-        # Normalize: (x - μ_current) * (σ_ref / σ_current) + μ_ref
+        # Leave flat channels unchanged
         if current_std > 1e-6:
-            normalized[:, :, i] = (conc_channel - current_mean) * (ref_std / current_std) + ref_mean
-        else:
-            normalized[:, :, i] = conc_channel
-        
-        # Clamp to non-negative
-        normalized[:, :, i] = np.maximum(normalized[:, :, i], 0)
+            scale[i] = ref_std / current_std
+            offset[i] = ref_mean - current_mean * scale[i]
+    return scale, offset
+
+
+def apply_normalization(concentrations, scale, offset, out=None):
+    """
+    Apply the normalization affine transform, clamped to non-negative.
     
-    return normalized
+    Args:
+        concentrations: (..., 2) concentration maps
+        scale, offset: (2,) from `normalization_affine`
+        out: optional output array (may be `concentrations` itself)
+    
+    Returns:
+        normalized: (..., 2)
+    """
+    out = np.multiply(concentrations, scale, out=out)
+    out += offset
+    np.maximum(out, 0, out=out)
+    return out
+
+
+def normalize_stain_concentrations(concentrations, reference_stats, current_stats=None):
+    """
+    Normalize concentrations to match reference distribution.
+    
+    Uses histogram matching: (x - μ_current) * (σ_ref / σ_current) + μ_ref
+    
+    Args:
+        concentrations: (H, W, 2) concentration maps
+        reference_stats: dict with 'mean' and 'std' for each stain
+        current_stats: optional dict from `concentration_statistics`; pass
+            slide-level statistics to normalize every tile the same way
+            (default: statistics of `concentrations`)
+    
+    Returns:
+        normalized_concentrations: (H, W, 2)
+    """
+    if current_stats is None:
+        current_stats = concentration_statistics(concentrations)
+    
+    scale, offset = normalization_affine(reference_stats, current_stats)
+    return apply_normalization(concentrations, scale.astype(concentrations.dtype),
+                               offset.astype(concentrations.dtype))
+
+
+# Rows per chunk in `concentrations_to_rgb`, sized so temporaries stay small
+RECONSTRUCTION_CHUNK_PIXELS = 1 << 16
+
+
+def concentrations_to_rgb(concentrations, stain_vectors, white_reference=255.0, out=None):
+    """
+    Reconstruct RGB from stain concentrations in one float32 pass.
+    
+    OD = C @ stain_vectors, I = I0 * 10^(-OD), evaluated chunk by chunk as
+    multiply-adds and a single exp so no full-size float64 intermediates
+    are created.
+    
+    Args:
+        concentrations: (H, W, 2) concentration maps
+        stain_vectors: (2, 3) stain vectors
+        white_reference: float or (3,) white reference
+        out: optional (H, W, 3) uint8 output array
+    
+    Returns:
+        rgb_image: (H, W, 3) uint8 RGB
+    """
+    height, width = concentrations.shape[:2]
+    if out is None:
+        out = np.empty((height, width, 3), dtype=np.uint8)
+    
+    # 10^(-OD) = exp(-ln(10) * OD): fold -ln(10) into the stain vectors
+    vectors = (np.asarray(stain_vectors, dtype=np.float64) * -np.log(10.0)).astype(np.float32)
+    white = np.asarray(white_reference, dtype=np.float32)
+    chunk_rows = max(1, RECONSTRUCTION_CHUNK_PIXELS // max(1, width))
+    
+    for start in range(0, height, chunk_rows):
+        c = concentrations[start:start + chunk_rows]
+        exponent = c[..., 0:1].astype(np.float32) * vectors[0]
+        exponent += c[..., 1:2] * vectors[1]
+        np.exp(exponent, out=exponent)
+        exponent *= white
+        np.clip(exponent, 0, 255, out=exponent)
+        out[start:start + chunk_rows] = exponent
+    
+    return out
+
+
+def reference_profiles_dir():
+    """
+    Directory holding the reference profile JSON files.
+    
+    Uses Django's REFERENCE_PROFILES_DIR setting when running inside the
+    service; Django is only imported if it is configured or already loaded.
+    
+    Returns:
+        path: str
+    """
+    if 'DJANGO_SETTINGS_MODULE' in os.environ or 'django.conf' in sys.modules:
+        try:
+            from django.conf import settings
+            return settings.REFERENCE_PROFILES_DIR
+        except Exception:
+            pass
+    return os.environ.get('REFERENCE_PROFILES_DIR', DEFAULT_REFERENCE_PROFILES_DIR)
 
 
 def load_reference_profile(stain_type):
@@ -54,22 +241,106 @@ def load_reference_profile(stain_type):
         stain_type: 'HE', 'IHC', or 'PAP'
     
     Returns:
-        reference_stats: dict with mean/std for each stain
+        reference_stats: dict with mean/std for each stain, or None if no
+            profile exists or it predates REFERENCE_PROFILE_VERSION (whole-image
+            statistics would shift tissue-only image statistics; a warning
+            asks to regenerate it)
     """
     try:
         profile_path = os.path.join(
-            settings.REFERENCE_PROFILES_DIR,
+            reference_profiles_dir(),
             f'{stain_type.lower()}_reference.json'
         )
         
         if os.path.exists(profile_path):
             with open(profile_path, 'r') as f:
-                return json.load(f)
+                profile = json.load(f)
         else:
             # Return None if no reference profile exists
             return None
     except Exception:
         return None
+    
+    if profile.get('profile_version', 1) != REFERENCE_PROFILE_VERSION:
+        warnings.warn(
+            f"Ignoring reference profile {profile_path}: format version "
+            f"{profile.get('profile_version', 1)}, expected {REFERENCE_PROFILE_VERSION} "
+            f"(tissue-only statistics); regenerate it with scripts/setup_reference_profiles.py",
+            RuntimeWarning
+        )
+        return None
+    return profile
+
+
+class RunningStats:
+    """
+    Mergeable per-channel mean and variance.
+    
+    Batches are folded in with Chan et al.'s parallel update of Welford's
+    algorithm, so statistics over any number of images need constant memory
+    and partial results from separate processes can be merged exactly.
+    """
+    
+    def __init__(self, channels=2):
+        self.count = 0
+        self.mean = np.zeros(channels, dtype=np.float64)
+        self.m2 = np.zeros(channels, dtype=np.float64)  # Sum of squared deviations
+    
+    def update(self, values):
+        """
+        Fold a batch of samples into the statistics.
+        
+        Args:
+            values: (..., C) array; all leading axes are treated as samples
+        """
+        values = values.reshape(-1, self.mean.shape[0])
+        if len(values) == 0:
+            return
+        batch_mean = values.mean(axis=0, dtype=np.float64)
+        batch_m2 = np.square(values - batch_mean).sum(axis=0)
+        self._combine(len(values), batch_mean, batch_m2)
+    
+    def merge(self, other):
+        """Fold another RunningStats into this one."""
+        if other.count:
+            self._combine(other.count, other.mean, other.m2)
+        return self
+    
+    def _combine(self, count_b, mean_b, m2_b):
+        count_a = self.count
+        total = count_a + count_b
+        delta = mean_b - self.mean
+        self.mean = self.mean + delta * (count_b / total)
+        self.m2 = self.m2 + m2_b + np.square(delta) * (count_a * count_b / total)
+        self.count = total
+    
+    @property
+    def std(self):
+        """Population standard deviation per channel."""
+        if self.count == 0:
+            return np.zeros_like(self.m2)
+        return np.sqrt(self.m2 / self.count)
+
+
+def reference_profile_from_stats(stats):
+    """
+    Reference statistics dict from accumulated concentration statistics.
+    
+    Args:
+        stats: RunningStats over (stain_0, stain_1) concentrations
+    
+    Returns:
+        reference_stats: dict with mean/std for each stain and the
+            'profile_version'
+    """
+    std = stats.std
+    return {
+        'profile_version': REFERENCE_PROFILE_VERSION,
+        'stain_0_mean': float(stats.mean[0]),
+        'stain_0_std': float(std[0]),
+        'stain_1_mean': float(stats.mean[1]),
+        'stain_1_std': float(std[1]),
+    }
 
 
 def generate_reference_profile(concentrations_list):
@@ -77,18 +348,13 @@ def generate_reference_profile(concentrations_list):
     Generate reference statistics from a set of "good" images.
     
     Args:
-        concentrations_list: list of (H, W, 2) concentration arrays
+        concentrations_list: iterable of (H, W, 2) concentration arrays;
+            consumed one at a time, so a generator keeps memory constant
     
     Returns:
         reference_stats: dict with mean/std for each stain
     """
-    all_concentrations = np.concatenate([c.reshape(-1, 2) for c in concentrations_list], axis=0)
-    
-    reference_stats = {
-        'stain_0_mean': float(np.mean(all_concentrations[:, 0])),
-        'stain_0_std': float(np.std(all_concentrations[:, 0])),
-        'stain_1_mean': float(np.mean(all_concentrations[:, 1])),
-        'stain_1_std': float(np.std(all_concentrations[:, 1])),
-    }
-    
-    return reference_stats
+    stats = RunningStats(channels=2)
+    for concentrations in concentrations_list:
+        stats.update(concentrations)
+    return reference_profile_from_stats(stats)
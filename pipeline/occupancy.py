@@ -0,0 +1,91 @@
+"""
+Tile-occupancy grids: the tissue fraction of every tile of a mask.
+
+One summed-area table of the mask gives each tile's tissue pixel count
+with four lookups, so the whole grid costs O(pixels) however many tiles
+overlap. Grids are serialized row-major as uint8 (fraction * 255) or
+float32 for clients selecting patches.
+"""
+import numpy as np
+
+OCCUPANCY_DTYPES = ('uint8', 'float32')
+
+
+def tile_origins(length, tile_size, stride):
+    """
+    Start offsets of the complete tiles along one axis.
+
+    Args:
+        length: int, image size along the axis
+        tile_size: int, tile size in pixels
+        stride: int, offset between tile starts
+
+    Returns:
+        origins: (n,) int64; empty if the image is smaller than a tile
+    """
+    if tile_size <= 0 or stride <= 0:
+        raise ValueError("tile_size and stride must be positive")
+    if length < tile_size:
+        return np.zeros(0, dtype=np.int64)
+    return np.arange(0, length - tile_size + 1, stride, dtype=np.int64)
+
+
+def tile_occupancy(mask, tile_size, stride=None):
+    """
+    Tissue fraction of every complete tile.
+
+    Args:
+        mask: (H, W) uint8 mask, nonzero=tissue
+        tile_size: int, tile size in pixels
+        stride: int, offset between tiles (default: tile_size)
+
+    Returns:
+        occupancy: (rows, cols) float32 in [0, 1]; entry (i, j) covers
+            mask[i * stride:i * stride + tile_size, j * stride:j * stride + tile_size]
+    """
+    import cv2
+
+    stride = stride or tile_size
+    rows = tile_origins(mask.shape[0], tile_size, stride)
+    cols = tile_origins(mask.shape[1], tile_size, stride)
+    if len(rows) == 0 or len(cols) == 0:
+        return np.zeros((len(rows), len(cols)), dtype=np.float32)
+
+    binary = cv2.threshold(np.ascontiguousarray(mask, dtype=np.uint8), 0, 1, cv2.THRESH_BINARY)[1]
+    # int32 sums are exact below 2^31 pixels
+    depth = cv2.CV_32S if mask.size < 2 ** 31 else cv2.CV_64F
+    table = cv2.integral(binary, sdepth=depth)
+
+    top, bottom = rows[:, np.newaxis], rows[:, np.newaxis] + tile_size
+    left, right = cols[np.newaxis, :], cols[np.newaxis, :] + tile_size
+    counts = (table[bottom, right] - table[top, right]
+              - table[bottom, left] + table[top, left])
+    return (counts / float(tile_size * tile_size)).astype(np.float32)
+
+
+def encode_occupancy(occupancy, dtype='uint8'):
+    """
+    Serialize an occupancy grid to row-major bytes.
+
+    Args:
+        occupancy: (rows, cols) float fractions
+        dtype: 'uint8' (round(fraction * 255)) or 'float32' (exact,
+            little-endian)
+
+    Returns:
+        data: bytes
+    """
+    if dtype == 'uint8':
+        return np.rint(occupancy * 255.0).astype(np.uint8).tobytes()
+    if dtype == 'float32':
+        return occupancy.astype('<f4').tobytes()
+    raise ValueError(f"dtype must be one of {OCCUPANCY_DTYPES}")
+
+
+def decode_occupancy(data, shape, dtype='uint8'):
+    """Inverse of `encode_occupancy`: (rows, cols) float32 fractions."""
+    if dtype == 'uint8':
+        return np.frombuffer(data, dtype=np.uint8).reshape(shape).astype(np.float32) / 255.0
+    if dtype == 'float32':
+        return np.frombuffer(data, dtype='<f4').reshape(shape).astype(np.float32)
+    raise ValueError(f"dtype must be one of {OCCUPANCY_DTYPES}")
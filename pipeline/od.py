@@ -5,6 +5,26 @@ Converts RGB intensity to absorbance space.
 import numpy as np
 
 
+def od_lut(white_reference=255.0, epsilon=1.0):
+    """
+    OD of every uint8 intensity, per channel.
+    
+    Computed with the same float32 operations as the direct formula, so
+    looking values up is bit-identical to evaluating it.
+    
+    Args:
+        white_reference: float or (3,) per-channel white reference
+        epsilon: small value to prevent log(0)
+    
+    Returns:
+        lut: (256, 3) float32, lut[v, c] = OD of intensity v in channel c
+    """
+    white = np.broadcast_to(np.asarray(white_reference, dtype=np.float32), (3,))
+    intensities = np.arange(256, dtype=np.float32)[:, np.newaxis]
+    normalized = np.clip((intensities + epsilon) / (white + epsilon), 1e-6, 1.0)
+    return -np.log10(normalized)
+
+
 def rgb_to_od(rgb_image, white_reference=255.0, epsilon=1.0):
     """
     Convert RGB to Optical Density space.
@@ -16,14 +36,26 @@ def rgb_to_od(rgb_image, white_reference=255.0, epsilon=1.0):
     - Tissue pixels > 0 OD
     - Robust to illumination, exposure, and gain changes
     
+    uint8 images are converted through a per-channel 256-entry table (see
+    `od_lut`), so a per-channel white reference costs nothing extra.
+    
     Args:
-        rgb_image: numpy array (H, W, 3) uint8 [0-255]
+        rgb_image: numpy array (..., 3) uint8 [0-255]
         white_reference: float, typically 255.0 or estimated per-channel
         epsilon: small value to prevent log(0)
     
     Returns:
-        od_image: numpy array (H, W, 3) float32, OD values
+        od_image: numpy array (..., 3) float32, OD values
     """
+    if rgb_image.dtype == np.uint8 and rgb_image.ndim >= 2 and rgb_image.shape[-1] == 3 and rgb_image.size:
+        import cv2
+        
+        lut = od_lut(white_reference, epsilon).reshape(1, 256, 3)
+        # cv2 takes (rows, cols, 3): fold leading axes into rows
+        cols = rgb_image.shape[-2] if rgb_image.ndim >= 3 else 1
+        od_image = cv2.LUT(rgb_image.reshape(-1, cols, 3), lut)
+        return od_image.reshape(rgb_image.shape)
+    
     # Normalize to [0, 1]
     rgb_normalized = (rgb_image.astype(np.float32) + epsilon) / (white_reference + epsilon)
     
@@ -36,31 +68,64 @@ def rgb_to_od(rgb_image, white_reference=255.0, epsilon=1.0):
     return od_image
 
 
-def estimate_white_reference(rgb_image, percentile=99.5):
+def channel_histograms(rgb_image):
+    """
+    Per-channel 256-bin intensity histograms.
+    
+    Args:
+        rgb_image: (..., 3) uint8 RGB
+    
+    Returns:
+        histograms: (3, 256) int64 pixel counts
+    """
+    import cv2
+    
+    pixels = np.ascontiguousarray(rgb_image).reshape(-1, 1, 3)
+    histograms = np.zeros((3, 256), dtype=np.int64)
+    # calcHist counts in float32: keep each chunk's bins exact (< 2^24)
+    chunk = 1 << 23
+    for start in range(0, len(pixels), chunk):
+        part = pixels[start:start + chunk]
+        for c in range(3):
+            histograms[c] += cv2.calcHist([part], [c], None, [256], [0, 256]).ravel().astype(np.int64)
+    return histograms
+
+
+def _histogram_percentile(histograms, percentile):
+    """Lowest intensity per row whose cumulative count reaches `percentile`."""
+    cumulative = np.cumsum(histograms, axis=1)
+    target = cumulative[:, -1:] * (percentile / 100.0)
+    return np.argmax(cumulative >= target, axis=1)
+
+
+def estimate_white_reference(rgb_image, percentile=99.5, histograms=None):
     """
     Estimate white reference from bright pixels (background glass).
     Uses high percentile to avoid outliers.
     
+    Per channel, pixels at or above the `percentile` intensity are taken
+    as background and the white reference is their 99.9th percentile.
+    Both percentiles are read off 256-bin histograms instead of sorting
+    pixels.
+    
     Args:
         rgb_image: (H, W, 3) uint8 RGB
         percentile: percentile to use for estimation
+        histograms: optional (3, 256) counts from `channel_histograms`
     
     Returns:
         white_ref: (3,) float32 array, per-channel white reference
     """
-    # Flatten image
-    pixels = rgb_image.reshape(-1, 3)
+    if histograms is None:
+        histograms = channel_histograms(rgb_image)
+    if histograms[0].sum() == 0:
+        return np.full(3, 255.0, dtype=np.float32)
     
     # Get bright pixels (likely background)
-    bright_threshold = np.percentile(pixels, percentile, axis=0)
-    bright_mask = np.all(pixels >= bright_threshold, axis=1)
-    bright_pixels = pixels[bright_mask]
-    
-    if len(bright_pixels) > 0:
-        white_ref = np.percentile(bright_pixels, 99.9, axis=0)
-    else:
-        white_ref = np.array([255.0, 255.0, 255.0])
+    bright_threshold = _histogram_percentile(histograms, percentile)
+    bright = np.where(np.arange(256) >= bright_threshold[:, np.newaxis], histograms, 0)
     
+    white_ref = _histogram_percentile(bright, 99.9)
     return white_ref.astype(np.float32)
 
 
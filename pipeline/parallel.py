@@ -0,0 +1,115 @@
+"""
+Intra-image parallelism over row bands.
+
+Per-pixel stages are split into horizontal bands that run on a shared thread
+pool. NumPy and OpenCV release the GIL inside their kernels, so bands execute
+concurrently. Each band runs exactly the same element-wise code as the serial
+path, so results are bit-identical.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Bands smaller than this cost more in dispatch than they save
+MIN_BAND_ROWS = 64
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_thread_pool(num_threads):
+    """
+    Shared thread pool with `num_threads` workers (created on first use).
+
+    Args:
+        num_threads: int, pool size
+
+    Returns:
+        executor: concurrent.futures.ThreadPoolExecutor
+    """
+    with _pools_lock:
+        pool = _pools.get(num_threads)
+        if pool is None:
+            pool = ThreadPoolExecutor(
+                max_workers=num_threads,
+                thread_name_prefix=f'pipeline-band-{num_threads}'
+            )
+            _pools[num_threads] = pool
+        return pool
+
+
+def row_bands(height, num_bands):
+    """
+    Split `height` rows into `num_bands` contiguous, near-equal bands.
+
+    Args:
+        height: int, number of rows
+        num_bands: int, number of bands
+
+    Returns:
+        bands: list of slice objects covering [0, height)
+    """
+    num_bands = max(1, min(num_bands, height))
+    edges = [(height * i) // num_bands for i in range(num_bands + 1)]
+    return [slice(edges[i], edges[i + 1]) for i in range(num_bands)]
+
+
+def _num_bands(height, num_threads, min_band_rows=MIN_BAND_ROWS):
+    """Number of bands worth using for `height` rows."""
+    return min(num_threads, height // max(1, min_band_rows))
+
+
+def run_in_row_bands(func, height, num_threads, min_band_rows=MIN_BAND_ROWS):
+    """
+    Call `func(band)` for row bands covering [0, height), in parallel.
+
+    `func` must only write rows inside its band. Runs serially (one band)
+    when `num_threads` <= 1 or the image is too small to be worth splitting.
+
+    Args:
+        func: callable taking a row slice
+        height: int, number of rows
+        num_threads: int, number of threads to use
+        min_band_rows: int, minimum rows per band
+    """
+    num_bands = _num_bands(height, num_threads, min_band_rows)
+    if num_bands <= 1:
+        func(slice(0, height))
+        return
+
+    pool = get_thread_pool(num_threads)
+    futures = [pool.submit(func, band) for band in row_bands(height, num_bands)]
+    for future in futures:
+        # Re-raises the first band error in the caller
+        future.result()
+
+
+def map_row_bands(func, array, num_threads):
+    """
+    Apply a row-independent function band by band into a new array.
+
+    Serial calls (or images too small to split) return `func(array)`
+    directly, without the extra output buffer. The output shape and dtype
+    are taken from `func` applied to an empty band.
+
+    Args:
+        func: callable mapping array[band] to the matching output rows
+        array: input array, rows along axis 0
+        num_threads: int, number of threads to use
+
+    Returns:
+        out: array with the same number of rows as `array`
+    """
+    height = array.shape[0]
+    if _num_bands(height, num_threads) <= 1:
+        return func(array)
+
+    import numpy as np
+
+    template = func(array[:0])
+    out = np.empty((height,) + template.shape[1:], dtype=template.dtype)
+
+    def _band(band):
+        out[band] = func(array[band])
+
+    run_in_row_bands(_band, height, num_threads)
+    return out
@@ -3,12 +3,24 @@ Main pipeline orchestrator.
 Scanner-agnostic tissue masking pipeline.
 """
 import numpy as np
-from .od import rgb_to_od, compute_total_od
-from .stain import estimate_stain_vectors_macenko, extract_stain_concentrations
-from .normalize import normalize_stain_concentrations, load_reference_profile
-from .threshold import apply_threshold
+from .od import rgb_to_od, compute_total_od, estimate_white_reference
+from .stain import (
+    estimate_stain_vectors_macenko, stain_projection_matrix, project_concentrations,
+    estimate_stain_vectors_macenko_batch, stain_projection_matrix_batch, project_concentrations_batch
+)
+from .normalize import (
+    load_reference_profile, tissue_concentration_statistics, normalization_affine,
+    apply_normalization, concentrations_to_rgb
+)
+from .threshold import compute_threshold, compute_threshold_batch, binarize
+from .parallel import map_row_bands, run_in_row_bands
+from .roi import clip_roi, expand_roi
+from .lut import COLOR_LUT_MODES, index_colors, scatter, max_lut_error
 from .morphology import morphological_cleanup
-from .metrics import compute_qc_metrics
+from .metrics import compute_qc_metrics, compute_qc_metrics_batch
+from .regions import extract_regions
+from .occupancy import tile_occupancy
+from .precheck import FAST_PATH_QC_FLAGS, classify_image, fast_path_mask, record_fast_path
 
 
 class TissueMaskingPipeline:
@@ -17,7 +29,11 @@ class TissueMaskingPipeline:
     Scanner-agnostic: no device-specific tuning.
     """
     
-    def __init__(self, normalize=False, stain_method='macenko', threshold_method='auto', stain_type='HE'):
+    def __init__(self, normalize=False, stain_method='macenko', threshold_method='auto', stain_type='HE',
+                 num_threads=1, min_area=100, kernel_size=3, color_lut=None, lut_bits=6,
+                 lut_tolerance=0.02, regions=False, region_epsilon=1.0, tile_size=None,
+                 tile_stride=None, adaptive_white_reference=False, white_reference_percentile=99.5,
+                 fast_paths=False, fast_path_tolerance=0.001):
         """
         Initialize pipeline.
         
@@ -26,75 +42,565 @@ class TissueMaskingPipeline:
             stain_method: 'macenko' or 'none'
             threshold_method: 'otsu', 'sauvola', or 'auto'
             stain_type: 'HE', 'IHC', or 'PAP' (for reference profile loading)
+            num_threads: int, threads for the per-pixel stages (1 = serial).
+                Images are split into row bands; output is bit-identical.
+            min_area: int, minimum connected component area kept in the mask
+                (0 keeps every component)
+            kernel_size: int, morphological smoothing kernel size (0: no
+                smoothing)
+            color_lut: None, 'unique' or 'quantized'; evaluate OD,
+                concentrations and the threshold input once per color
+                instead of once per pixel (see pipeline.lut)
+            lut_bits: int, bits per channel of the 'quantized' LUT
+            lut_tolerance: float, largest threshold-input error accepted
+                from the 'quantized' LUT before falling back to 'unique'
+            regions: bool, add per-component geometry of the cleaned mask
+                to `process` results (see pipeline.regions)
+            region_epsilon: float, region polygon simplification tolerance
+                in pixels
+            tile_size: int, add the tissue fraction of every tile of this
+                size to `process` results (see pipeline.occupancy)
+            tile_stride: int, offset between tiles (default: tile_size)
+            adaptive_white_reference: bool, estimate a per-channel white
+                reference from each image's background instead of 255
+            white_reference_percentile: float, percentile of each channel
+                above which pixels count as background glass
+            fast_paths: bool, return blank, fully covered and degenerate
+                images without thresholding (see pipeline.precheck); off by
+                default
+            fast_path_tolerance: float, fraction of sampled pixels allowed
+                to disagree with a blank or full classification
         """
+        if color_lut is not None and color_lut not in COLOR_LUT_MODES:
+            raise ValueError(f"color_lut must be None or one of {COLOR_LUT_MODES}")
+        if min_area < 0 or kernel_size < 0:
+            raise ValueError("min_area and kernel_size must not be negative")
+        if (tile_size is not None and tile_size <= 0) or (tile_stride is not None and tile_stride <= 0):
+            raise ValueError("tile_size and tile_stride must be positive")
         self.normalize = normalize
         self.stain_method = stain_method
         self.threshold_method = threshold_method
         self.stain_type = stain_type
+        self.num_threads = max(1, int(num_threads))
+        self.min_area = min_area
+        self.kernel_size = kernel_size
+        self.color_lut = color_lut
+        self.lut_bits = lut_bits
+        self.lut_tolerance = lut_tolerance
+        self.regions = regions
+        self.region_epsilon = region_epsilon
+        self.tile_size = tile_size
+        self.tile_stride = tile_stride
+        self.adaptive_white_reference = adaptive_white_reference
+        self.white_reference_percentile = white_reference_percentile
+        self.fast_paths = fast_paths
+        self.fast_path_tolerance = fast_path_tolerance
     
-    def process(self, rgb_image, flat_field=None):
+    def _white_reference(self, rgb_image):
+        """Per-channel white reference of an image, or 255 if not adaptive."""
+        if not self.adaptive_white_reference:
+            return 255.0
+        return estimate_white_reference(rgb_image, percentile=self.white_reference_percentile)
+    
+    def _map_bands(self, func, array):
+        """Apply a per-pixel stage over row bands on the thread pool."""
+        return map_row_bands(func, array, self.num_threads)
+    
+    def _stain_threshold_input(self, od_image, stain_vectors, concentration_stats=None,
+                               normalized_rgb=None, weights=None):
+        """
+        Stain concentrations and the threshold input for given stain vectors.
+        
+        Normalization statistics come from a tissue-only subsample. The
+        affine normalization, the threshold input and (optionally) the
+        normalized RGB reconstruction then run in a single pass over row
+        bands, normalizing the concentrations in place.
+        
+        Args:
+            od_image: (H, W, 3) OD image
+            stain_vectors: (2, 3) stain vectors
+            concentration_stats: normalization statistics to reuse, or None
+                to compute them from this image
+            normalized_rgb: optional (H, W, 3) uint8 array to receive the
+                RGB reconstruction of the (normalized) concentrations
+            weights: optional (H, W) pixel weights for the statistics
+        
+        Returns:
+            threshold_input: (H, W) max of the two stain concentrations
+            concentrations: (H, W, 2), normalized if enabled
+            concentration_stats: statistics used for normalization, or None
+        """
+        projection = stain_projection_matrix(stain_vectors)
+        concentrations = self._map_bands(
+            lambda od_band: project_concentrations(od_band, projection),
+            od_image
+        )
+        
+        # Optional normalization
+        affine = None
+        if self.normalize:
+            reference_stats = load_reference_profile(self.stain_type)
+            if reference_stats:
+                if concentration_stats is None:
+                    concentration_stats = tissue_concentration_statistics(
+                        concentrations, od_image, weights=weights
+                    )
+                affine = normalization_affine(reference_stats, concentration_stats)
+        else:
+            concentration_stats = None
+        
+        # Threshold on concentrations (use max of both stains)
+        threshold_input = np.empty(concentrations.shape[:2], dtype=concentrations.dtype)
+        
+        def _band(band):
+            c = concentrations[band]
+            if affine is not None:
+                apply_normalization(c, *affine, out=c)
+            np.maximum(c[:, :, 0], c[:, :, 1], out=threshold_input[band])
+            if normalized_rgb is not None:
+                concentrations_to_rgb(c, stain_vectors, out=normalized_rgb[band])
+        
+        run_in_row_bands(_band, concentrations.shape[0], self.num_threads)
+        return threshold_input, concentrations, concentration_stats
+    
+    def _evaluate_pixels(self, rgb_image, white_reference, stain_vectors=None,
+                         concentration_stats=None, weights=None):
+        """
+        Per-pixel stages: RGB → OD → (stain estimation) → threshold input.
+        
+        Runs on a whole image, or on a per-color table (an (n, 1, 3) image
+        of colors, with `weights` giving how often each occurs).
+        
+        Args:
+            rgb_image: (H, W, 3) uint8 RGB
+            white_reference: float or (3,) white reference
+            stain_vectors: (2, 3) stain vectors to reuse, or None to estimate
+            concentration_stats: normalization statistics to reuse, or None
+            weights: optional (H, W) weights for stain estimation and
+                normalization statistics
+        
+        Returns:
+            od_image, threshold_input, stain_vectors, concentration_stats,
+            normalized_rgb (None unless normalizing)
+        """
+        od_image = self._map_bands(
+            lambda rgb_band: rgb_to_od(rgb_band, white_reference=white_reference),
+            rgb_image
+        )
+        normalized_rgb = None
+        
+        if self.stain_method == 'macenko':
+            if stain_vectors is None:
+                stain_vectors = estimate_stain_vectors_macenko(od_image, weights=weights)
+            if self.normalize:
+                # Filled in by the same banded pass as the threshold input
+                normalized_rgb = np.empty(od_image.shape, dtype=np.uint8)
+            threshold_input, _, concentration_stats = self._stain_threshold_input(
+                od_image, stain_vectors, concentration_stats,
+                normalized_rgb=normalized_rgb, weights=weights
+            )
+        else:
+            # Threshold on total OD (stain-agnostic)
+            threshold_input = self._map_bands(compute_total_od, od_image)
+            stain_vectors = None
+            concentration_stats = None
+        
+        return od_image, threshold_input, stain_vectors, concentration_stats, normalized_rgb
+    
+    def _evaluate_by_color(self, rgb_image, white_reference, stain_vectors=None,
+                           concentration_stats=None, mode=None):
+        """
+        `_evaluate_pixels` evaluated once per color and scattered back.
+        
+        Stain vectors and normalization statistics are estimated from the
+        color table weighted by pixel counts. A 'quantized' LUT whose
+        threshold input differs from exact evaluation by more than
+        `lut_tolerance` on sampled pixels is discarded for 'unique'.
+        
+        Returns:
+            od_image, threshold_input, stain_vectors, concentration_stats,
+            normalized_rgb, color_lut (dict with 'mode', 'colors' and
+            'max_error')
+        """
+        mode = mode or self.color_lut
+        color_index = index_colors(rgb_image, mode=mode, bits=self.lut_bits)
+        od_colors, threshold_colors, fitted_vectors, fitted_stats, normalized_colors = \
+            self._evaluate_pixels(color_index.colors, white_reference, stain_vectors,
+                                  concentration_stats, weights=color_index.counts)
+        threshold_input = scatter(threshold_colors, color_index)
+        
+        max_error = 0.0
+        if mode == 'quantized':
+            def _exact(colors):
+                return self._evaluate_pixels(colors, white_reference, fitted_vectors, fitted_stats)[1]
+            
+            max_error = max_lut_error(rgb_image, threshold_input, _exact)
+            if max_error > self.lut_tolerance:
+                return self._evaluate_by_color(rgb_image, white_reference, stain_vectors,
+                                               concentration_stats, mode='unique')
+        
+        od_image = scatter(od_colors, color_index)
+        normalized_rgb = None if normalized_colors is None else scatter(normalized_colors, color_index)
+        color_lut = {
+            'mode': mode,
+            'colors': int(np.count_nonzero(color_index.counts)),
+            'max_error': max_error,
+        }
+        return od_image, threshold_input, fitted_vectors, fitted_stats, normalized_rgb, color_lut
+    
+    def process(self, rgb_image, flat_field=None, context=None, gain=None, allow_fast_path=True):
         """
         Process RGB image through full pipeline.
         
+        Blank, fully covered and degenerate images take a fast path (unless
+        normalizing, or while `context` still has to be established): the
+        mask is all zero or all tissue, metrics are computed from it as
+        usual and a QC flag (BLANK_IMAGE, FULL_TISSUE_COVERAGE,
+        DEGENERATE_IMAGE) is added.
+        
         Args:
             rgb_image: numpy array (H, W, 3) uint8 RGB
             flat_field: optional (H, W, 3) uint8 flat field image
+            gain: optional precomputed (H, W, 3) float32 flat-field gain map
+                (see FlatFieldRegistry); used instead of `flat_field`
+            context: optional SlideContext shared by tiles of one slide.
+                Once established, its stain vectors, normalization
+                statistics and threshold are reused instead of re-estimated;
+                otherwise this tile establishes it if it has enough tissue.
+            allow_fast_path: bool, False to always estimate the parameters
+                (e.g. to establish a slide context from the result)
         
         Returns:
-            dict with keys: 'mask', 'od_image', 'normalized_rgb' (optional), 'metrics'
+            dict with keys: 'mask', 'od_image', 'normalized_rgb' (optional), 'metrics',
+            'slide_parameters' (the parameters used, as accepted by
+            SlideContext.establish), 'regions' (if enabled; see
+            extract_regions), 'tile_occupancy' (with tile_size; see
+            tile_occupancy), 'fast_path' (if one was taken: 'blank', 'full'
+            or 'degenerate'; stain vectors and threshold not estimated)
         """
         # Step 1: Optional flat-field correction
-        if flat_field is not None:
+        if gain is not None:
+            from .preprocess import apply_gain
+            rgb_image = apply_gain(rgb_image, gain)
+        elif flat_field is not None:
             from .preprocess import flat_field_correction
             rgb_image = flat_field_correction(rgb_image, flat_field)
         
-        # Step 2: RGB → OD
-        od_image = rgb_to_od(rgb_image)
+        reuse_context = context is not None and context.is_established
+        white_reference = context.get('white_reference') if reuse_context else self._white_reference(rgb_image)
         
-        # Step 3: Optional stain estimation
-        if self.stain_method == 'macenko':
-            stain_vectors = estimate_stain_vectors_macenko(od_image)
-            concentrations = extract_stain_concentrations(od_image, stain_vectors)
-            
-            # Optional normalization
-            if self.normalize:
-                reference_stats = load_reference_profile(self.stain_type)
-                if reference_stats:
-                    concentrations = normalize_stain_concentrations(concentrations, reference_stats)
-            
-            # Threshold on concentrations (use max of both stains)
-            threshold_input = np.maximum(concentrations[:, :, 0], concentrations[:, :, 1])
+        stain_vectors = context.get('stain_vectors') if reuse_context else None
+        concentration_stats = context.get('concentration_stats') if reuse_context else None
+        
+        fast_path = None
+        if rgb_image.shape[0] * rgb_image.shape[1] == 0:
+            raise ValueError(f"Empty image of shape {rgb_image.shape}")
+        if self.fast_paths and allow_fast_path and not self.normalize and (context is None or reuse_context):
+            fast_path = classify_image(rgb_image, white_reference, tolerance=self.fast_path_tolerance,
+                                       min_pixels=self.min_area)
+            record_fast_path(fast_path)
+        if fast_path is not None:
+            slide_parameters = {
+                'stain_vectors': stain_vectors,
+                'white_reference': white_reference,
+                'threshold': context.get('threshold') if reuse_context else None,
+                'concentration_stats': concentration_stats,
+            }
+            return self._fast_path_result(rgb_image, fast_path, slide_parameters, context)
+        
+        # Steps 2-3: RGB → OD → (stain estimation) → threshold input
+        if self.color_lut is not None:
+            od_image, threshold_input, stain_vectors, concentration_stats, normalized_rgb, color_lut = \
+                self._evaluate_by_color(rgb_image, white_reference, stain_vectors, concentration_stats)
         else:
-            # Threshold on total OD (stain-agnostic)
-            threshold_input = compute_total_od(od_image)
+            od_image, threshold_input, stain_vectors, concentration_stats, normalized_rgb = \
+                self._evaluate_pixels(rgb_image, white_reference, stain_vectors, concentration_stats)
         
-        # Step 4: Adaptive thresholding
-        mask = apply_threshold(threshold_input, method=self.threshold_method)
+        # Step 4: Adaptive thresholding (global threshold, banded mask)
+        if reuse_context:
+            threshold = context.get('threshold')
+        else:
+            threshold = compute_threshold(threshold_input, method=self.threshold_method)
+        mask = self._map_bands(lambda band: binarize(band, threshold), threshold_input)
         
         # Step 5: Morphological cleanup
-        mask = morphological_cleanup(mask)
+        mask = morphological_cleanup(mask, min_area=self.min_area, kernel_size=self.kernel_size)
         
         # Step 6: Compute metrics
         metrics = compute_qc_metrics(rgb_image, mask, od_image)
         
+        slide_parameters = {
+            'stain_vectors': stain_vectors,
+            'white_reference': white_reference,
+            'threshold': float(threshold),
+            'concentration_stats': concentration_stats,
+        }
+        
+        if context is not None:
+            if not reuse_context and _tissue_fraction(od_image) >= context.min_tissue_fraction:
+                context.establish(**slide_parameters)
+            context.record_tile()
+        
         result = {
             'mask': mask,
             'od_image': od_image,
-            'metrics': metrics
+            'metrics': metrics,
+            'slide_parameters': slide_parameters
         }
         
-        # Optional: Reconstruct normalized RGB for visualization
-        if self.normalize and self.stain_method == 'macenko' and 'concentrations' in locals():
-            # Reconstruct OD from normalized concentrations
-            stain_matrix = stain_vectors.T
-            normalized_od = concentrations.reshape(-1, 2) @ stain_matrix.T
-            normalized_od = normalized_od.reshape(od_image.shape)
-            
-            # Convert back to RGB
-            normalized_rgb = od_to_rgb(normalized_od)
+        # Optional: normalized RGB for visualization (reconstructed above)
+        if normalized_rgb is not None:
             result['normalized_rgb'] = normalized_rgb
         
+        if self.color_lut is not None:
+            result['color_lut'] = color_lut
+        
+        return self._add_mask_outputs(result)
+    
+    def _fast_path_result(self, rgb_image, fast_path, slide_parameters, context=None):
+        """`process` result for a pre-classified image: constant mask, exact metrics."""
+        mask = fast_path_mask(fast_path, rgb_image.shape)
+        white_reference = slide_parameters['white_reference']
+        od_image = self._map_bands(
+            lambda rgb_band: rgb_to_od(rgb_band, white_reference=white_reference),
+            rgb_image
+        )
+        metrics = compute_qc_metrics(rgb_image, mask, od_image)
+        metrics['qc_flags'].append(FAST_PATH_QC_FLAGS[fast_path])
+        
+        if context is not None:
+            context.record_tile()
+        
+        return self._add_mask_outputs({
+            'mask': mask,
+            'od_image': od_image,
+            'metrics': metrics,
+            'slide_parameters': slide_parameters,
+            'fast_path': fast_path,
+        })
+    
+    def _add_mask_outputs(self, result):
+        """Add the optional outputs derived from the cleaned mask."""
+        if self.regions:
+            result['regions'] = extract_regions(result['mask'], result['od_image'], epsilon=self.region_epsilon)
+        
+        if self.tile_size is not None:
+            result['tile_occupancy'] = tile_occupancy(result['mask'], self.tile_size, self.tile_stride)
+        
         return result
+    
+    def process_batch(self, rgb_batch, stain_vectors=None):
+        """
+        Process a stack of same-shaped tiles with batched array operations.
+        
+        OD, stain estimation, concentration extraction, normalization and
+        thresholding run over the whole (N, H, W, 3) stack at once; only
+        morphological cleanup loops over tiles (on `num_threads` threads).
+        Each tile gets its own stain vectors, normalization statistics and
+        threshold, as with `process`, unless `stain_vectors` are given.
+        
+        With `adaptive_white_reference`, each tile gets its own white
+        reference. Blank, fully covered and degenerate tiles take the same
+        fast paths as in `process`. Flat-field correction, slide contexts, color LUTs and
+        the normalized RGB reconstruction are not supported here; use
+        `process` for those.
+        Peak memory is roughly 60 bytes per pixel of the stack, so split
+        very large batches.
+        
+        Args:
+            rgb_batch: (N, H, W, 3) uint8 RGB tiles
+            stain_vectors: optional (2, 3) stain vectors shared by all tiles,
+                or (N, 2, 3) per tile; estimated per tile if None
+        
+        Returns:
+            dict with keys: 'masks' ((N, H, W) uint8), 'metrics' (list of N
+            dicts), 'thresholds' ((N,) float64), 'stain_vectors' ((N, 2, 3)
+            or None), 'concentration_stats' (list of N dicts or None),
+            'white_references' ((N, 3) float32), 'fast_paths' (list of N
+            fast path names or None); thresholds and stain vectors are NaN
+            for tiles that took a fast path
+        """
+        rgb_batch = np.asarray(rgb_batch)
+        if rgb_batch.ndim != 4 or rgb_batch.shape[-1] != 3:
+            raise ValueError(f"rgb_batch must have shape (N, H, W, 3), got {rgb_batch.shape}")
+        num_tiles = len(rgb_batch)
+        
+        # Steps 2-3: RGB → OD → (stain estimation) → threshold input
+        white_references = np.full((num_tiles, 3), 255.0, dtype=np.float32)
+        if self.adaptive_white_reference:
+            od_batch = np.empty(rgb_batch.shape, dtype=np.float32)
+            for i, tile in enumerate(rgb_batch):
+                white_references[i] = self._white_reference(tile)
+                od_batch[i] = rgb_to_od(tile, white_reference=white_references[i])
+        else:
+            od_batch = rgb_to_od(rgb_batch)
+        
+        # Blank, fully covered and degenerate tiles skip steps 3-5
+        fast_paths = [None] * num_tiles
+        if self.fast_paths and not self.normalize:
+            fast_paths = [
+                classify_image(tile, white_references[i], tolerance=self.fast_path_tolerance,
+                               min_pixels=self.min_area)
+                for i, tile in enumerate(rgb_batch)
+            ]
+            for kind in fast_paths:
+                record_fast_path(kind)
+        active = np.array([kind is None for kind in fast_paths])
+        
+        masks = np.empty(rgb_batch.shape[:3], dtype=np.uint8)
+        thresholds = np.full(num_tiles, np.nan)
+        stain_vectors_out = None
+        concentration_stats = None
+        if self.stain_method == 'macenko':
+            stain_vectors_out = np.full((num_tiles, 2, 3), np.nan)
+            if stain_vectors is not None:
+                stain_vectors = np.broadcast_to(np.asarray(stain_vectors, dtype=np.float64),
+                                                (num_tiles, 2, 3))
+        
+        if active.any():
+            subset = active.all()
+            od_active = od_batch if subset else od_batch[active]
+            
+            if self.stain_method == 'macenko':
+                if stain_vectors is None:
+                    active_vectors = estimate_stain_vectors_macenko_batch(od_active)
+                else:
+                    active_vectors = stain_vectors if subset else stain_vectors[active]
+                stain_vectors_out[active] = active_vectors
+                concentrations = project_concentrations_batch(
+                    od_active, stain_projection_matrix_batch(active_vectors)
+                )
+                
+                reference_stats = load_reference_profile(self.stain_type) if self.normalize else None
+                if reference_stats:
+                    concentration_stats = [
+                        tissue_concentration_statistics(c, od) for c, od in zip(concentrations, od_active)
+                    ]
+                    affines = [normalization_affine(reference_stats, stats) for stats in concentration_stats]
+                    scale = np.stack([affine[0] for affine in affines])[:, np.newaxis, np.newaxis]
+                    offset = np.stack([affine[1] for affine in affines])[:, np.newaxis, np.newaxis]
+                    apply_normalization(concentrations, scale, offset, out=concentrations)
+                
+                threshold_input = np.maximum(concentrations[..., 0], concentrations[..., 1])
+            else:
+                threshold_input = np.sum(od_active, axis=3)
+            
+            # Step 4: One global threshold per tile
+            active_thresholds = compute_threshold_batch(threshold_input, method=self.threshold_method)
+            thresholds[active] = active_thresholds
+            masks[active] = binarize(threshold_input, active_thresholds[:, np.newaxis, np.newaxis])
+        
+        for i, kind in enumerate(fast_paths):
+            if kind is not None:
+                masks[i] = fast_path_mask(kind, masks[i].shape)
+        
+        # Step 5: Morphological cleanup, tile by tile
+        def _cleanup(tiles):
+            for i in range(tiles.start, tiles.stop):
+                if fast_paths[i] is None:
+                    masks[i] = morphological_cleanup(masks[i], min_area=self.min_area,
+                                                     kernel_size=self.kernel_size)
+        
+        run_in_row_bands(_cleanup, num_tiles, self.num_threads, min_band_rows=1)
+        
+        # Step 6: Compute metrics
+        metrics = compute_qc_metrics_batch(rgb_batch, masks, od_batch)
+        for tile_metrics, kind in zip(metrics, fast_paths):
+            if kind is not None:
+                tile_metrics['qc_flags'].append(FAST_PATH_QC_FLAGS[kind])
+        
+        if concentration_stats is not None and not active.all():
+            # Re-align with the tiles; None where a fast path was taken
+            remaining = iter(concentration_stats)
+            concentration_stats = [next(remaining) if is_active else None for is_active in active]
+        
+        return {
+            'masks': masks,
+            'metrics': metrics,
+            'thresholds': thresholds,
+            'stain_vectors': stain_vectors_out,
+            'concentration_stats': concentration_stats,
+            'white_references': white_references,
+            'fast_paths': fast_paths,
+        }
+    
+    def remask_roi(self, rgb_image, roi, slide_parameters, threshold=None, halo=32):
+        """
+        Recompute the mask inside a region of interest only.
+        
+        OD, thresholding and morphology run on the ROI plus a halo of
+        context pixels (so components crossing the ROI border are cleaned
+        up as in a full run), reusing the image's stain vectors,
+        normalization statistics and threshold. Use `splice_roi` to write
+        the result into the previous mask.
+        
+        Args:
+            rgb_image: (H, W, 3) uint8 RGB, the full image
+            roi: (x, y, width, height) in image pixels
+            slide_parameters: dict from a previous `process` result
+            threshold: float, override of the stored threshold
+            halo: int, context pixels around the ROI (>= 0)
+        
+        Returns:
+            roi_mask: (height, width) uint8 mask for the (clipped) ROI
+            roi: (x, y, width, height) clipped to the image
+        """
+        if halo < 0:
+            raise ValueError("halo must not be negative")
+        roi = clip_roi(roi, rgb_image.shape)
+        outer = expand_roi(roi, halo, rgb_image.shape)
+        crop = rgb_image[outer[1]:outer[1] + outer[3], outer[0]:outer[0] + outer[2]]
+        
+        white_reference = slide_parameters['white_reference']
+        od_image = rgb_to_od(crop, white_reference=white_reference)
+        
+        if self.stain_method == 'macenko':
+            # Not estimated for images that took a fast path: use the crop
+            stain_vectors = slide_parameters['stain_vectors']
+            if stain_vectors is None:
+                stain_vectors = estimate_stain_vectors_macenko(od_image)
+            threshold_input, _, _ = self._stain_threshold_input(
+                od_image, stain_vectors, slide_parameters['concentration_stats']
+            )
+        else:
+            threshold_input = compute_total_od(od_image)
+        
+        if threshold is None:
+            threshold = slide_parameters['threshold']
+        if threshold is None:
+            threshold = compute_threshold(threshold_input, method=self.threshold_method)
+        mask = binarize(threshold_input, threshold)
+        mask = morphological_cleanup(mask, min_area=self.min_area, kernel_size=self.kernel_size)
+        
+        # Drop the halo
+        x, y, width, height = roi
+        top, left = y - outer[1], x - outer[0]
+        return mask[top:top + height, left:left + width], roi
+    
+    def establish_context(self, context, rgb_image):
+        """
+        Establish slide parameters from a thumbnail or representative tile.
+        
+        Unlike `process`, the parameters are stored regardless of how much
+        tissue the image contains.
+        
+        Args:
+            context: SlideContext
+            rgb_image: (H, W, 3) uint8 RGB thumbnail
+        
+        Returns:
+            established: bool, False if the context was already established
+        """
+        result = self.process(rgb_image, allow_fast_path=False)
+        return context.establish(**result['slide_parameters'])
+
+
+def _tissue_fraction(od_image, beta=0.15, stride=4):
+    """Fraction of tissue-like pixels (total OD > beta) on a strided subsample."""
+    sample = od_image[::stride, ::stride]
+    if sample.size == 0:
+        return 0.0
+    return float(np.mean(np.sum(sample, axis=2) > beta))
 
 
 def od_to_rgb(od_image, white_reference=255.0):
@@ -108,10 +614,11 @@ def od_to_rgb(od_image, white_reference=255.0):
     Returns:
         rgb_image: (H, W, 3) uint8 RGB
     """
-    # Reverse OD: I = I0 * 10^(-OD)
-    rgb_normalized = white_reference * np.power(10.0, -od_image)
+    # Reverse OD: I = I0 * 10^(-OD) = I0 * exp(-ln(10) * OD), in float32
+    rgb_normalized = np.exp(od_image.astype(np.float32) * np.float32(-np.log(10.0)))
+    rgb_normalized *= np.asarray(white_reference, dtype=np.float32)
     
     # Clip and convert to uint8
-    rgb_image = np.clip(rgb_normalized, 0, 255).astype(np.uint8)
+    rgb_image = np.clip(rgb_normalized, 0, 255, out=rgb_normalized).astype(np.uint8)
     
     return rgb_image
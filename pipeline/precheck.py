@@ -0,0 +1,103 @@
+"""
+Pre-classification of images that need no thresholding.
+
+Blank slides, background-only tiles and tiles fully covered by tissue are
+recognised from the total OD of a strided subsample (about 64k pixels
+whatever the image size). For them the pipeline returns an all-zero or
+all-tissue mask directly, skipping stain estimation, thresholding and
+morphology. Images too small to hold a component of `min_area` pixels are
+degenerate: their cleaned mask is always empty.
+
+Total OD is measured against the pipeline's white reference, so a background
+darker than it reads as tissue-dark. An image is therefore only called full
+if it also has no flat bright plateau: glass is uniform to within sensor
+noise, while tissue is textured. A dim background (or a dim blank slide)
+forms such a plateau and sends the image through the full pipeline.
+
+How often each fast path fires is counted per process.
+"""
+import threading
+
+import numpy as np
+
+from .od import rgb_to_od
+
+FAST_PATHS = ('blank', 'full', 'degenerate')
+FAST_PATH_QC_FLAGS = {
+    'blank': 'BLANK_IMAGE',
+    'full': 'FULL_TISSUE_COVERAGE',
+    'degenerate': 'DEGENERATE_IMAGE',
+}
+
+_counts_lock = threading.Lock()
+_counts = dict.fromkeys(('checked',) + FAST_PATHS, 0)
+
+
+def sample_stride(shape, sample_pixels=65536):
+    """Stride giving roughly `sample_pixels` pixels of an (H, W, ...) image."""
+    pixels = shape[0] * shape[1]
+    return max(1, int(round(np.sqrt(pixels / sample_pixels))))
+
+
+def classify_image(rgb_image, white_reference=255.0, beta=0.15, tolerance=0.001,
+                   min_pixels=1, sample_pixels=65536, plateau_od=0.05, max_plateau_fraction=0.02):
+    """
+    Detect images whose mask is known without thresholding.
+
+    Args:
+        rgb_image: (H, W, 3) uint8 RGB, not empty
+        white_reference: float or (3,) white reference for OD
+        beta: float, total OD above which a pixel counts as tissue
+        tolerance: float, fraction of sampled pixels allowed to disagree
+            with 'blank' or 'full'
+        min_pixels: int, images with fewer pixels are 'degenerate'
+        sample_pixels: int, approximate subsample size
+        plateau_od: float, total OD above the image's lightest level (its
+            `tolerance` quantile) within which pixels form its bright plateau
+        max_plateau_fraction: float, largest bright plateau (fraction of
+            sampled pixels) an image called 'full' may have
+
+    Returns:
+        kind: 'blank', 'full', 'degenerate' or None (run the full pipeline)
+    """
+    height, width = rgb_image.shape[:2]
+    if height * width < min_pixels:
+        return 'degenerate'
+
+    stride = sample_stride(rgb_image.shape, sample_pixels)
+    sample = rgb_image[::stride, ::stride]
+    od = rgb_to_od(sample, white_reference=white_reference)
+    total_od = (od[..., 0] + od[..., 1] + od[..., 2]).ravel()
+    tissue_fraction = np.count_nonzero(total_od > beta) / total_od.size
+
+    if tissue_fraction <= tolerance:
+        return 'blank'
+    if tissue_fraction >= 1.0 - tolerance and _plateau_fraction(total_od, tolerance, plateau_od) \
+            <= max_plateau_fraction:
+        return 'full'
+    return None
+
+
+def _plateau_fraction(total_od, tolerance, plateau_od):
+    """Fraction of samples within `plateau_od` of the lightest level."""
+    lightest = np.quantile(total_od, tolerance)
+    return np.count_nonzero(total_od <= lightest + plateau_od) / total_od.size
+
+
+def fast_path_mask(kind, shape):
+    """(H, W) uint8 mask for a fast path: all tissue for 'full', else empty."""
+    return np.full(shape[:2], 255 if kind == 'full' else 0, dtype=np.uint8)
+
+
+def record_fast_path(kind):
+    """Count one pre-classified image (`kind` None if it took the full pipeline)."""
+    with _counts_lock:
+        _counts['checked'] += 1
+        if kind is not None:
+            _counts[kind] += 1
+
+
+def fast_path_counts():
+    """Snapshot of images checked and fast paths taken in this process."""
+    with _counts_lock:
+        return dict(_counts)
@@ -1,30 +1,215 @@
 """
 Optional preprocessing: flat-field/illumination correction.
+
+A blank-slide reference is turned once into a reciprocal gain map
+(1 / normalized flat field); correction is then a single saturating
+multiply. `FlatFieldRegistry` keeps gain maps per scanner id, persisted
+as .npy files and resized on demand with a cache per resolution.
 """
+import os
+import re
+import threading
+from collections import OrderedDict
+
 import numpy as np
 
+# Scanner ids become file names
+_SCANNER_ID = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+
+class UnknownFlatFieldError(KeyError):
+    """Raised when no flat field is registered for a scanner id."""
+
+
+def flat_field_gain(flat_field_image):
+    """
+    Reciprocal gain map of a blank slide reference.
+
+    Args:
+        flat_field_image: (H, W, 3) blank slide reference uint8
+
+    Returns:
+        gain: (H, W, 3) float32, 1 / flat field normalized to [0.01, 1]
+    """
+    # Normalize flat field to [0, 1]
+    flat_field_norm = flat_field_image.astype(np.float32) / 255.0
+
+    # Avoid division by zero
+    np.clip(flat_field_norm, 0.01, 1.0, out=flat_field_norm)
+
+    return np.reciprocal(flat_field_norm, out=flat_field_norm)
+
+
+def resize_gain(gain, shape):
+    """
+    Resize a gain map to an image size (bilinear; illumination is smooth).
+
+    Args:
+        gain: (h, w, 3) float32 gain map
+        shape: target image shape, (H, W, ...)
+
+    Returns:
+        gain: (H, W, 3) float32
+    """
+    import cv2
+
+    height, width = shape[:2]
+    if gain.shape[:2] == (height, width):
+        return gain
+    return cv2.resize(gain, (width, height), interpolation=cv2.INTER_LINEAR)
+
+
+def apply_gain(rgb_image, gain):
+    """
+    Correct an image with a precomputed gain map.
+
+    I_corrected = I_raw * gain, rounded and saturated to uint8 in one pass.
+
+    Args:
+        rgb_image: (H, W, 3) input image uint8
+        gain: (H, W, 3) float32 gain map of the same size
+
+    Returns:
+        corrected_image: (H, W, 3) corrected RGB uint8
+    """
+    import cv2
+
+    return cv2.multiply(rgb_image, gain, dtype=cv2.CV_8U)
+
 
 def flat_field_correction(rgb_image, flat_field_image):
     """
     Correct for non-uniform illumination using blank slide reference.
-    
+
+    Prepares the gain map on every call; use `FlatFieldRegistry` (or
+    `flat_field_gain` + `apply_gain`) when the same flat field is reused.
+
     Args:
         rgb_image: (H, W, 3) input image uint8
         flat_field_image: (H, W, 3) blank slide reference uint8
-    
+
     Returns:
         corrected_image: (H, W, 3) corrected RGB uint8
     """
-    # Normalize flat field to [0, 1]
-    flat_field_norm = flat_field_image.astype(np.float32) / 255.0
-    
-    # Avoid division by zero
-    flat_field_norm = np.clip(flat_field_norm, 0.01, 1.0)
-    
-    # Correct: I_corrected = I_raw / I_flat_field
-    corrected = (rgb_image.astype(np.float32) / flat_field_norm)
-    
-    # Renormalize to [0, 255]
-    corrected = np.clip(corrected, 0, 255).astype(np.uint8)
-    
-    return corrected
+    gain = resize_gain(flat_field_gain(flat_field_image), rgb_image.shape)
+    return apply_gain(rgb_image, gain)
+
+
+def validate_scanner_id(scanner_id):
+    """Raise ValueError unless `scanner_id` is a safe identifier."""
+    if not isinstance(scanner_id, str) or not _SCANNER_ID.match(scanner_id):
+        raise ValueError("scanner_id must be 1-64 characters of letters, digits, '_', '.' or '-'")
+    return scanner_id
+
+
+class FlatFieldRegistry:
+    """
+    Gain maps per scanner id.
+
+    Gain maps are stored at their native resolution in `directory`
+    (`<scanner_id>.npy`), so every worker process sees registrations.
+    Resized copies are cached in memory per (scanner id, resolution), least
+    recently used first out. Thread-safe.
+    """
+
+    def __init__(self, directory, max_cached=32):
+        """
+        Args:
+            directory: str, where gain maps are persisted
+            max_cached: int, resized gain maps kept in memory
+        """
+        self.directory = directory
+        self.max_cached = max_cached
+        self._lock = threading.Lock()
+        self._native = {}  # scanner_id -> (gain, mtime_ns)
+        self._resized = OrderedDict()  # (scanner_id, height, width) -> gain
+
+    def _path(self, scanner_id):
+        return os.path.join(self.directory, f'{validate_scanner_id(scanner_id)}.npy')
+
+    def register(self, scanner_id, flat_field_image):
+        """
+        Store the gain map of a blank slide reference, replacing any previous.
+
+        Args:
+            scanner_id: str
+            flat_field_image: (H, W, 3) blank slide reference uint8
+
+        Returns:
+            shape: (H, W) of the stored gain map
+        """
+        path = self._path(scanner_id)
+        gain = flat_field_gain(flat_field_image)
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Atomic replace: concurrent readers see the old or the new map
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, gain)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._native[scanner_id] = (gain, os.stat(path).st_mtime_ns)
+            for key in [key for key in self._resized if key[0] == scanner_id]:
+                del self._resized[key]
+        return gain.shape[:2]
+
+    def _native_gain(self, scanner_id):
+        """Native gain map, reloaded if another process replaced the file."""
+        path = self._path(scanner_id)
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            raise UnknownFlatFieldError(scanner_id) from None
+
+        with self._lock:
+            cached = self._native.get(scanner_id)
+            if cached is not None and cached[1] == mtime_ns:
+                return cached[0]
+
+        gain = np.load(path)
+        with self._lock:
+            self._native[scanner_id] = (gain, mtime_ns)
+            for key in [key for key in self._resized if key[0] == scanner_id]:
+                del self._resized[key]
+        return gain
+
+    def get_gain(self, scanner_id, shape):
+        """
+        Gain map for a scanner at an image resolution.
+
+        Args:
+            scanner_id: str
+            shape: image shape, (H, W, ...)
+
+        Returns:
+            gain: (H, W, 3) float32, shared; do not modify
+
+        Raises:
+            UnknownFlatFieldError: if nothing is registered for `scanner_id`
+        """
+        gain = self._native_gain(scanner_id)
+        height, width = shape[:2]
+        if gain.shape[:2] == (height, width):
+            return gain
+
+        key = (scanner_id, height, width)
+        with self._lock:
+            resized = self._resized.get(key)
+            if resized is not None:
+                self._resized.move_to_end(key)
+                return resized
+
+        resized = resize_gain(gain, shape)
+        with self._lock:
+            self._resized[key] = resized
+            self._resized.move_to_end(key)
+            while len(self._resized) > self.max_cached:
+                self._resized.popitem(last=False)
+        return resized
+
+    def scanner_ids(self):
+        """Registered scanner ids."""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-4] for name in os.listdir(self.directory) if name.endswith('.npy'))
@@ -0,0 +1,154 @@
+"""
+Downsampled previews for display: overlays, mask thumbnails and
+normalized-RGB previews.
+
+Images are reduced to the requested maximum dimension (INTER_AREA) before
+anything else happens, so blending and encoding cost scales with the
+preview size rather than the source image. Previews are owned arrays:
+they can be blended and swapped to the encoders' BGR order in place.
+"""
+import numpy as np
+
+from .io import rgb_to_bgr_inplace
+
+# Overlay tint: 30% green over 70% image, as in the full-resolution overlay
+OVERLAY_ALPHA = 0.3
+OVERLAY_COLOR = (0, 255, 0)
+
+# Rows blended per band (bounds the scaled temporary at full resolution)
+BLEND_BAND_ROWS = 256
+
+
+def preview_size(shape, max_dimension):
+    """
+    Preview (width, height) for an image, keeping the aspect ratio.
+
+    Args:
+        shape: image shape, (H, W, ...)
+        max_dimension: int, maximum preview width/height; None or 0 keeps
+            the full size
+
+    Returns:
+        (width, height): tuple of ints, never larger than the image
+    """
+    height, width = shape[:2]
+    if not max_dimension or max(width, height) <= max_dimension:
+        return width, height
+    scale = max_dimension / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def downsample_image(image, max_dimension):
+    """
+    Area-average an image down to fit `max_dimension`.
+
+    Args:
+        image: (H, W, 3) or (H, W) uint8
+        max_dimension: int, maximum preview width/height
+
+    Returns:
+        preview: uint8 array; a new array even when no resize is needed,
+            so callers may modify it in place
+    """
+    import cv2
+
+    size = preview_size(image.shape, max_dimension)
+    if size == (image.shape[1], image.shape[0]):
+        return image.copy()
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def downsample_mask(mask, max_dimension):
+    """
+    Mask thumbnail: area-averaged, then re-binarized at 50% coverage.
+
+    Args:
+        mask: (H, W) uint8, 0=background, 255=tissue
+        max_dimension: int, maximum thumbnail width/height
+
+    Returns:
+        thumbnail: (h, w) uint8, 0 or 255
+    """
+    import cv2
+
+    thumbnail = downsample_image(mask, max_dimension)
+    cv2.threshold(thumbnail, 127, 255, cv2.THRESH_BINARY, dst=thumbnail)
+    return thumbnail
+
+
+def blend_overlay(image, mask, alpha=OVERLAY_ALPHA, color=OVERLAY_COLOR):
+    """
+    Tint tissue pixels in place.
+
+    Args:
+        image: (H, W, 3) uint8 RGB, modified in place
+        mask: (H, W) uint8 mask of the same size, nonzero=tissue
+        alpha: float, weight of `color`
+        color: (r, g, b) tint
+
+    Returns:
+        image: the blended input array
+    """
+    import cv2
+
+    weights = (1.0 - alpha,) * 3 + (0.0,)
+    tint = tuple(alpha * c for c in color) + (0.0,)
+    scaled = np.empty_like(image[:BLEND_BAND_ROWS])
+    for top in range(0, image.shape[0], BLEND_BAND_ROWS):
+        band = image[top:top + BLEND_BAND_ROWS]
+        cv2.multiply(band, weights, dst=scaled[:len(band)])
+        # Saturating uint8 add, written only where the mask is set
+        cv2.add(scaled[:len(band)], tint, dst=band, mask=mask[top:top + BLEND_BAND_ROWS])
+    return image
+
+
+def render_overlay(image, mask, max_dimension=None):
+    """
+    Overlay preview: downsample image and mask, then blend.
+
+    Args:
+        image: (H, W, 3) uint8 RGB
+        mask: (H, W) uint8 mask
+        max_dimension: int, maximum preview width/height (None: full size)
+
+    Returns:
+        overlay: (h, w, 3) uint8 RGB
+    """
+    preview = downsample_image(image, max_dimension)
+    return blend_overlay(preview, downsample_mask(mask, max_dimension))
+
+
+def render_previews(image, mask, normalized_rgb=None, max_dimension=1024,
+                    overlay=True, mask_thumbnail=False, channel_order='rgb'):
+    """
+    Render the requested previews at one preview size.
+
+    Args:
+        image: (H, W, 3) uint8 RGB
+        mask: (H, W) uint8 mask
+        normalized_rgb: (H, W, 3) uint8 RGB, or None
+        max_dimension: int, maximum preview width/height (None: full size)
+        overlay: bool, render the overlay
+        mask_thumbnail: bool, render a mask thumbnail
+        channel_order: 'rgb', or 'bgr' to return color previews swapped in
+            place, ready for `encode_image(..., channel_order='bgr')`
+
+    Returns:
+        previews: dict with any of 'overlay', 'mask_thumbnail' and
+            'normalized_rgb' (uint8 arrays)
+    """
+    previews = {}
+    mask_preview = None
+    if overlay or mask_thumbnail:
+        mask_preview = downsample_mask(mask, max_dimension)
+    if overlay:
+        previews['overlay'] = blend_overlay(downsample_image(image, max_dimension), mask_preview)
+    if mask_thumbnail:
+        previews['mask_thumbnail'] = mask_preview
+    if normalized_rgb is not None:
+        previews['normalized_rgb'] = downsample_image(normalized_rgb, max_dimension)
+    if channel_order == 'bgr':
+        for name in ('overlay', 'normalized_rgb'):
+            if name in previews:
+                rgb_to_bgr_inplace(previews[name])
+    return previews
@@ -0,0 +1,350 @@
+"""
+Tissue region geometry and a grid spatial index over it.
+
+`extract_regions` describes every connected component of a cleaned mask:
+simplified outline polygon (plus holes), bounding box, area, centroid and
+mean total OD. `RegionIndex` answers point and box queries from that
+geometry alone: a coarse grid marks cells as empty, fully covered or
+partial, and only partial cells fall back to exact polygon tests against
+the few regions bucketed in them. The index persists as a small .npz.
+
+Coordinates are mask pixel coordinates: pixel (row, col) is the point
+(x=col, y=row); boxes are (x, y, width, height) covering pixels
+x..x+width-1 and y..y+height-1.
+"""
+import io
+
+import numpy as np
+
+EMPTY, PARTIAL, FULL = 0, 1, 2
+
+
+def extract_regions(mask, od_image=None, epsilon=1.0):
+    """
+    Geometry of each tissue component.
+
+    Args:
+        mask: (H, W) uint8 mask, nonzero=tissue
+        od_image: optional (H, W, 3) OD image for per-region mean OD
+        epsilon: float, polygon simplification tolerance in pixels
+            (Douglas-Peucker); 0 keeps every contour vertex
+
+    Returns:
+        regions: list of dicts, one per 8-connected component, with 'id',
+            'bbox' [x, y, width, height], 'area' (pixels), 'centroid'
+            [x, y], 'mean_od' (mean total OD, or None without an OD image),
+            'polygon' ((K, 2) int32 outline vertices, x/y) and 'holes'
+            (list of (K, 2) int32 rings)
+    """
+    import cv2
+
+    mask = np.ascontiguousarray(mask, dtype=np.uint8)
+    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    areas = stats[:, cv2.CC_STAT_AREA]
+
+    mean_od = None
+    if od_image is not None:
+        # Per-label OD sums in one pass over the image
+        total_od = od_image[..., 0] + od_image[..., 1] + od_image[..., 2]
+        od_sums = np.bincount(labels.ravel(), weights=total_od.ravel(), minlength=num_labels)
+        mean_od = od_sums / np.maximum(areas, 1)
+
+    # Two-level hierarchy: outer boundaries, and holes as their children
+    contours, hierarchy = cv2.findContours(mask, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+    outlines = {}
+    holes = {}
+    for i, contour in enumerate(contours):
+        ring = contour if epsilon <= 0 else cv2.approxPolyDP(contour, epsilon, True)
+        ring = ring.reshape(-1, 2).astype(np.int32)
+        parent = hierarchy[0][i][3]
+        if parent < 0:
+            # Outer boundary points lie on their component
+            x, y = contour[0, 0]
+            outlines[int(labels[y, x])] = (i, ring)
+        else:
+            holes.setdefault(parent, []).append(ring)
+
+    regions = []
+    for label in range(1, num_labels):
+        contour_index, polygon = outlines[label]
+        x, y, width, height = (int(v) for v in stats[label, :4])
+        regions.append({
+            'id': label - 1,
+            'bbox': [x, y, width, height],
+            'area': int(areas[label]),
+            'centroid': [float(centroids[label, 0]), float(centroids[label, 1])],
+            'mean_od': None if mean_od is None else float(mean_od[label]),
+            'polygon': polygon,
+            'holes': holes.get(contour_index, []),
+        })
+    return regions
+
+
+def regions_to_json(regions):
+    """Regions with polygons as nested lists, for JSON responses."""
+    return [
+        dict(region, polygon=region['polygon'].tolist(),
+             holes=[hole.tolist() for hole in region['holes']])
+        for region in regions
+    ]
+
+
+def _segments_intersect_box(starts, ends, box):
+    """
+    Liang-Barsky test of segments against a closed box, vectorized.
+
+    Args:
+        starts, ends: (K, 2) float segment endpoints
+        box: (xmin, ymin, xmax, ymax)
+
+    Returns:
+        hit: bool, whether any segment touches the box
+    """
+    xmin, ymin, xmax, ymax = box
+    delta = ends - starts
+    p = np.stack([-delta[:, 0], delta[:, 0], -delta[:, 1], delta[:, 1]], axis=1)
+    q = np.stack([starts[:, 0] - xmin, xmax - starts[:, 0],
+                  starts[:, 1] - ymin, ymax - starts[:, 1]], axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = q / p
+    # Parallel to a side and outside it: rejected
+    outside = np.any((p == 0) & (q < 0), axis=1)
+    t_enter = np.max(np.where(p < 0, ratio, 0.0), axis=1)
+    t_exit = np.min(np.where(p > 0, ratio, 1.0), axis=1)
+    return bool(np.any(~outside & (t_enter <= t_exit)))
+
+
+class RegionIndex:
+    """
+    Grid bucket index over region polygons.
+
+    Every `cell_size` x `cell_size` cell is EMPTY, FULL (all its pixels
+    inside tissue) or PARTIAL, and lists the regions whose bounding boxes
+    overlap it (CSR arrays). Queries on EMPTY and FULL cells are answered
+    from the grid; PARTIAL cells test the bucketed polygons exactly.
+    """
+
+    def __init__(self, shape, cell_size, cell_state, bboxes, vertices, ring_offsets,
+                 ring_region, ring_is_hole, cell_offsets, cell_regions):
+        self.shape = tuple(int(v) for v in shape)
+        self.cell_size = int(cell_size)
+        self.cell_state = cell_state
+        self.bboxes = bboxes
+        self.vertices = vertices
+        self.ring_offsets = ring_offsets
+        self.ring_region = ring_region
+        self.ring_is_hole = ring_is_hole
+        self.cell_offsets = cell_offsets
+        self.cell_regions = cell_regions
+
+        # Rings of each region, outline first
+        self._rings = [[] for _ in range(len(bboxes))]
+        for ring in np.argsort(ring_is_hole, kind='stable'):
+            self._rings[ring_region[ring]].append(int(ring))
+
+    @classmethod
+    def build(cls, regions, shape, cell_size=64):
+        """
+        Index regions from `extract_regions`.
+
+        Args:
+            regions: list of region dicts
+            shape: mask shape, (H, W)
+            cell_size: int, grid cell size in pixels
+
+        Returns:
+            RegionIndex
+        """
+        import cv2
+
+        height, width = shape[:2]
+        rows, cols = -(-height // cell_size), -(-width // cell_size)
+
+        rings, ring_region, ring_is_hole = [], [], []
+        for index, region in enumerate(regions):
+            for ring, is_hole in [(region['polygon'], False)] + [(hole, True) for hole in region['holes']]:
+                rings.append(np.asarray(ring, dtype=np.int32).reshape(-1, 2))
+                ring_region.append(index)
+                ring_is_hole.append(is_hole)
+        vertices = np.concatenate(rings) if rings else np.zeros((0, 2), dtype=np.int32)
+        ring_offsets = np.concatenate([[0], np.cumsum([len(ring) for ring in rings])]).astype(np.int64)
+
+        # Cell coverage of the rasterized polygons (even-odd: holes stay empty)
+        raster = np.zeros((rows * cell_size, cols * cell_size), dtype=np.uint8)
+        if rings:
+            cv2.fillPoly(raster, rings, 1)
+        coverage = raster.reshape(rows, cell_size, cols, cell_size).sum(axis=(1, 3), dtype=np.int64)
+        cell_heights = np.minimum(cell_size, height - np.arange(rows) * cell_size)
+        cell_widths = np.minimum(cell_size, width - np.arange(cols) * cell_size)
+        cell_state = np.full((rows, cols), PARTIAL, dtype=np.uint8)
+        cell_state[coverage == 0] = EMPTY
+        cell_state[coverage >= np.outer(cell_heights, cell_widths)] = FULL
+
+        # Bucket regions into the cells their bounding boxes overlap
+        bboxes = np.array([region['bbox'] for region in regions], dtype=np.int32).reshape(-1, 4)
+        pairs = []
+        for index, (x, y, w, h) in enumerate(bboxes):
+            cell_rows = np.arange(y // cell_size, (y + h - 1) // cell_size + 1)
+            cell_cols = np.arange(x // cell_size, (x + w - 1) // cell_size + 1)
+            cells = (cell_rows[:, np.newaxis] * cols + cell_cols).ravel()
+            pairs.append(np.stack([cells, np.full(len(cells), index)], axis=1))
+        pairs = np.concatenate(pairs) if pairs else np.zeros((0, 2), dtype=np.int64)
+        pairs = pairs[np.argsort(pairs[:, 0], kind='stable')]
+        cell_offsets = np.concatenate([[0], np.cumsum(np.bincount(pairs[:, 0], minlength=rows * cols))])
+
+        return cls((height, width), cell_size, cell_state, bboxes, vertices, ring_offsets,
+                   np.asarray(ring_region, dtype=np.int32), np.asarray(ring_is_hole, dtype=bool),
+                   cell_offsets.astype(np.int64), pairs[:, 1].astype(np.int32))
+
+    def __len__(self):
+        return len(self.bboxes)
+
+    def _ring(self, ring):
+        return self.vertices[self.ring_offsets[ring]:self.ring_offsets[ring + 1]]
+
+    def _candidates(self, cell_row, cell_col):
+        cell = cell_row * self.cell_state.shape[1] + cell_col
+        return self.cell_regions[self.cell_offsets[cell]:self.cell_offsets[cell + 1]]
+
+    def _region_contains(self, region, x, y):
+        import cv2
+
+        bx, by, bw, bh = self.bboxes[region]
+        if not (bx <= x < bx + bw and by <= y < by + bh):
+            return False
+        outline, *holes = self._rings[region]
+        point = (float(x), float(y))
+        if cv2.pointPolygonTest(self._ring(outline), point, False) < 0:
+            return False
+        # Hole outlines trace tissue pixels: only strict interiors are holes
+        return all(cv2.pointPolygonTest(self._ring(hole), point, False) <= 0 for hole in holes)
+
+    def _region_intersects_box(self, region, box):
+        xmin, ymin, xmax, ymax = box
+        bx, by, bw, bh = self.bboxes[region]
+        if bx > xmax or by > ymax or bx + bw - 1 < xmin or by + bh - 1 < ymin:
+            return False
+        for ring in self._rings[region]:
+            points = self._ring(ring).astype(np.float64)
+            if _segments_intersect_box(points, np.roll(points, -1, axis=0), box):
+                return True
+        # No boundary crosses the box: it is inside the region or outside it
+        return self._region_contains(region, xmin, ymin)
+
+    def region_at(self, x, y):
+        """
+        Region containing a point.
+
+        Returns:
+            region: int region id, or None outside tissue
+        """
+        height, width = self.shape
+        if not (0 <= x < width and 0 <= y < height):
+            return None
+        cell_row, cell_col = int(y) // self.cell_size, int(x) // self.cell_size
+        if self.cell_state[cell_row, cell_col] == EMPTY:
+            return None
+        for region in self._candidates(cell_row, cell_col):
+            if self._region_contains(region, x, y):
+                return int(region)
+        return None
+
+    def contains_point(self, x, y):
+        """Whether a point lies on tissue."""
+        height, width = self.shape
+        if not (0 <= x < width and 0 <= y < height):
+            return False
+        state = self.cell_state[int(y) // self.cell_size, int(x) // self.cell_size]
+        if state != PARTIAL:
+            return state == FULL
+        return self.region_at(x, y) is not None
+
+    def regions_in_box(self, x, y, width, height, first_only=False):
+        """
+        Regions intersecting a box.
+
+        Args:
+            x, y, width, height: box in pixels
+            first_only: bool, stop at the first hit
+
+        Returns:
+            regions: sorted list of region ids
+        """
+        box = self._clip_box(x, y, width, height)
+        if box is None:
+            return []
+        xmin, ymin, xmax, ymax = box
+        cells = self.cell_state[ymin // self.cell_size:ymax // self.cell_size + 1,
+                                xmin // self.cell_size:xmax // self.cell_size + 1]
+        if not cells.any():
+            return []
+
+        hits = []
+        candidates = set()
+        for cell_row in range(ymin // self.cell_size, ymax // self.cell_size + 1):
+            for cell_col in range(xmin // self.cell_size, xmax // self.cell_size + 1):
+                if self.cell_state[cell_row, cell_col] != EMPTY:
+                    candidates.update(int(r) for r in self._candidates(cell_row, cell_col))
+        for region in sorted(candidates):
+            if self._region_intersects_box(region, box):
+                hits.append(region)
+                if first_only:
+                    break
+        return hits
+
+    def intersects_box(self, x, y, width, height):
+        """Whether any tissue lies inside a box."""
+        box = self._clip_box(x, y, width, height)
+        if box is None:
+            return False
+        xmin, ymin, xmax, ymax = box
+        cells = self.cell_state[ymin // self.cell_size:ymax // self.cell_size + 1,
+                                xmin // self.cell_size:xmax // self.cell_size + 1]
+        if (cells == FULL).any():
+            return True
+        if not cells.any():
+            return False
+        return bool(self.regions_in_box(x, y, width, height, first_only=True))
+
+    def _clip_box(self, x, y, width, height):
+        """Closed box (xmin, ymin, xmax, ymax) clipped to the mask, or None."""
+        xmin, ymin = max(0, int(x)), max(0, int(y))
+        xmax = min(self.shape[1], int(x) + int(width)) - 1
+        ymax = min(self.shape[0], int(y) + int(height)) - 1
+        if xmax < xmin or ymax < ymin:
+            return None
+        return xmin, ymin, xmax, ymax
+
+    def save(self, file):
+        """Write the index as a compressed .npz (path or binary file)."""
+        np.savez_compressed(
+            file,
+            meta=np.array([self.shape[0], self.shape[1], self.cell_size], dtype=np.int64),
+            cell_state=self.cell_state, bboxes=self.bboxes, vertices=self.vertices,
+            ring_offsets=self.ring_offsets, ring_region=self.ring_region,
+            ring_is_hole=self.ring_is_hole, cell_offsets=self.cell_offsets,
+            cell_regions=self.cell_regions,
+        )
+
+    @classmethod
+    def load(cls, file):
+        """Read an index written by `save`."""
+        with np.load(file) as data:
+            height, width, cell_size = data['meta']
+            return cls(
+                (height, width), cell_size, data['cell_state'], data['bboxes'], data['vertices'],
+                data['ring_offsets'], data['ring_region'], data['ring_is_hole'],
+                data['cell_offsets'], data['cell_regions'],
+            )
+
+    def to_bytes(self):
+        """Serialized index (the .npz file contents)."""
+        buffer = io.BytesIO()
+        self.save(buffer)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Inverse of `to_bytes`."""
+        return cls.load(io.BytesIO(data))
@@ -0,0 +1,178 @@
+"""
+Results kept on disk for incremental ROI re-masking.
+
+Each result is a directory holding the image and mask as .npy files plus
+its slide parameters and request options, so any worker process can edit a
+result produced by another. Images and masks are memory-mapped: an ROI edit
+reads the ROI plus its halo and writes only the pages of the mask it
+changes. Edits of one result are serialized across processes by a file
+lock (POSIX `flock`).
+"""
+import contextlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+
+import numpy as np
+
+from pipeline.session import slide_parameters_from_arrays, slide_parameters_to_arrays
+
+_RESULT_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class StoredResult:
+    """
+    A result opened from a `ResultStore`.
+
+    `image` is read-only; `mask` and `tissue_pixels` may only be changed
+    inside `with result.lock():`, which saves them on exit.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        meta_path = os.path.join(directory, 'meta.json')
+        with open(meta_path) as f:
+            meta = json.load(f)
+        # Reading refreshes the expiry
+        os.utime(meta_path)
+        self.params = meta['params']
+        self.tissue_pixels = meta['tissue_pixels']
+        with np.load(os.path.join(directory, 'slide_parameters.npz'), allow_pickle=False) as arrays:
+            self.slide_parameters = slide_parameters_from_arrays(arrays)
+        self.image = np.load(os.path.join(directory, 'image.npy'), mmap_mode='r')
+        self.mask = np.load(os.path.join(directory, 'mask.npy'), mmap_mode='r+')
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Hold the result's edit lock; mask and tissue count are saved on exit."""
+        import fcntl
+
+        with open(os.path.join(self.directory, 'lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Another process may have edited the result since it was opened
+                with open(os.path.join(self.directory, 'meta.json')) as f:
+                    self.tissue_pixels = json.load(f)['tissue_pixels']
+                yield self
+                self.mask.flush()
+                _write_json(os.path.join(self.directory, 'meta.json'), {
+                    'params': self.params,
+                    'tissue_pixels': self.tissue_pixels,
+                })
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class ResultStore:
+    """
+    Directory of results addressed by random result ids.
+
+    Results are written under a temporary name and renamed when complete.
+    Results unused for `ttl_seconds` are removed, as are the least recently
+    used ones beyond `max_entries`, whenever a new one is added.
+    """
+
+    def __init__(self, directory, ttl_seconds=600, max_entries=16):
+        """
+        Args:
+            directory: str, result directory (created on first add)
+            ttl_seconds: float, idle time after which a result is removed
+            max_entries: int, results kept on disk
+        """
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+    def add(self, image, mask, slide_parameters, params):
+        """
+        Store a result.
+
+        Args:
+            image: (H, W, 3) uint8 RGB
+            mask: (H, W) uint8 mask
+            slide_parameters: dict, `slide_parameters` of the pipeline result
+            params: dict of JSON-serializable request options
+
+        Returns:
+            result_id: str
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.prune(keep=self.max_entries - 1)
+        result_id = uuid.uuid4().hex
+        path = os.path.join(self.directory, result_id)
+        tmp_path = path + '.partial'
+        try:
+            os.mkdir(tmp_path)
+            np.save(os.path.join(tmp_path, 'image.npy'), image)
+            np.save(os.path.join(tmp_path, 'mask.npy'), mask)
+            np.savez(os.path.join(tmp_path, 'slide_parameters.npz'),
+                     **slide_parameters_to_arrays(slide_parameters))
+            _write_json(os.path.join(tmp_path, 'meta.json'), {
+                'params': params,
+                # Kept up to date by ROI edits so the area fraction is never recounted
+                'tissue_pixels': int(np.count_nonzero(mask)),
+            })
+            os.rename(tmp_path, path)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        return result_id
+
+    def get(self, result_id):
+        """
+        Open a stored result.
+
+        Returns:
+            StoredResult, or None if the id is malformed, unknown or expired
+        """
+        if not _RESULT_ID.match(result_id or ''):
+            return None
+        path = os.path.join(self.directory, result_id)
+        try:
+            if os.path.getmtime(os.path.join(path, 'meta.json')) < time.time() - self.ttl_seconds:
+                return None
+            return StoredResult(path)
+        except FileNotFoundError:
+            return None
+
+    def prune(self, keep=None):
+        """
+        Remove expired results (and partial ones left by crashed writers),
+        then the least recently used beyond `keep`.
+        """
+        cutoff = time.time() - self.ttl_seconds
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return 0
+        live = []
+        removed = 0
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            partial = entry.name.endswith('.partial')
+            try:
+                mtime = os.path.getmtime(entry.path if partial else os.path.join(entry.path, 'meta.json'))
+            except FileNotFoundError:
+                mtime = 0.0
+            if mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+            elif not partial:
+                live.append((mtime, entry.path))
+        if keep is not None and len(live) > keep:
+            live.sort()
+            for _, path in live[:len(live) - max(keep, 0)]:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        return removed
+
+
+def _write_json(path, data):
+    tmp_path = f'{path}.{uuid.uuid4().hex}.partial'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
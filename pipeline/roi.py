@@ -0,0 +1,51 @@
+"""
+Region-of-interest geometry for incremental re-masking.
+"""
+
+
+def clip_roi(roi, shape):
+    """
+    Clip an (x, y, width, height) box to an image.
+
+    Args:
+        roi: (x, y, width, height)
+        shape: image shape, (H, W, ...)
+
+    Returns:
+        roi: clipped (x, y, width, height)
+
+    Raises:
+        ValueError: if the ROI does not overlap the image
+    """
+    x, y, width, height = (int(v) for v in roi)
+    image_height, image_width = shape[:2]
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(image_width, x + width), min(image_height, y + height)
+    if x1 <= x0 or y1 <= y0:
+        raise ValueError(f"ROI {tuple(roi)} does not overlap the {image_width}x{image_height} image")
+    return (x0, y0, x1 - x0, y1 - y0)
+
+
+def expand_roi(roi, halo, shape):
+    """Grow an ROI by `halo` pixels on each side, clipped to the image."""
+    x, y, width, height = roi
+    return clip_roi((x - halo, y - halo, width + 2 * halo, height + 2 * halo), shape)
+
+
+def splice_roi(mask, roi_mask, roi):
+    """
+    Write an ROI mask into a full mask in place.
+
+    Args:
+        mask: (H, W) uint8 full mask, modified in place
+        roi_mask: (height, width) uint8 mask of the ROI
+        roi: (x, y, width, height) matching `roi_mask`
+
+    Returns:
+        changed_pixels: int, tissue pixel count difference (new - old)
+    """
+    x, y, width, height = roi
+    region = mask[y:y + height, x:x + width]
+    changed_pixels = int((roi_mask > 0).sum()) - int((region > 0).sum())
+    region[...] = roi_mask
+    return changed_pixels
@@ -0,0 +1,154 @@
+"""
+Process runtime setup for serving workers.
+
+Coordinates native thread pools with the number of worker processes,
+preloads the heavy pipeline dependencies and warms the pipeline up so the
+first real request does not pay for imports and first-call initialization.
+"""
+import os
+import threading
+import time
+
+# Environment variables read by the native thread pools when they start
+THREAD_LIMIT_ENV_VARS = (
+    'OMP_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'BLIS_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+)
+
+_state_lock = threading.Lock()
+_state = {
+    'ready': False,
+    'warmup_seconds': None,
+    'threads_per_worker': None,
+}
+
+
+def threads_per_worker(workers, cpu_count=None):
+    """
+    Number of native threads each worker may use without oversubscribing.
+
+    Args:
+        workers: int, number of worker processes on the node
+        cpu_count: int, available cores (default: cores usable by this process)
+
+    Returns:
+        threads: int, at least 1
+    """
+    if cpu_count is None:
+        cpu_count = available_cpu_count()
+    return max(1, cpu_count // max(1, workers))
+
+
+def available_cpu_count():
+    """Cores usable by this process (respects CPU affinity)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def configure_thread_limits(threads, override=False):
+    """
+    Limit OpenMP/BLAS/OpenCV thread pools to `threads` per process.
+
+    The environment variables only take effect for libraries that have not
+    initialized their thread pools yet, so call this before importing numpy
+    (e.g. from the server config file). OpenCV is also limited at runtime.
+
+    Args:
+        threads: int, threads per process
+        override: bool, replace values already set in the environment
+    """
+    for name in THREAD_LIMIT_ENV_VARS:
+        if override or name not in os.environ:
+            os.environ[name] = str(threads)
+
+    try:
+        import cv2
+        cv2.setNumThreads(threads)
+    except ImportError:
+        pass
+
+    with _state_lock:
+        _state['threads_per_worker'] = threads
+
+
+def preload_modules():
+    """Import the pipeline and its heavy dependencies eagerly."""
+    import cv2  # noqa: F401
+    import scipy.ndimage  # noqa: F401
+    import scipy.signal  # noqa: F401
+    import skimage.filters  # noqa: F401
+    from . import io, metrics, morphology, normalize, od, preprocess, stain, threshold  # noqa: F401
+    from .pipeline import TissueMaskingPipeline  # noqa: F401
+
+
+def create_warmup_image(size=256):
+    """
+    Synthetic slide-like image: white glass with two stained regions.
+
+    Args:
+        size: int, image height and width
+
+    Returns:
+        rgb_image: (size, size, 3) uint8 RGB
+    """
+    import numpy as np
+
+    rgb = np.full((size, size, 3), 245, dtype=np.uint8)
+    quarter = size // 4
+    rgb[quarter:2 * quarter, quarter:3 * quarter] = [180, 110, 170]  # Hematoxylin-ish
+    rgb[2 * quarter:3 * quarter, quarter:3 * quarter] = [230, 140, 180]  # Eosin-ish
+    return rgb
+
+
+def warm_up(size=256):
+    """
+    Run a synthetic image through every pipeline configuration once.
+
+    Marks the process as ready when done.
+
+    Args:
+        size: int, warm-up image size
+
+    Returns:
+        seconds: float, time spent warming up
+    """
+    start = time.perf_counter()
+    preload_modules()
+
+    from .io import encode_image_png, encode_mask_png
+    from .pipeline import TissueMaskingPipeline
+
+    rgb = create_warmup_image(size)
+    for stain_method in ('macenko', 'none'):
+        for threshold_method in ('otsu', 'sauvola', 'auto'):
+            pipeline = TissueMaskingPipeline(
+                stain_method=stain_method,
+                threshold_method=threshold_method
+            )
+            result = pipeline.process(rgb)
+    encode_mask_png(result['mask'])
+    encode_image_png(rgb)
+
+    elapsed = time.perf_counter() - start
+    with _state_lock:
+        _state['ready'] = True
+        _state['warmup_seconds'] = elapsed
+    return elapsed
+
+
+def is_ready():
+    """True once `warm_up` has completed in this process."""
+    with _state_lock:
+        return _state['ready']
+
+
+def runtime_status():
+    """Snapshot of the runtime state for health/readiness reporting."""
+    with _state_lock:
+        return dict(_state)
@@ -0,0 +1,286 @@
+"""
+Slide-level session context.
+
+Tiles from the same slide share one set of slide parameters (stain vectors,
+white reference, normalization statistics, threshold). The first tile with
+enough tissue (or an explicit thumbnail) establishes them; later tiles reuse
+them and only run the per-pixel stages, so thresholds are consistent across
+tile borders.
+
+`SlideParameterStore` keeps established parameters on disk so that worker
+processes serving the same slide share them.
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+_PARAMETER_NAMES = ('stain_vectors', 'white_reference', 'threshold')
+
+
+class SlideContext:
+    """
+    Parameters estimated once per slide and reused for every tile.
+
+    Thread-safe: concurrent tiles may race to establish the context; the
+    first one wins and the others use its parameters from then on.
+    """
+
+    def __init__(self, min_tissue_fraction=0.05):
+        """
+        Args:
+            min_tissue_fraction: float, fraction of tissue-like pixels a tile
+                needs before its parameters are trusted for the whole slide
+        """
+        self.min_tissue_fraction = min_tissue_fraction
+        self._lock = threading.Lock()
+        self._params = None
+        self.tiles_processed = 0
+
+    @property
+    def is_established(self):
+        return self._params is not None
+
+    def establish(self, stain_vectors=None, white_reference=255.0, threshold=None,
+                  concentration_stats=None):
+        """
+        Store slide parameters unless another tile already did.
+
+        Args:
+            stain_vectors: (2, 3) array, or None for stain_method='none'
+            white_reference: float or (3,) array used for OD conversion
+            threshold: float, global threshold on the threshold input
+            concentration_stats: dict with per-stain 'mean'/'std' used for
+                normalization, or None
+
+        Returns:
+            established: bool, True if these parameters were stored
+        """
+        with self._lock:
+            if self._params is not None:
+                return False
+            self._params = {
+                'stain_vectors': stain_vectors,
+                'white_reference': white_reference,
+                'threshold': threshold,
+                'concentration_stats': concentration_stats,
+            }
+            return True
+
+    def get(self, name):
+        """Established parameter value (None before establishment)."""
+        params = self._params
+        return None if params is None else params[name]
+
+    @property
+    def parameters(self):
+        """Established parameters as `establish` keyword arguments, or None."""
+        params = self._params
+        return None if params is None else dict(params)
+
+    def adopt(self, parameters):
+        """
+        Replace the parameters with ones established elsewhere (e.g. by
+        another worker process that saved them first).
+        """
+        with self._lock:
+            self._params = dict(parameters)
+
+    def record_tile(self):
+        with self._lock:
+            self.tiles_processed += 1
+
+
+class TTLCache:
+    """
+    Thread-safe mapping whose entries expire after `ttl_seconds` of disuse.
+
+    Reads refresh the expiry. When full, the least recently used entry is
+    evicted.
+    """
+
+    def __init__(self, ttl_seconds=1800, max_entries=1000, clock=time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+
+    def _purge_expired_locked(self, now):
+        expired = [key for key, (_, expires_at) in self._entries.items() if expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+
+    def get(self, key, default=None):
+        with self._lock:
+            now = self._clock()
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= now:
+                self._entries.pop(key, None)
+                return default
+            self._entries[key] = (entry[0], now + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            now = self._clock()
+            self._purge_expired_locked(now)
+            self._entries[key] = (value, now + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_create(self, key, factory):
+        """
+        Return the live value for `key`, creating it with `factory()` if needed.
+
+        Returns:
+            (value, created): tuple
+        """
+        with self._lock:
+            now = self._clock()
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries[key] = (entry[0], now + self.ttl_seconds)
+                self._entries.move_to_end(key)
+                return entry[0], False
+            self._purge_expired_locked(now)
+            value = factory()
+            self._entries[key] = (value, now + self.ttl_seconds)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return value, True
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return default if entry is None else entry[0]
+
+    def __len__(self):
+        with self._lock:
+            self._purge_expired_locked(self._clock())
+            return len(self._entries)
+
+
+class SlideParameterStore:
+    """
+    Established slide parameters on disk, shared by worker processes.
+
+    One .npz file per session key (arrays keep their dtype, so every worker
+    computes with exactly the same values). The first process to save a key
+    wins; later saves return the stored parameters instead. Files unused for
+    `ttl_seconds` are removed whenever a new key is saved.
+    """
+
+    def __init__(self, directory, ttl_seconds=1800):
+        """
+        Args:
+            directory: str, where parameters are stored (created on first save)
+            ttl_seconds: float, idle time after which a session is removed
+        """
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+
+    def _path(self, key):
+        digest = hashlib.sha256(json.dumps(list(key)).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + '.npz')
+
+    def load(self, key):
+        """
+        Stored parameters for `key` (refreshing its expiry), or None.
+
+        Returns:
+            parameters: dict of `SlideContext.establish` keyword arguments
+        """
+        path = self._path(key)
+        try:
+            if os.path.getmtime(path) < time.time() - self.ttl_seconds:
+                return None
+            with np.load(path, allow_pickle=False) as arrays:
+                parameters = slide_parameters_from_arrays(arrays)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return parameters
+
+    def save(self, key, parameters):
+        """
+        Store parameters for `key` unless another process already did.
+
+        Returns:
+            (parameters, saved): the stored parameters (the existing ones if
+                `saved` is False) and whether these were stored
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.prune()
+        path = self._path(key)
+        buffer = io.BytesIO()
+        np.savez(buffer, **slide_parameters_to_arrays(parameters))
+        tmp_path = f'{path}.{uuid.uuid4().hex}.partial'
+        with open(tmp_path, 'wb') as f:
+            f.write(buffer.getbuffer())
+        try:
+            # Atomic and exclusive: fails if the key was saved in the meantime
+            os.link(tmp_path, path)
+        except FileExistsError:
+            stored = self.load(key)
+            if stored is not None:
+                return stored, False
+            # Expired: replace it
+            os.replace(tmp_path, path)
+            return parameters, True
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return parameters, True
+
+    def prune(self):
+        """Remove expired sessions (and partial files left by crashed writers)."""
+        cutoff = time.time() - self.ttl_seconds
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return 0
+        removed = 0
+        for entry in entries:
+            if not entry.name.endswith(('.npz', '.partial')):
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+
+def slide_parameters_to_arrays(parameters):
+    """Named arrays of slide parameters, for `np.savez` (None values left out)."""
+    arrays = {name: np.asarray(parameters[name])
+              for name in _PARAMETER_NAMES if parameters.get(name) is not None}
+    for name, value in (parameters.get('concentration_stats') or {}).items():
+        arrays['concentration_stats.' + name] = np.asarray(value)
+    return arrays
+
+
+def slide_parameters_from_arrays(arrays):
+    """Slide parameters from `slide_parameters_to_arrays` output (e.g. an NpzFile)."""
+    parameters = {name: None for name in _PARAMETER_NAMES}
+    concentration_stats = {}
+    for name in arrays.files:
+        value = arrays[name]
+        # Scalars were Python floats
+        value = float(value) if value.ndim == 0 else value
+        if name.startswith('concentration_stats.'):
+            concentration_stats[name[len('concentration_stats.'):]] = value
+        else:
+            parameters[name] = value
+    parameters['concentration_stats'] = concentration_stats or None
+    return parameters
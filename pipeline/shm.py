@@ -0,0 +1,393 @@
+"""
+Shared-memory transport for process-pool workers.
+
+Images and masks are placed in named `multiprocessing.shared_memory`
+segments; only segment names, shapes and dtypes cross the process
+boundary, so a 100-megapixel image costs a few hundred bytes of IPC
+instead of a 300 MB pickle.
+
+Every segment is created through a `SharedMemoryRegistry`, which owns it
+until it is released: segments are unlinked when their job finishes (or
+fails), and anything still registered when the registry closes is
+reported as a leak (ResourceWarning) and unlinked.
+"""
+import os
+import threading
+import time
+import warnings
+from collections import namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Picklable reference to a segment, all a worker needs to attach to it
+SharedArrayHandle = namedtuple('SharedArrayHandle', ['name', 'shape', 'dtype'])
+
+_worker_pipeline = None
+
+
+class SharedArray:
+    """
+    A numpy array backed by a named shared memory segment.
+
+    Views returned by `array` are only valid until `close`; closing with
+    views still alive raises BufferError rather than leaving them dangling.
+    """
+
+    def __init__(self, segment, shape, dtype, owner=False):
+        """
+        Args:
+            segment: multiprocessing.shared_memory.SharedMemory
+            shape: tuple, array shape
+            dtype: numpy dtype
+            owner: bool, whether `unlink` removes the segment
+        """
+        self.segment = segment
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = owner
+        self._array = np.ndarray(self.shape, dtype=self.dtype, buffer=segment.buf)
+
+    @classmethod
+    def create(cls, shape, dtype):
+        """Allocate a new (uninitialized) segment owned by this process."""
+        nbytes = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        segment = shared_memory.SharedMemory(create=True, size=nbytes)
+        return cls(segment, shape, dtype, owner=True)
+
+    @classmethod
+    def attach(cls, handle):
+        """
+        Attach to a segment created by another process.
+
+        Raises:
+            FileNotFoundError: if the segment no longer exists
+        """
+        segment = shared_memory.SharedMemory(name=handle.name)
+        return cls(segment, handle.shape, handle.dtype)
+
+    @property
+    def name(self):
+        return self.segment.name
+
+    @property
+    def nbytes(self):
+        return self._array.nbytes
+
+    @property
+    def array(self):
+        """The shared array (a view; valid until `close`)."""
+        if self._array is None:
+            raise ValueError(f"Shared array {self.name} is closed")
+        return self._array
+
+    @property
+    def handle(self):
+        """SharedArrayHandle to pass to other processes."""
+        return SharedArrayHandle(self.name, self.shape, self.dtype.str)
+
+    def close(self):
+        """
+        Detach this process from the segment.
+
+        If views are still referenced elsewhere (e.g. by the traceback of a
+        failed job) the mapping stays until they are garbage collected.
+        """
+        if self._array is not None:
+            self._array = None
+            try:
+                self.segment.close()
+            except BufferError:
+                pass
+
+    def unlink(self):
+        """Close and remove the segment (owner only)."""
+        self.close()
+        if self.owner:
+            try:
+                self.segment.unlink()
+            except FileNotFoundError:
+                pass
+            self.owner = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SharedMemoryRegistry:
+    """
+    Owner-side bookkeeping of live shared memory segments.
+
+    Thread-safe. Tracks segment counts and bytes (current and peak) and
+    reports segments that outlive their expected lifetime.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._live = {}  # name -> (SharedArray, label, created_at)
+        self._created = 0
+        self._released = 0
+        self._live_bytes = 0
+        self._peak_bytes = 0
+
+    def create(self, shape, dtype, label=None):
+        """
+        Allocate a registered segment.
+
+        Args:
+            shape: tuple, array shape
+            dtype: numpy dtype
+            label: optional str describing the segment, used in leak reports
+
+        Returns:
+            SharedArray owned by this registry until `release`
+        """
+        shared = SharedArray.create(shape, dtype)
+        with self._lock:
+            self._live[shared.name] = (shared, label, time.monotonic())
+            self._created += 1
+            self._live_bytes += shared.nbytes
+            self._peak_bytes = max(self._peak_bytes, self._live_bytes)
+        return shared
+
+    def put(self, array, label=None):
+        """Copy an array into a new registered segment."""
+        shared = self.create(array.shape, array.dtype, label=label)
+        shared.array[...] = array
+        return shared
+
+    def release(self, shared):
+        """
+        Unlink a registered segment. Releasing twice is a no-op.
+
+        Returns:
+            released: bool, False if the segment was not registered
+        """
+        with self._lock:
+            entry = self._live.pop(shared.name, None)
+            if entry is None:
+                return False
+            self._released += 1
+            self._live_bytes -= shared.nbytes
+        shared.unlink()
+        return True
+
+    def live_segments(self, older_than=None):
+        """
+        Segments not yet released.
+
+        Args:
+            older_than: float, only segments created more than this many
+                seconds ago
+
+        Returns:
+            segments: list of dicts with 'name', 'label', 'nbytes' and
+                'age_seconds'
+        """
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self._live.values())
+        segments = [
+            {'name': shared.name, 'label': label, 'nbytes': shared.nbytes,
+             'age_seconds': now - created_at}
+            for shared, label, created_at in entries
+        ]
+        if older_than is not None:
+            segments = [segment for segment in segments if segment['age_seconds'] > older_than]
+        return segments
+
+    def close(self):
+        """
+        Unlink every remaining segment, warning about each as a leak.
+
+        Returns:
+            leaked: list of leaked segment descriptions (see `live_segments`)
+        """
+        leaked = self.live_segments()
+        for segment in leaked:
+            warnings.warn(
+                f"Shared memory segment {segment['name']} ({segment['label']}, "
+                f"{segment['nbytes']} bytes) was never released",
+                ResourceWarning, stacklevel=2,
+            )
+        with self._lock:
+            entries = [entry[0] for entry in self._live.values()]
+        for shared in entries:
+            self.release(shared)
+        return leaked
+
+    def stats(self):
+        """Snapshot of segment counters."""
+        with self._lock:
+            return {
+                'created': self._created,
+                'released': self._released,
+                'live_segments': len(self._live),
+                'live_bytes': self._live_bytes,
+                'peak_bytes': self._peak_bytes,
+            }
+
+
+def _init_worker(pipeline_options, threads):
+    """Process pool initializer: limit threads and build the pipeline once."""
+    global _worker_pipeline
+    if threads:
+        from . import runtime
+        runtime.configure_thread_limits(threads, override=True)
+
+    from .pipeline import TissueMaskingPipeline
+    _worker_pipeline = TissueMaskingPipeline(**pipeline_options)
+
+
+def _process_shared(image_handle, mask_handle):
+    """
+    Worker job: mask the image in one segment into another.
+
+    Returns:
+        dict with the small results: 'metrics', 'slide_parameters' and
+        'seconds'
+    """
+    start = time.perf_counter()
+    image = SharedArray.attach(image_handle)
+    mask = SharedArray.attach(mask_handle)
+    try:
+        result = _worker_pipeline.process(image.array)
+        mask.array[...] = result['mask']
+        # Drop views into the segments before detaching
+        del result['mask'], result['od_image']
+        result.pop('normalized_rgb', None)
+    finally:
+        image.close()
+        mask.close()
+
+    return {
+        'metrics': result['metrics'],
+        'slide_parameters': result['slide_parameters'],
+        'seconds': time.perf_counter() - start,
+        'worker_pid': os.getpid(),
+    }
+
+
+class SharedMemoryPipelinePool:
+    """
+    Process pool running `TissueMaskingPipeline.process` over shared memory.
+
+    The input image is copied once into a shared segment (or decoded
+    straight into one from `allocate_image`), workers attach by name and
+    write the mask into a second segment. Both segments are released when
+    the job completes, fails or the pool shuts down.
+    """
+
+    def __init__(self, workers=2, pipeline_options=None, threads=None):
+        """
+        Args:
+            workers: int, worker processes
+            pipeline_options: dict of TissueMaskingPipeline keyword arguments
+            threads: int, native threads per worker (default: cores / workers)
+        """
+        from . import runtime
+
+        if threads is None:
+            threads = runtime.threads_per_worker(workers)
+        self.workers = workers
+        self.registry = SharedMemoryRegistry()
+        self._pool = ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker,
+            initargs=(dict(pipeline_options or {}), threads),
+        )
+
+    def allocate_image(self, shape):
+        """
+        Registered (H, W, 3) uint8 segment to decode an image into.
+
+        Passing it to `submit` avoids the copy into shared memory; the
+        caller releases it with `release` once the job is done.
+        """
+        return self.registry.create(tuple(shape[:2]) + (3,), np.uint8, label='image')
+
+    def release(self, shared):
+        """Release a segment from `allocate_image` or `submit(copy_mask=False)`."""
+        self.registry.release(shared)
+
+    def submit(self, image, copy_mask=True):
+        """
+        Schedule one image.
+
+        Args:
+            image: (H, W, 3) uint8 RGB array, copied into shared memory, or
+                a SharedArray from `allocate_image` (used as is)
+            copy_mask: bool, return the mask as a private array and release
+                its segment; if False, 'mask' is the SharedArray itself and
+                the caller must `release` it
+
+        Returns:
+            future: concurrent.futures.Future resolving to a dict with
+                'mask', 'metrics', 'slide_parameters' and 'seconds'
+        """
+        owns_image = not isinstance(image, SharedArray)
+        shared_image = self.registry.put(image, label='image') if owns_image else image
+        try:
+            shared_mask = self.registry.create(shared_image.shape[:2], np.uint8, label='mask')
+        except BaseException:
+            if owns_image:
+                self.registry.release(shared_image)
+            raise
+
+        result_future = Future()
+
+        def _done(job):
+            if owns_image:
+                self.registry.release(shared_image)
+            error = job.exception()
+            if error is not None:
+                self.registry.release(shared_mask)
+                result_future.set_exception(error)
+                return
+            result = job.result()
+            if copy_mask:
+                result['mask'] = shared_mask.array.copy()
+                self.registry.release(shared_mask)
+            else:
+                result['mask'] = shared_mask
+            result_future.set_result(result)
+
+        try:
+            job = self._pool.submit(_process_shared, shared_image.handle, shared_mask.handle)
+        except BaseException:
+            if owns_image:
+                self.registry.release(shared_image)
+            self.registry.release(shared_mask)
+            raise
+        job.add_done_callback(_done)
+        return result_future
+
+    def map(self, images, copy_mask=True):
+        """Process images in order; yields result dicts as from `submit`."""
+        futures = [self.submit(image, copy_mask=copy_mask) for image in images]
+        for future in futures:
+            yield future.result()
+
+    def stats(self):
+        """Segment counters (see SharedMemoryRegistry.stats)."""
+        return dict(self.registry.stats(), workers=self.workers)
+
+    def shutdown(self, wait=True):
+        """
+        Stop the workers and unlink remaining segments.
+
+        Returns:
+            leaked: segments that were still registered (see
+                SharedMemoryRegistry.close)
+        """
+        self._pool.shutdown(wait=wait, cancel_futures=not wait)
+        return self.registry.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
@@ -0,0 +1,256 @@
+"""
+Pyramidal (multi-resolution) TIFF slide reader.
+
+Opens whole-slide TIFFs, selects the coarsest pyramid level that still meets
+a requested resolution, and decodes only the tiles that level needs, so a
+tissue outline never requires decoding the full-resolution image.
+
+Requires `tifffile` (and `imagecodecs` for JPEG/JPEG2000-compressed tiles).
+"""
+import math
+import re
+from collections import namedtuple
+
+import numpy as np
+
+TIFF_MAGIC = (b'II*\x00', b'MM\x00*', b'II+\x00', b'MM\x00+')
+
+# Centimeter and inch resolution units → microns
+_RESOLUTION_UNIT_MICRONS = {2: 25400.0, 3: 10000.0}
+_APERIO_MPP = re.compile(r'MPP\s*=\s*([0-9.]+)')
+
+PyramidLevel = namedtuple('PyramidLevel', ['index', 'width', 'height', 'downsample', 'mpp'])
+
+
+def is_tiff(image_file):
+    """
+    Check the TIFF magic bytes without consuming the file.
+
+    Args:
+        image_file: seekable file-like object
+
+    Returns:
+        bool
+    """
+    position = image_file.tell()
+    try:
+        return image_file.read(4) in TIFF_MAGIC
+    finally:
+        image_file.seek(position)
+
+
+def _level0_mpp(page):
+    """Microns per pixel (x, y) of a TIFF page, or None if unknown."""
+    match = _APERIO_MPP.search(page.description or '')
+    if match:
+        mpp = float(match.group(1))
+        return (mpp, mpp)
+
+    x_res = page.tags.get('XResolution')
+    y_res = page.tags.get('YResolution')
+    unit = page.tags.get('ResolutionUnit')
+    if x_res is None or y_res is None or unit is None:
+        return None
+    microns = _RESOLUTION_UNIT_MICRONS.get(int(unit.value))
+    if microns is None:
+        return None
+
+    def _per_pixel(value):
+        numerator, denominator = value
+        return microns * denominator / numerator if numerator else None
+
+    mpp = (_per_pixel(x_res.value), _per_pixel(y_res.value))
+    return None if None in mpp else mpp
+
+
+class SlideReader:
+    """
+    Reader for a pyramidal TIFF.
+
+    Level 0 is the full-resolution image; each further level is a
+    downsampled copy. Flat (single-level) TIFFs are read as one level.
+    """
+
+    def __init__(self, source):
+        """
+        Args:
+            source: path or seekable binary file-like object
+        """
+        import tifffile
+
+        self._tiff = tifffile.TiffFile(source)
+        series = self._tiff.series[0]
+        pages = [level.keyframe for level in series.levels]
+
+        base = pages[0]
+        base_mpp = _level0_mpp(base)
+        self._pages = pages
+        self.levels = []
+        for index, page in enumerate(pages):
+            downsample = (base.imagewidth / page.imagewidth, base.imagelength / page.imagelength)
+            mpp = None
+            if base_mpp is not None:
+                mpp = (base_mpp[0] * downsample[0], base_mpp[1] * downsample[1])
+            self.levels.append(PyramidLevel(index, page.imagewidth, page.imagelength, downsample, mpp))
+
+    def close(self):
+        self._tiff.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def select_level(self, target_mpp=None, max_dimension=None):
+        """
+        Pick the pyramid level to mask at.
+
+        - target_mpp: coarsest level whose resolution is at least as fine
+          as `target_mpp` microns per pixel
+        - max_dimension: finest level whose width and height both fit in
+          `max_dimension` pixels (coarsest level if none fits)
+
+        With both, the coarser of the two choices is used so the decode cost
+        stays bounded. With neither, level 0.
+
+        Args:
+            target_mpp: float, requested microns per pixel
+            max_dimension: int, maximum width/height in pixels
+
+        Returns:
+            level: int, index into `self.levels`
+
+        Raises:
+            ValueError: if `target_mpp` is given but the slide has no
+                resolution metadata
+        """
+        choice = 0
+
+        if target_mpp is not None:
+            if self.levels[0].mpp is None:
+                raise ValueError("Slide has no resolution metadata; use max_dimension instead")
+            # Small tolerance for rounding in stored resolutions
+            meets = [level.index for level in self.levels
+                     if max(level.mpp) <= target_mpp * 1.001]
+            choice = max(choice, max(meets) if meets else 0)
+
+        if max_dimension is not None:
+            fits = [level.index for level in self.levels
+                    if max(level.width, level.height) <= max_dimension]
+            choice = max(choice, min(fits) if fits else len(self.levels) - 1)
+
+        return choice
+
+    def read_region(self, level=0, x=0, y=0, width=None, height=None):
+        """
+        Decode a region of a level as RGB, touching only intersecting tiles.
+
+        Args:
+            level: int, pyramid level
+            x, y: int, region origin in level pixels
+            width, height: int, region size (default: to the level edge)
+
+        Returns:
+            rgb_image: (height, width, 3) uint8 RGB; sparse (empty) tiles
+                read as white background
+        """
+        page = self._pages[level]
+        info = self.levels[level]
+        width = info.width - x if width is None else width
+        height = info.height - y if height is None else height
+        if width <= 0 or height <= 0 or x < 0 or y < 0 \
+                or x + width > info.width or y + height > info.height:
+            raise ValueError(f"Region ({x}, {y}, {width}, {height}) outside level {level} "
+                             f"({info.width}x{info.height})")
+
+        if not page.is_tiled or page.planarconfig != 1:
+            # Strip-organized or planar levels: decode the level directly
+            return _to_rgb(page.asarray()[y:y + height, x:x + width])
+
+        tile_w, tile_h = page.tilewidth, page.tilelength
+        tiles_across = math.ceil(info.width / tile_w)
+        region = np.empty((height, width, page.samplesperpixel), dtype=page.dtype)
+        background = np.iinfo(page.dtype).max if page.dtype.kind == 'u' else 0
+
+        filehandle = self._tiff.filehandle
+        for tile_row in range(y // tile_h, (y + height - 1) // tile_h + 1):
+            for tile_col in range(x // tile_w, (x + width - 1) // tile_w + 1):
+                index = tile_row * tiles_across + tile_col
+                tile_y, tile_x = tile_row * tile_h, tile_col * tile_w
+
+                # Intersection of this tile with the region, in level pixels
+                top, left = max(y, tile_y), max(x, tile_x)
+                bottom = min(y + height, tile_y + tile_h)
+                right = min(x + width, tile_x + tile_w)
+                target = region[top - y:bottom - y, left - x:right - x]
+
+                if not page.databytecounts[index]:
+                    # Sparse tile (never written): background
+                    target[...] = background
+                    continue
+                filehandle.seek(page.dataoffsets[index])
+                data = filehandle.read(page.databytecounts[index])
+                tile = page.decode(data, index, jpegtables=page.jpegtables)[0][0]
+                target[...] = tile[top - tile_y:bottom - tile_y, left - tile_x:right - tile_x]
+
+        return _to_rgb(region)
+
+    def read_level(self, level):
+        """Decode a whole level as RGB."""
+        return self.read_region(level)
+
+
+def _to_rgb(pixels):
+    """Convert decoded samples (gray, RGB, RGBA; 8 or 16 bit) to uint8 RGB."""
+    if pixels.ndim == 2:
+        pixels = pixels[:, :, np.newaxis]
+    if pixels.dtype == np.uint16:
+        pixels = (pixels >> 8).astype(np.uint8)
+    elif pixels.dtype != np.uint8:
+        raise ValueError(f"Unsupported slide sample type: {pixels.dtype}")
+    if pixels.shape[2] == 1:
+        return np.repeat(pixels, 3, axis=2)
+    if pixels.shape[2] > 3:
+        return np.ascontiguousarray(pixels[:, :, :3])
+    return pixels
+
+
+def selected_level_size(source, target_mpp=None, max_dimension=None):
+    """
+    (width, height) of the level `read_slide_for_masking` would decode.
+
+    Reads only the TIFF directory, not pixel data.
+    """
+    with SlideReader(source) as reader:
+        info = reader.levels[reader.select_level(target_mpp=target_mpp, max_dimension=max_dimension)]
+        return info.width, info.height
+
+
+def read_slide_for_masking(source, target_mpp=None, max_dimension=None):
+    """
+    Decode the pyramid level to mask at.
+
+    Args:
+        source: path or seekable binary file-like object
+        target_mpp: float, requested microns per pixel
+        max_dimension: int, maximum width/height in pixels
+
+    Returns:
+        rgb_image: (H, W, 3) uint8 RGB of the selected level
+        slide_info: dict with 'level', 'level_count', 'level_dimensions',
+            'scale_factor' (level-0 pixels per level pixel, [x, y]) and
+            'mpp' ([x, y] or None)
+    """
+    with SlideReader(source) as reader:
+        level = reader.select_level(target_mpp=target_mpp, max_dimension=max_dimension)
+        rgb_image = reader.read_level(level)
+        info = reader.levels[level]
+        slide_info = {
+            'level': level,
+            'level_count': len(reader.levels),
+            'level_dimensions': [info.width, info.height],
+            'scale_factor': list(info.downsample),
+            'mpp': list(info.mpp) if info.mpp is not None else None,
+        }
+    return rgb_image, slide_info
@@ -5,7 +5,7 @@ Estimates dominant stain vectors using SVD on OD pixels.
 import numpy as np
 
 
-def estimate_stain_vectors_macenko(od_image, alpha=1.0, beta=0.15):
+def estimate_stain_vectors_macenko(od_image, alpha=1.0, beta=0.15, weights=None):
     """
     Estimate stain vectors using Macenko method.
     
@@ -19,6 +19,8 @@ def estimate_stain_vectors_macenko(od_image, alpha=1.0, beta=0.15):
         od_image: (H, W, 3) float32 OD image
         alpha: percentile for stain vector selection (default 1.0 = 99th)
         beta: OD threshold to exclude background (default 0.15)
+        weights: optional (H, W) pixel weights, e.g. how often each entry
+            of a per-color OD table occurs in the image
     
     Returns:
         stain_vectors: (2, 3) array, normalized stain vectors
@@ -29,9 +31,17 @@ def estimate_stain_vectors_macenko(od_image, alpha=1.0, beta=0.15):
     tissue_mask = total_od > beta
     tissue_pixels = pixels[tissue_mask]
     
-    if len(tissue_pixels) < 100:
+    tissue_weights = None
+    tissue_count = len(tissue_pixels)
+    if weights is not None:
+        weights = weights.reshape(-1)
+        tissue_weights = weights[tissue_mask]
+        tissue_count = tissue_weights.sum()
+    
+    if tissue_count < 100:
         # Fallback: use all pixels
         tissue_pixels = pixels
+        tissue_weights = weights
     
     # Step 2: Normalize to unit vectors (project onto plane)
     # This removes intensity variation, keeping only color direction
@@ -39,16 +49,25 @@ def estimate_stain_vectors_macenko(od_image, alpha=1.0, beta=0.15):
     norms[norms == 0] = 1.0  # Avoid division by zero
     normalized_pixels = tissue_pixels / norms
     
+    if tissue_weights is not None:
+        # Same principal directions as repeating each row `weight` times
+        normalized_pixels = normalized_pixels * np.sqrt(tissue_weights).astype(
+            normalized_pixels.dtype)[:, np.newaxis]
+    
     # Step 3: SVD to find principal directions
     # The two dominant directions correspond to stain vectors
     U, S, Vt = np.linalg.svd(normalized_pixels.T, full_matrices=False)
     
     # Step 4: Extract stain vectors (first two principal components)
-    stain_vectors = Vt[:2, :]  # (2, 3)
+    # normalized_pixels.T is (3, N), so the color-space directions are the
+    # columns of U
+    stain_vectors = U[:, :2].T  # (2, 3)
     
     # Step 5: Ensure vectors point in correct direction
-    # (Hematoxylin should be bluer, Eosin redder)
-    # This is stain-specific and may need adjustment
+    # SVD signs are arbitrary; stains absorb, so orient each vector towards
+    # positive total OD. This also makes the result independent of how the
+    # pixels were weighted or ordered.
+    stain_vectors = stain_vectors * np.where(stain_vectors.sum(axis=1) < 0, -1, 1)[:, np.newaxis]
     
     # Step 6: Normalize stain vectors
     stain_vectors = stain_vectors / np.linalg.norm(stain_vectors, axis=1, keepdims=True)
@@ -56,6 +75,55 @@ def estimate_stain_vectors_macenko(od_image, alpha=1.0, beta=0.15):
     return stain_vectors
 
 
+def stain_projection_matrix(stain_vectors):
+    """
+    Least-squares projection from OD to stain concentrations.
+    
+    C = OD @ P, with P = S (S^T S)^(-1) and S = stain_vectors^T.
+    
+    Args:
+        stain_vectors: (2, 3) stain vectors
+    
+    Returns:
+        projection: (3, 2) float64 projection matrix
+    """
+    stain_matrix = stain_vectors.T  # (3, 2)
+    gram_matrix = stain_matrix.T @ stain_matrix  # (2, 2)
+    
+    # Avoid singular matrix
+    if np.linalg.cond(gram_matrix) > 1e10:
+        # Fallback: use pseudo-inverse
+        return stain_matrix @ np.linalg.pinv(gram_matrix)
+    return stain_matrix @ np.linalg.inv(gram_matrix)
+
+
+def project_concentrations(od_image, projection):
+    """
+    Apply an OD → concentration projection pixel by pixel.
+    
+    Evaluated as explicit per-channel multiply-adds rather than a BLAS
+    matmul, so each pixel's result is independent of how the image is split
+    into bands.
+    
+    Args:
+        od_image: (H, W, 3) OD image
+        projection: (3, 2) projection matrix
+    
+    Returns:
+        concentrations: (H, W, 2) non-negative concentration maps, in the
+            OD image's float precision
+    """
+    projection = np.asarray(projection, dtype=od_image.dtype)
+    concentrations = od_image[..., 0:1] * projection[0]
+    concentrations += od_image[..., 1:2] * projection[1]
+    concentrations += od_image[..., 2:3] * projection[2]
+    
+    # Clamp negative values (non-physical)
+    np.maximum(concentrations, 0, out=concentrations)
+    
+    return concentrations
+
+
 def extract_stain_concentrations(od_image, stain_vectors):
     """
     Extract stain concentrations using least squares.
@@ -70,24 +138,84 @@ def extract_stain_concentrations(od_image, stain_vectors):
     Returns:
         concentrations: (H, W, 2) concentration maps
     """
-    pixels = od_image.reshape(-1, 3)  # (N, 3)
+    return project_concentrations(od_image, stain_projection_matrix(stain_vectors))
+
+
+def estimate_stain_vectors_macenko_batch(od_batch, beta=0.15):
+    """
+    Macenko stain vectors of a stack of same-shaped images.
     
-    # Solve: OD = C @ stain_vectors^T
-    # C = OD @ stain_vectors @ (stain_vectors^T @ stain_vectors)^(-1)
-    stain_matrix = stain_vectors.T  # (3, 2)
-    gram_matrix = stain_matrix.T @ stain_matrix  # (2, 2)
+    The left singular vectors of the (3, N) unit-OD matrix are the
+    eigenvectors of its 3x3 Gram matrix, so each image reduces to one
+    masked batched matmul and the eigendecompositions of all images run
+    together. Same vectors as `estimate_stain_vectors_macenko` up to
+    floating point rounding.
     
-    # Avoid singular matrix
-    if np.linalg.cond(gram_matrix) > 1e10:
-        # Fallback: use pseudo-inverse
-        concentrations = pixels @ stain_matrix @ np.linalg.pinv(gram_matrix)
-    else:
-        concentrations = pixels @ stain_matrix @ np.linalg.inv(gram_matrix)
+    Args:
+        od_batch: (N, H, W, 3) float32 OD images
+        beta: OD threshold to exclude background (default 0.15)
     
-    # Reshape back to image
-    concentrations = concentrations.reshape(od_image.shape[0], od_image.shape[1], 2)
+    Returns:
+        stain_vectors: (N, 2, 3) array, normalized stain vectors per image
+    """
+    pixels = od_batch.reshape(len(od_batch), -1, 3)
+    
+    # Step 1: Tissue pixels as 0/1 weights (all pixels below 100 tissue pixels)
+    tissue_mask = (pixels[..., 0] + pixels[..., 1] + pixels[..., 2]) > beta
+    weights = tissue_mask.astype(pixels.dtype)
+    weights[np.count_nonzero(tissue_mask, axis=1) < 100] = 1.0
+    
+    # Step 2: Unit vectors, folded into the weights: u u^T = p p^T / |p|^2
+    squared_norms = np.einsum('npi,npi->np', pixels, pixels)
+    np.divide(weights, squared_norms, out=weights, where=squared_norms > 0)
+    weights[squared_norms == 0] = 0.0
+    
+    # Step 3: Gram matrices (N, 3, 3) and their eigenvectors, largest first
+    gram = np.matmul((pixels * weights[:, :, np.newaxis]).transpose(0, 2, 1), pixels)
+    _, eigenvectors = np.linalg.eigh(gram.astype(np.float64))
+    stain_vectors = eigenvectors[:, :, [2, 1]].transpose(0, 2, 1)  # (N, 2, 3)
+    
+    # Step 4: Orient towards positive total OD and normalize
+    stain_vectors = stain_vectors * np.where(stain_vectors.sum(axis=2) < 0, -1, 1)[:, :, np.newaxis]
+    return stain_vectors / np.linalg.norm(stain_vectors, axis=2, keepdims=True)
+
+
+def stain_projection_matrix_batch(stain_vectors):
+    """
+    `stain_projection_matrix` for a stack of stain vectors.
     
-    # Clamp negative values (non-physical)
-    concentrations = np.maximum(concentrations, 0)
+    Args:
+        stain_vectors: (N, 2, 3) stain vectors
+    
+    Returns:
+        projection: (N, 3, 2) float64 projection matrices
+    """
+    stain_matrix = np.asarray(stain_vectors, dtype=np.float64).transpose(0, 2, 1)  # (N, 3, 2)
+    gram_matrix = np.matmul(stain_matrix.transpose(0, 2, 1), stain_matrix)  # (N, 2, 2)
+    # Pseudo-inverse: equals the inverse unless a matrix is singular
+    return np.matmul(stain_matrix, np.linalg.pinv(gram_matrix))
+
+
+def project_concentrations_batch(od_batch, projections):
+    """
+    `project_concentrations` for a stack of images.
     
+    One batched BLAS matmul: several times faster than broadcast
+    multiply-adds over the 2-wide concentration axis. Results may differ
+    from `project_concentrations` in the last bit.
+    
+    Args:
+        od_batch: (N, H, W, 3) OD images
+        projections: (N, 3, 2) projection matrices
+    
+    Returns:
+        concentrations: (N, H, W, 2) non-negative concentration maps, in
+            the OD images' float precision
+    """
+    projections = np.asarray(projections, dtype=od_batch.dtype)
+    pixels = od_batch.reshape(len(od_batch), -1, 3)
+    concentrations = np.matmul(pixels, projections).reshape(od_batch.shape[:-1] + (2,))
+    
+    # Clamp negative values (non-physical)
+    np.maximum(concentrations, 0, out=concentrations)
     return concentrations
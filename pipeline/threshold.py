@@ -3,8 +3,9 @@ Adaptive thresholding in OD space.
 Supports Otsu, Sauvola, and auto method selection.
 """
 import numpy as np
-from skimage.filters import threshold_otsu, threshold_sauvola
-from scipy import signal
+
+# skimage.filters and scipy.signal are imported inside the functions that use
+# them: together they dominate `import pipeline` time.
 
 
 def otsu_threshold(od_channel):
@@ -27,6 +28,7 @@ def otsu_threshold(od_channel):
     if len(flat) == 0:
         return 0.0
     
+    from skimage.filters import threshold_otsu
     threshold = threshold_otsu(flat)
     return threshold
 
@@ -45,6 +47,7 @@ def sauvola_threshold(od_channel, window_size=15, k=0.2, R=128):
     Returns:
         threshold: float, mean threshold value
     """
+    from skimage.filters import threshold_sauvola
     threshold_map = threshold_sauvola(
         od_channel,
         window_size=window_size,
@@ -74,6 +77,8 @@ def auto_threshold(od_channel):
     if len(flat) == 0:
         return 0.0
     
+    from scipy import signal
+    
     # Check if histogram is bimodal
     hist, bins = np.histogram(flat, bins=50)
     peaks, _ = signal.find_peaks(hist, height=np.max(hist) * 0.1)
@@ -86,6 +91,39 @@ def auto_threshold(od_channel):
         return sauvola_threshold(od_channel)
 
 
+def compute_threshold(od_channel, method='auto'):
+    """
+    Select a global threshold for an OD channel.
+    
+    Args:
+        od_channel: (H, W) float32 OD channel
+        method: 'otsu', 'sauvola', or 'auto'
+    
+    Returns:
+        threshold: float, threshold value
+    """
+    if method == 'otsu':
+        return otsu_threshold(od_channel)
+    elif method == 'sauvola':
+        return sauvola_threshold(od_channel)
+    else:  # 'auto'
+        return auto_threshold(od_channel)
+
+
+def binarize(od_channel, threshold):
+    """
+    Create binary mask from a threshold.
+    
+    Args:
+        od_channel: (H, W) OD channel
+        threshold: float, threshold value
+    
+    Returns:
+        mask: (H, W) uint8, 0=background, 255=tissue
+    """
+    return (od_channel > threshold).astype(np.uint8) * 255
+
+
 def apply_threshold(od_channel, method='auto'):
     """
     Apply threshold and create binary mask.
@@ -97,12 +135,122 @@ def apply_threshold(od_channel, method='auto'):
     Returns:
         mask: (H, W) uint8, 0=background, 255=tissue
     """
+    threshold = compute_threshold(od_channel, method=method)
+    return binarize(od_channel, threshold)
+
+
+def _histograms(values, cutoffs, nbins):
+    """
+    Histograms of each row's values below its cutoff.
+    
+    Binned row by row with np.histogram: at tile sizes its blocked C loop
+    is several times faster than a vectorized bincount over all rows.
+    
+    Args:
+        values: (N, P) float array
+        cutoffs: (N,) exclusive upper bounds
+        nbins: int
+    
+    Returns:
+        counts: (N, nbins) int64
+        edges: (N, nbins + 1) bin edges in the dtype of `values`
+        empty: (N,) bool, rows without values below the cutoff
+    """
+    counts = np.zeros((len(values), nbins), dtype=np.int64)
+    edges = np.zeros((len(values), nbins + 1), dtype=values.dtype)
+    empty = np.zeros(len(values), dtype=bool)
+    for i, (row, cutoff) in enumerate(zip(values, cutoffs)):
+        kept = row[row < cutoff]
+        if len(kept) == 0:
+            empty[i] = True
+            continue
+        counts[i], edges[i] = np.histogram(kept, bins=nbins)
+    return counts, edges, empty
+
+
+def _otsu_from_histograms(counts, edges):
+    """Row-wise Otsu threshold from histograms (as skimage's threshold_otsu)."""
+    counts = counts.astype(np.float32)
+    centers = (edges[:, :-1] + edges[:, 1:]) / 2.0
+    
+    # Class probabilities and means for all possible thresholds
+    weight1 = np.cumsum(counts, axis=1)
+    weight2 = np.cumsum(counts[:, ::-1], axis=1)[:, ::-1]
+    # Empty rows divide by zero; callers replace their thresholds
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean1 = np.cumsum(counts * centers, axis=1) / weight1
+        mean2 = (np.cumsum((counts * centers)[:, ::-1], axis=1) / weight2[:, ::-1])[:, ::-1]
+    variance12 = weight1[:, :-1] * weight2[:, 1:] * (mean1[:, :-1] - mean2[:, 1:]) ** 2
+    
+    best = np.argmax(variance12, axis=1)
+    return centers[np.arange(len(centers)), best]
+
+
+def _clipped_values(od_channels):
+    """Flattened channels and each channel's 99.9th percentile."""
+    flat = od_channels.reshape(len(od_channels), -1)
+    return flat, np.percentile(flat, 99.9, axis=1)
+
+
+def otsu_threshold_batch(od_channels):
+    """
+    Otsu thresholds for a stack of channels.
+    
+    Percentiles and the Otsu search over the stacked histograms are
+    vectorized across channels.
+    
+    Args:
+        od_channels: (N, H, W) float32 OD channels
+    
+    Returns:
+        thresholds: (N,) float array, equal to `otsu_threshold` per channel
+    """
+    flat, cutoffs = _clipped_values(od_channels)
+    counts, edges, empty = _histograms(flat, cutoffs, 256)
+    thresholds = _otsu_from_histograms(counts, edges).astype(np.float64)
+    
+    # Single-valued rows: that value (as skimage); empty rows: 0.0
+    constant = ~empty & (np.count_nonzero(counts, axis=1) == 1)
+    for i in np.flatnonzero(constant):
+        row = flat[i]
+        kept = row[row < cutoffs[i]]
+        if np.all(kept == kept[0]):
+            thresholds[i] = kept[0]
+    thresholds[empty] = 0.0
+    return thresholds
+
+
+def compute_threshold_batch(od_channels, method='auto'):
+    """
+    Global thresholds for a stack of same-shaped channels.
+    
+    Otsu and the bimodality test of 'auto' are evaluated for all channels
+    at once; Sauvola (a local filter) still runs channel by channel.
+    
+    Args:
+        od_channels: (N, H, W) float32 OD channels
+        method: 'otsu', 'sauvola', or 'auto'
+    
+    Returns:
+        thresholds: (N,) float64
+    """
     if method == 'otsu':
-        threshold = otsu_threshold(od_channel)
-    elif method == 'sauvola':
-        threshold = sauvola_threshold(od_channel)
-    else:  # 'auto'
-        threshold = auto_threshold(od_channel)
+        return otsu_threshold_batch(od_channels)
+    if method == 'sauvola':
+        return np.array([sauvola_threshold(channel) for channel in od_channels], dtype=np.float64)
+    
+    from scipy import signal
+    
+    flat, cutoffs = _clipped_values(od_channels)
+    hist, _, empty = _histograms(flat, cutoffs, 50)
+    bimodal = np.zeros(len(od_channels), dtype=bool)
+    for i in np.flatnonzero(~empty):
+        peaks, _ = signal.find_peaks(hist[i], height=np.max(hist[i]) * 0.1)
+        bimodal[i] = len(peaks) >= 2
     
-    mask = (od_channel > threshold).astype(np.uint8) * 255
-    return mask
+    thresholds = np.zeros(len(od_channels), dtype=np.float64)
+    if bimodal.any():
+        thresholds[bimodal] = otsu_threshold_batch(od_channels[bimodal])
+    for i in np.flatnonzero(~bimodal & ~empty):
+        thresholds[i] = sauvola_threshold(od_channels[i])
+    return thresholds
@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+"""
+Mask every image under a directory tree on a local process pool.
+
+Masks and metrics are written to a mirrored output tree. The input may also
+be a zip or tar archive, read entry by entry without extracting it. Every
+finished file is appended to a manifest, so an interrupted run picks up where
+it stopped: files whose path, size and modification time match a manifest
+entry are skipped.
+
+Usage:
+    python scripts/batch_mask.py --input_dir /data/slides --output_dir /data/masks
+    python scripts/batch_mask.py --input_dir /data/slides --output_dir /data/masks \\
+        --workers 8 --stain_method none --max_dimension 4096
+    python scripts/batch_mask.py --input_dir /data/slides --output_dir /data/masks --regions
+    python scripts/batch_mask.py --input_dir /data/slides --output_dir /data/masks \\
+        --mask_format tiff --mask_pyramid
+    python scripts/batch_mask.py --input_dir /data/tiles.tar.gz --output_dir /data/masks
+"""
+import argparse
+import io
+import json
+import os
+import posixpath
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+# Only stdlib-level imports here: numpy must load after thread limits are set
+from pipeline import runtime  # noqa: E402
+
+VALID_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.tif', '.tiff'}
+MANIFEST_NAME = 'manifest.jsonl'
+# Archive entries larger than this fail individually (as BATCH_MAX_ENTRY_BYTES)
+MAX_ENTRY_BYTES = 256 * 1024 * 1024
+
+_worker_pipeline = None
+_worker_options = None
+
+
+def find_images(input_dir):
+    """Yield image paths relative to `input_dir`, in a stable order."""
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            if os.path.splitext(filename)[1].lower() in VALID_EXTENSIONS:
+                yield os.path.relpath(os.path.join(root, filename), input_dir)
+
+
+def file_signature(path):
+    """(size, mtime_ns) used to detect files changed since the last run."""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def load_manifest(manifest_path):
+    """
+    Read finished entries from a previous run.
+
+    Returns:
+        done: dict mapping relative path to (size, mtime_ns)
+    """
+    done = {}
+    if not os.path.exists(manifest_path):
+        return done
+    with open(manifest_path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # Truncated last line from an interrupted run
+                continue
+            if entry.get('status') == 'done':
+                done[entry['path']] = (entry['size'], entry['mtime_ns'])
+    return done
+
+
+def output_paths(output_dir, relpath, mask_format='png'):
+    """Mask (PNG or tiled TIFF) and metrics JSON paths for an input file."""
+    stem = os.path.splitext(relpath)[0]
+    return (
+        os.path.join(output_dir, stem + ('_mask.tif' if mask_format == 'tiff' else '_mask.png')),
+        os.path.join(output_dir, stem + '_metrics.json'),
+    )
+
+
+def region_paths(output_dir, relpath):
+    """Region geometry JSON and spatial index paths for an input file."""
+    stem = os.path.splitext(relpath)[0]
+    return (
+        os.path.join(output_dir, stem + '_regions.json'),
+        os.path.join(output_dir, stem + '_regions.npz'),
+    )
+
+
+def _init_worker(options, threads):
+    """Process pool initializer: limit threads and build the pipeline once."""
+    global _worker_pipeline, _worker_options
+    runtime.configure_thread_limits(threads, override=True)
+
+    from pipeline.pipeline import TissueMaskingPipeline
+    _worker_options = options
+    _worker_pipeline = TissueMaskingPipeline(
+        normalize=options['normalize'],
+        stain_method=options['stain_method'],
+        threshold_method=options['threshold_method'],
+        stain_type=options['stain_type'],
+        regions=options.get('regions', False),
+        adaptive_white_reference=options.get('adaptive_white_reference', False),
+    )
+
+
+def _atomic_write(path, write):
+    """Write via a temporary file so interrupted runs never leave partial outputs."""
+    tmp_path = path + '.tmp'
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _mask_file(relpath):
+    """Worker job: decode, mask and write outputs for one file."""
+    with open(os.path.join(_worker_options['input_dir'], relpath), 'rb') as f:
+        return _mask_source(relpath, f)
+
+
+def _mask_entry(relpath, data):
+    """Worker job: mask one archive entry from its encoded bytes."""
+    return _mask_source(relpath, io.BytesIO(data))
+
+
+def _mask_source(relpath, f):
+    """Decode an open image file, mask it and write the outputs for `relpath`."""
+    import cv2
+    from pipeline.io import decode_image
+    from pipeline.slide import is_tiff, read_slide_for_masking
+
+    options = _worker_options
+    start = time.perf_counter()
+
+    slide_info = None
+    wants_level = options['target_mpp'] is not None or options['max_dimension'] is not None
+    if wants_level and is_tiff(f):
+        rgb_image, slide_info = read_slide_for_masking(
+            f, target_mpp=options['target_mpp'], max_dimension=options['max_dimension']
+        )
+    else:
+        rgb_image = decode_image(f)
+
+    result = _worker_pipeline.process(rgb_image)
+
+    mask_format = options.get('mask_format', 'png')
+    mask_path, metrics_path = output_paths(options['output_dir'], relpath, mask_format)
+    os.makedirs(os.path.dirname(mask_path), exist_ok=True)
+
+    if mask_format == 'tiff':
+        from pipeline.mask_tiff import iter_mask_tiles, write_mask_tiff
+
+        def _write_mask(path):
+            # Tile by tile: no encoded copy of the whole mask in memory
+            write_mask_tiff(path, iter_mask_tiles(result['mask'], 512), result['mask'].shape,
+                            pyramid=options.get('mask_pyramid', False))
+    else:
+        success, mask_png = cv2.imencode('.png', result['mask'])
+        if not success:
+            raise ValueError(f"Failed to encode mask for {relpath}")
+
+        def _write_mask(path):
+            with open(path, 'wb') as out:
+                out.write(mask_png)
+
+    if options.get('regions'):
+        from pipeline.regions import RegionIndex, regions_to_json
+
+        regions_path, index_path = region_paths(options['output_dir'], relpath)
+
+        def _write_regions(path):
+            with open(path, 'w') as out:
+                json.dump(regions_to_json(result['regions']), out)
+
+        def _write_index(path):
+            with open(path, 'wb') as out:
+                RegionIndex.build(result['regions'], result['mask'].shape).save(out)
+
+        _atomic_write(regions_path, _write_regions)
+        _atomic_write(index_path, _write_index)
+
+    def _write_metrics(path):
+        with open(path, 'w') as out:
+            json.dump({
+                'source': relpath,
+                'shape': list(rgb_image.shape[:2]),
+                'metrics': result['metrics'],
+                'slide': slide_info,
+            }, out, indent=2)
+
+    _atomic_write(mask_path, _write_mask)
+    _atomic_write(metrics_path, _write_metrics)
+
+    height, width = rgb_image.shape[:2]
+    return {
+        'path': relpath,
+        'megapixels': width * height / 1e6,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def archive_output_relpath(name):
+    """
+    Output-relative path for an archive entry name.
+
+    Raises:
+        ValueError: for absolute names or names escaping the output tree
+    """
+    relpath = posixpath.normpath(name)
+    if relpath.startswith('/') or relpath == '..' or relpath.startswith('../'):
+        raise ValueError(f"Unsafe archive entry name: {name!r}")
+    return relpath
+
+
+def is_archive(path):
+    """Whether `path` is a zip or tar archive (judged from its leading bytes)."""
+    from pipeline.archive import archive_format
+
+    with open(path, 'rb') as f:
+        return archive_format(f) is not None
+
+
+def _archive_jobs(archive_path, done, counts, max_entry_bytes):
+    """
+    Jobs for the image entries of an archive, read one at a time.
+
+    Entries already in the manifest with the same size and modification
+    time are skipped (counted in `counts['skipped']`); entries larger than
+    `max_entry_bytes` fail without being read.
+    """
+    from pipeline.archive import iter_archive_images
+
+    with open(archive_path, 'rb') as archive:
+        for entry in iter_archive_images(archive, max_entry_bytes=max_entry_bytes):
+            signature = (entry.size, int(entry.mtime * 1e9))
+            try:
+                relpath = archive_output_relpath(entry.name)
+            except ValueError as e:
+                yield entry.name, signature, None, str(e)
+                continue
+            if entry.error is not None:
+                yield relpath, signature, None, entry.error
+                continue
+            if done.get(relpath) == signature:
+                counts['skipped'] += 1
+                continue
+            yield relpath, signature, _mask_entry, (relpath, entry.file.getvalue())
+
+
+def run_batch(input_dir, output_dir, options, workers, max_entry_bytes=MAX_ENTRY_BYTES):
+    """
+    Mask all pending files and append them to the manifest.
+
+    `input_dir` may also be a zip or tar archive: its image entries are
+    streamed to the workers one at a time without extracting it, and
+    outputs mirror the paths inside the archive. Entries larger than
+    `max_entry_bytes` are recorded as failed.
+
+    Returns:
+        summary: dict with counts and throughput
+
+    Raises:
+        ValueError: if `input_dir` is a file but not a zip or tar archive
+    """
+    if os.path.isfile(input_dir) and not is_archive(input_dir):
+        raise ValueError(f"{input_dir} is not a directory or a zip/tar archive")
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    done = load_manifest(manifest_path)
+
+    counts = {'skipped': 0}
+    if os.path.isfile(input_dir):
+        jobs = _archive_jobs(input_dir, done, counts, max_entry_bytes)
+        total = '?'
+    else:
+        pending = []
+        for relpath in find_images(input_dir):
+            signature = file_signature(os.path.join(input_dir, relpath))
+            if done.get(relpath) == signature:
+                counts['skipped'] += 1
+            else:
+                pending.append((relpath, signature, _mask_file, (relpath,)))
+        print(f"{len(pending)} to process, {counts['skipped']} already done")
+        jobs = iter(pending)
+        total = len(pending)
+
+    options = dict(options, input_dir=input_dir, output_dir=output_dir)
+    threads = runtime.threads_per_worker(workers)
+    # Inherited by the workers before they import numpy
+    runtime.configure_thread_limits(threads)
+    processed = failed = 0
+    megapixels = 0.0
+    start = time.perf_counter()
+
+    with open(manifest_path, 'a') as manifest, ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(options, threads)
+    ) as pool:
+        in_flight = {}
+
+        def _record(relpath, signature, record=None, error=None):
+            nonlocal processed, failed, megapixels
+            size, mtime_ns = signature
+            entry = {'path': relpath, 'size': size, 'mtime_ns': mtime_ns}
+            if error is None:
+                entry.update(record, status='done')
+                processed += 1
+                megapixels += record['megapixels']
+            else:
+                entry.update(status='failed', error=error)
+                failed += 1
+                print(f"Error processing {relpath}: {error}")
+            manifest.write(json.dumps(entry) + '\n')
+            manifest.flush()
+
+        def _fill():
+            # Keep a bounded number of jobs queued so memory stays flat
+            for relpath, signature, job, args in jobs:
+                if job is None:
+                    _record(relpath, signature, error=args)
+                    continue
+                in_flight[pool.submit(job, *args)] = (relpath, signature)
+                if len(in_flight) >= workers * 2:
+                    break
+
+        _fill()
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                relpath, signature = in_flight.pop(future)
+                try:
+                    _record(relpath, signature, record=future.result())
+                except Exception as e:
+                    _record(relpath, signature, error=str(e))
+            _fill()
+
+            elapsed = time.perf_counter() - start
+            print(f"\r{processed + failed}/{total} "
+                  f"({processed / elapsed:.2f} images/s, {megapixels / elapsed:.1f} MP/s)",
+                  end='', flush=True)
+
+    elapsed = time.perf_counter() - start
+    print()
+    return {
+        'processed': processed,
+        'failed': failed,
+        'skipped': counts['skipped'],
+        'seconds': elapsed,
+        'images_per_second': processed / elapsed if elapsed > 0 else 0.0,
+        'megapixels_per_second': megapixels / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch tissue masking for local directories')
+    parser.add_argument('--input_dir', required=True,
+                        help='Directory tree of images, or a zip/tar archive of images')
+    parser.add_argument('--output_dir', required=True, help='Directory for masks, metrics and manifest')
+    parser.add_argument('--workers', type=int, default=runtime.available_cpu_count(),
+                        help='Worker processes (default: available cores)')
+    parser.add_argument('--normalize', action='store_true', help='Enable stain normalization')
+    parser.add_argument('--stain_method', default='macenko', choices=['macenko', 'none'])
+    parser.add_argument('--threshold_method', default='auto', choices=['otsu', 'sauvola', 'auto'])
+    parser.add_argument('--stain_type', default='HE', choices=['HE', 'IHC', 'PAP'])
+    parser.add_argument('--target_mpp', type=float, default=None,
+                        help='Pyramidal TIFFs: mask at this resolution (microns per pixel)')
+    parser.add_argument('--max_dimension', type=int, default=None,
+                        help='Pyramidal TIFFs: mask at the finest level fitting this size')
+    parser.add_argument('--regions', action='store_true',
+                        help='Also write region geometry (*_regions.json) and spatial index (*_regions.npz)')
+    parser.add_argument('--adaptive_white_reference', action='store_true',
+                        help='Estimate each image\'s white reference from its background')
+    parser.add_argument('--mask_format', default='png', choices=['png', 'tiff'],
+                        help='Mask output: PNG, or tiled deflate-compressed TIFF (*_mask.tif)')
+    parser.add_argument('--mask_pyramid', action='store_true',
+                        help='With --mask_format tiff: add 2x reduced levels')
+    parser.add_argument('--max_entry_bytes', type=int, default=MAX_ENTRY_BYTES,
+                        help='Archive input: entries larger than this fail (default: 256 MB)')
+
+    args = parser.parse_args()
+    if os.path.isfile(args.input_dir) and not is_archive(args.input_dir):
+        parser.error(f"--input_dir {args.input_dir} is not a directory or a zip/tar archive")
+
+    options = {
+        'normalize': args.normalize,
+        'stain_method': args.stain_method,
+        'threshold_method': args.threshold_method,
+        'stain_type': args.stain_type,
+        'target_mpp': args.target_mpp,
+        'max_dimension': args.max_dimension,
+        'regions': args.regions,
+        'adaptive_white_reference': args.adaptive_white_reference,
+        'mask_format': args.mask_format,
+        'mask_pyramid': args.mask_pyramid,
+    }
+    summary = run_batch(args.input_dir, args.output_dir, options, args.workers,
+                        max_entry_bytes=args.max_entry_bytes)
+
+    print(f"\nProcessed: {summary['processed']}  Failed: {summary['failed']}  "
+          f"Skipped: {summary['skipped']}")
+    print(f"Throughput: {summary['images_per_second']:.2f} images/s, "
+          f"{summary['megapixels_per_second']:.1f} MP/s ({summary['seconds']:.1f}s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Measure the cold-start cost of importing the pipeline.
+
+Each run imports the module in a fresh interpreter with `-X importtime`,
+so results reflect process start and autoscaled pod cold starts.
+
+Usage:
+    python scripts/benchmark_import_time.py
+    python scripts/benchmark_import_time.py --module pipeline --runs 10 --max-ms 250
+    python scripts/benchmark_import_time.py --output bench_output.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Dependencies that must only be loaded on the code paths that need them
+HEAVY_MODULES = ('cv2', 'skimage', 'scipy', 'django')
+
+
+def parse_importtime(stderr):
+    """
+    Parse `-X importtime` output.
+
+    Returns:
+        entries: list of (module, self_us, cumulative_us)
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3:
+            continue
+        self_us, cumulative_us, module = fields
+        entries.append((module.strip(), int(self_us), int(cumulative_us)))
+    return entries
+
+
+def measure_once(module):
+    """
+    Import `module` in a fresh interpreter.
+
+    Returns:
+        dict with 'cumulative_ms', 'entries' and 'heavy_loaded'
+    """
+    code = (
+        f"import sys, json; import {module}; "
+        f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    )
+    env = dict(os.environ)
+    env.pop('DJANGO_SETTINGS_MODULE', None)
+    env['PYTHONPATH'] = REPO_ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    entries = parse_importtime(proc.stderr)
+    cumulative_us = next((c for name, _, c in entries if name == module), 0)
+    return {
+        'cumulative_ms': cumulative_us / 1000.0,
+        'entries': entries,
+        'heavy_loaded': json.loads(proc.stdout.strip().splitlines()[-1]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pipeline import time')
+    parser.add_argument('--module', default='pipeline', help='Module to import')
+    parser.add_argument('--runs', type=int, default=5, help='Number of fresh interpreters')
+    parser.add_argument('--top', type=int, default=10, help='Slowest modules to list')
+    parser.add_argument('--max-ms', type=float, default=None,
+                        help='Fail if the median import time exceeds this')
+    parser.add_argument('--output', default=None, help='Write results as JSON')
+    args = parser.parse_args()
+
+    runs = [measure_once(args.module) for _ in range(args.runs)]
+    times = [run['cumulative_ms'] for run in runs]
+    median_ms = statistics.median(times)
+    heavy_loaded = sorted({name for run in runs for name in run['heavy_loaded']})
+
+    slowest = sorted(runs[-1]['entries'], key=lambda entry: entry[1], reverse=True)[:args.top]
+
+    print(f"import {args.module}: median {median_ms:.1f} ms "
+          f"(min {min(times):.1f}, max {max(times):.1f}, {args.runs} runs)")
+    print(f"Heavy modules loaded: {', '.join(heavy_loaded) or 'none'}")
+    print("\nSlowest modules (self time):")
+    for name, self_us, cumulative_us in slowest:
+        print(f"  {self_us / 1000.0:8.1f} ms  {name}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'module': args.module,
+                'runs_ms': times,
+                'median_ms': median_ms,
+                'heavy_modules_loaded': heavy_loaded,
+                'slowest_modules': [
+                    {'module': name, 'self_ms': s / 1000.0, 'cumulative_ms': c / 1000.0}
+                    for name, s, c in slowest
+                ],
+            }, f, indent=2)
+
+    if args.max_ms is not None and median_ms > args.max_ms:
+        print(f"\nFAIL: median {median_ms:.1f} ms exceeds {args.max_ms:.1f} ms")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,609 @@
+#!/usr/bin/env python
+"""
+End-to-end HTTP load test of the masking service.
+
+Starts the service locally (Django runserver or gunicorn), replays a
+weighted mix of image sizes and parameter combinations at a fixed
+concurrency, and reports latency percentiles, throughput and the resident
+memory of the server processes. Results are saved as JSON so serving
+configurations can be compared run against run.
+
+Usage:
+    python scripts/load_test.py --requests 200 --concurrency 4
+    python scripts/load_test.py --server gunicorn --workers 4 --mix mix.json \\
+        --output results/gunicorn_4w.json --compare results/baseline.json
+    python scripts/load_test.py --url http://localhost:8000 --duration 60
+
+A mix file is a JSON list of scenarios:
+    [{"name": "tile_512", "size": [512, 512], "weight": 3,
+      "params": {"threshold_method": "otsu", "return_overlay": "true"}}]
+"""
+import argparse
+import datetime
+import http.client
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROJECT_DIR = os.path.join(REPO_ROOT, 'tissue_service')
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+DEFAULT_ENDPOINT = '/api/v1/tissue/mask/'
+READY_PATH = '/api/v1/health/ready/'
+DEFAULT_OUTPUT_DIR = os.path.join(REPO_ROOT, 'data', 'load_tests')
+
+DEFAULT_MIX = [
+    {'name': 'tile_512_default', 'size': [512, 512], 'weight': 4, 'params': {}},
+    {'name': 'tile_512_otsu_overlay', 'size': [512, 512], 'weight': 2,
+     'params': {'threshold_method': 'otsu', 'return_overlay': 'true'}},
+    {'name': 'image_1024_normalize', 'size': [1024, 1024], 'weight': 2,
+     'params': {'normalize': 'true'}},
+    {'name': 'image_2048_sauvola', 'size': [2048, 1536], 'weight': 1,
+     'params': {'threshold_method': 'sauvola', 'stain_method': 'none'}},
+]
+
+# Server settings recorded with the results
+RECORDED_ENV_VARS = (
+    'WEB_CONCURRENCY', 'PIPELINE_THREADS', 'PIPELINE_INTRA_IMAGE_THREADS',
+    'PIPELINE_EXECUTOR_WORKERS', 'GUNICORN_TIMEOUT', 'SERVER_INTERFACE',
+)
+
+
+def make_test_image(width, height, seed=0):
+    """
+    Synthetic slide-like image: stained regions with texture on glass.
+
+    Returns:
+        rgb_image: (height, width, 3) uint8 RGB
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    rgb = np.full((height, width, 3), 242, dtype=np.int16)
+    for _ in range(6):
+        cy, cx = rng.integers(0, height), rng.integers(0, width)
+        ry, rx = rng.integers(height // 10, height // 3 + 1), rng.integers(width // 10, width // 3 + 1)
+        yy, xx = np.ogrid[:height, :width]
+        blob = ((yy - cy) / ry) ** 2 + ((xx - cx) / rx) ** 2 <= 1.0
+        rgb[blob] = rng.choice([[180, 110, 170], [230, 140, 180], [150, 90, 150]])
+    rgb += rng.integers(-12, 13, size=rgb.shape, dtype=np.int16)
+    return np.clip(rgb, 0, 255).astype(np.uint8)
+
+
+def encode_test_image(rgb_image, image_format='jpeg'):
+    """Encode an RGB image as JPEG or PNG bytes."""
+    import cv2
+
+    extension = '.png' if image_format == 'png' else '.jpg'
+    success, buffer = cv2.imencode(extension, cv2.cvtColor(rgb_image, cv2.COLOR_RGB2BGR))
+    if not success:
+        raise ValueError(f"Failed to encode test image as {image_format}")
+    return buffer.tobytes()
+
+
+def build_multipart(fields, file_field, filename, file_bytes):
+    """
+    multipart/form-data request body.
+
+    Returns:
+        (body, content_type)
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; '
+        f'filename="{filename}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode()
+    )
+    parts.append(file_bytes)
+    parts.append(f'\r\n--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def prepare_scenarios(mix):
+    """Encode each scenario's image and request body once."""
+    scenarios = []
+    for index, scenario in enumerate(mix):
+        width, height = scenario['size']
+        image_format = scenario.get('format', 'jpeg')
+        image_bytes = encode_test_image(make_test_image(width, height, seed=index), image_format)
+        body, content_type = build_multipart(
+            {key: str(value) for key, value in scenario.get('params', {}).items()},
+            'image', f"{scenario['name']}.{'png' if image_format == 'png' else 'jpg'}", image_bytes
+        )
+        scenarios.append(dict(
+            scenario, body=body, content_type=content_type,
+            endpoint=scenario.get('endpoint', DEFAULT_ENDPOINT),
+            megapixels=width * height / 1e6, weight=scenario.get('weight', 1),
+        ))
+    return scenarios
+
+
+def free_port():
+    """An unused local TCP port."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(server, port, workers, log_file):
+    """
+    Start the service in its own process group.
+
+    Args:
+        server: 'runserver' or 'gunicorn'
+        port: int
+        workers: int, gunicorn worker processes
+        log_file: file object receiving the server output
+
+    Returns:
+        process: subprocess.Popen
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = REPO_ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    if server == 'gunicorn':
+        env['WEB_CONCURRENCY'] = str(workers)
+        env['PORT'] = str(port)
+        command = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(PROJECT_DIR, 'gunicorn.conf.py'),
+                   '--bind', f'127.0.0.1:{port}']
+        cwd = REPO_ROOT
+    elif server == 'runserver':
+        # Warm up on startup so the readiness probe turns green
+        env['PIPELINE_WARMUP'] = '1'
+        command = [sys.executable, 'manage.py', 'runserver', '--noreload', f'127.0.0.1:{port}']
+        cwd = PROJECT_DIR
+    else:
+        raise ValueError(f"Unknown server: {server}")
+    return subprocess.Popen(command, cwd=cwd, env=env, stdout=log_file, stderr=subprocess.STDOUT,
+                            start_new_session=True)
+
+
+def stop_server(process, timeout=15):
+    """SIGTERM the server's process group, SIGKILL if it does not exit."""
+    if process.poll() is not None:
+        return
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+    except ProcessLookupError:
+        pass
+
+
+def wait_until_ready(host, port, timeout=120, process=None):
+    """Poll the readiness endpoint until it returns 200."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode} before becoming ready")
+        connection = http.client.HTTPConnection(host, port, timeout=5)
+        try:
+            connection.request('GET', READY_PATH)
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        finally:
+            connection.close()
+        time.sleep(0.25)
+    raise TimeoutError(f"Server not ready after {timeout}s")
+
+
+def process_tree(root_pid):
+    """PIDs of a process and all its descendants (Linux /proc)."""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name may contain spaces: parse after its ')'
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    pids, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(children.get(pid, []))
+    return pids
+
+
+def rss_bytes(pid):
+    """Resident set size of a process, or None if it is gone."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+class RSSSampler:
+    """Background sampling of the RSS of a server process tree."""
+
+    def __init__(self, root_pid, interval=0.5):
+        self.root_pid = root_pid
+        self.interval = interval
+        self._peak = {}
+        self._last = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        for pid in process_tree(self.root_pid):
+            rss = rss_bytes(pid)
+            if rss is not None:
+                self._last[pid] = rss
+                self._peak[pid] = max(rss, self._peak.get(pid, 0))
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._sample()
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        """
+        Stop sampling.
+
+        Returns:
+            dict with per-process and total peak RSS in MB
+        """
+        self._sample()
+        self._stop.set()
+        self._thread.join()
+        processes = [
+            {'pid': pid, 'role': 'master' if pid == self.root_pid else 'worker',
+             'peak_rss_mb': self._peak[pid] / 2 ** 20, 'last_rss_mb': self._last[pid] / 2 ** 20}
+            for pid in sorted(self._peak)
+        ]
+        return {
+            'processes': processes,
+            'total_peak_rss_mb': sum(p['peak_rss_mb'] for p in processes),
+            'max_worker_peak_rss_mb': max(
+                (p['peak_rss_mb'] for p in processes if p['role'] == 'worker'),
+                default=processes[0]['peak_rss_mb'] if processes else 0.0
+            ),
+        }
+
+
+def send_request(host, port, scenario, timeout=300):
+    """
+    POST one scenario.
+
+    Returns:
+        record: dict with 'scenario', 'status', 'latency_ms' and
+            'response_bytes' (status 0 on connection errors)
+    """
+    start = time.perf_counter()
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        connection.request('POST', scenario['endpoint'], body=scenario['body'],
+                           headers={'Content-Type': scenario['content_type']})
+        response = connection.getresponse()
+        payload = response.read()
+        status = response.status
+    except OSError as e:
+        payload, status = str(e).encode(), 0
+    finally:
+        connection.close()
+    return {
+        'scenario': scenario['name'],
+        'status': status,
+        'latency_ms': (time.perf_counter() - start) * 1000.0,
+        'response_bytes': len(payload),
+    }
+
+
+def percentile(values, q):
+    """Linear-interpolated percentile of a non-empty list (as numpy's default)."""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(records, seconds, megapixels_by_scenario):
+    """
+    Latency and throughput statistics.
+
+    Args:
+        records: list of request records from `send_request`
+        seconds: float, wall-clock duration of the measured phase
+        megapixels_by_scenario: dict, image size of each scenario
+
+    Returns:
+        dict with 'overall' and per-scenario 'scenarios' statistics
+    """
+    def _stats(group):
+        ok = [r['latency_ms'] for r in group if 200 <= r['status'] < 300]
+        statuses = {}
+        for r in group:
+            statuses[str(r['status'])] = statuses.get(str(r['status']), 0) + 1
+        stats = {
+            'requests': len(group),
+            'errors': len(group) - len(ok),
+            'status_counts': statuses,
+            'requests_per_second': len(ok) / seconds if seconds > 0 else 0.0,
+            'megapixels_per_second': sum(
+                megapixels_by_scenario[r['scenario']] for r in group if 200 <= r['status'] < 300
+            ) / seconds if seconds > 0 else 0.0,
+        }
+        if ok:
+            stats.update({
+                'latency_ms_mean': sum(ok) / len(ok),
+                'latency_ms_p50': percentile(ok, 50),
+                'latency_ms_p95': percentile(ok, 95),
+                'latency_ms_p99': percentile(ok, 99),
+                'latency_ms_max': max(ok),
+            })
+        return stats
+
+    by_scenario = {}
+    for record in records:
+        by_scenario.setdefault(record['scenario'], []).append(record)
+    return {
+        'overall': _stats(records),
+        'scenarios': {name: _stats(group) for name, group in sorted(by_scenario.items())},
+    }
+
+
+def run_load(host, port, scenarios, concurrency, num_requests=None, duration=None, seed=0):
+    """
+    Closed-loop load: `concurrency` clients issue requests back to back.
+
+    Scenarios are drawn by weight from a seeded generator, so runs with the
+    same arguments replay the same request sequence.
+
+    Returns:
+        records: list of request records
+        seconds: float, wall-clock duration
+    """
+    rng = random.Random(seed)
+    weights = [scenario['weight'] for scenario in scenarios]
+    lock = threading.Lock()
+    records = []
+    issued = [0]
+    start = time.perf_counter()
+    deadline = start + duration if duration else None
+
+    def _next_scenario():
+        with lock:
+            if num_requests is not None and issued[0] >= num_requests:
+                return None
+            if deadline is not None and time.perf_counter() >= deadline:
+                return None
+            issued[0] += 1
+            return rng.choices(scenarios, weights=weights)[0]
+
+    def _client():
+        while True:
+            scenario = _next_scenario()
+            if scenario is None:
+                return
+            record = send_request(host, port, scenario)
+            with lock:
+                records.append(record)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(_client) for _ in range(concurrency)]:
+            future.result()
+    return records, time.perf_counter() - start
+
+
+def git_commit():
+    """Current commit hash, or None outside a git checkout."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_load_test(mix=None, server='runserver', url=None, workers=2, concurrency=4,
+                  num_requests=100, duration=None, warmup_requests=None, seed=0):
+    """
+    Start (or target) the service, warm it up, run the load and summarize.
+
+    Args:
+        mix: list of scenario dicts (default: DEFAULT_MIX)
+        server: 'runserver' or 'gunicorn'; ignored with `url`
+        url: base URL of an already running service (no RSS sampling)
+        workers: int, gunicorn worker processes
+        concurrency: int, concurrent clients
+        num_requests: int, measured requests (None with `duration`)
+        duration: float, measured seconds instead of a request count
+        warmup_requests: int, unmeasured requests first (default: one per
+            scenario and client)
+        seed: int, scenario sequence seed
+
+    Returns:
+        results: JSON-serializable dict
+    """
+    mix = mix or DEFAULT_MIX
+    scenarios = prepare_scenarios(mix)
+    megapixels = {scenario['name']: scenario['megapixels'] for scenario in scenarios}
+
+    process = None
+    log_file = tempfile.TemporaryFile(mode='w+')
+    if url:
+        parts = urlsplit(url)
+        host, port = parts.hostname, parts.port or 80
+    else:
+        host, port = '127.0.0.1', free_port()
+        process = start_server(server, port, workers, log_file)
+
+    try:
+        wait_until_ready(host, port, process=process)
+
+        if warmup_requests is None:
+            warmup_requests = len(scenarios) * concurrency
+        if warmup_requests:
+            run_load(host, port, scenarios, concurrency, num_requests=warmup_requests, seed=seed + 1)
+
+        sampler = RSSSampler(process.pid).start() if process else None
+        records, seconds = run_load(host, port, scenarios, concurrency,
+                                    num_requests=None if duration else num_requests,
+                                    duration=duration, seed=seed)
+        memory = sampler.stop() if sampler else None
+    except Exception:
+        log_file.seek(0)
+        sys.stderr.write(log_file.read()[-5000:])
+        raise
+    finally:
+        if process is not None:
+            stop_server(process)
+        log_file.close()
+
+    return {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'config': {
+            'server': 'external' if url else server,
+            'url': url,
+            'workers': workers if server == 'gunicorn' and not url else None,
+            'concurrency': concurrency,
+            'requests': num_requests if not duration else None,
+            'duration_seconds': duration,
+            'warmup_requests': warmup_requests,
+            'seed': seed,
+            'mix': [{key: scenario[key] for key in ('name', 'size', 'weight', 'params') if key in scenario}
+                    for scenario in mix],
+        },
+        'environment': {
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'env': {name: os.environ[name] for name in RECORDED_ENV_VARS if name in os.environ},
+        },
+        'seconds': seconds,
+        'summary': summarize(records, seconds, megapixels),
+        'memory': memory,
+    }
+
+
+def compare_results(current, baseline):
+    """
+    Relative changes of the headline metrics against a baseline run.
+
+    Returns:
+        rows: list of (scope, metric, baseline, current, change_percent)
+    """
+    metrics = ('requests_per_second', 'latency_ms_p50', 'latency_ms_p95', 'latency_ms_p99')
+    scopes = [('overall', current['summary']['overall'], baseline['summary']['overall'])]
+    for name, stats in current['summary']['scenarios'].items():
+        if name in baseline['summary']['scenarios']:
+            scopes.append((name, stats, baseline['summary']['scenarios'][name]))
+
+    rows = []
+    for scope, now, before in scopes:
+        for metric in metrics:
+            if metric in now and metric in before and before[metric]:
+                rows.append((scope, metric, before[metric], now[metric],
+                             100.0 * (now[metric] - before[metric]) / before[metric]))
+    if current.get('memory') and baseline.get('memory'):
+        before = baseline['memory']['max_worker_peak_rss_mb']
+        now = current['memory']['max_worker_peak_rss_mb']
+        if before:
+            rows.append(('overall', 'max_worker_peak_rss_mb', before, now, 100.0 * (now - before) / before))
+    return rows
+
+
+def print_report(results):
+    """Human-readable summary of a run."""
+    config = results['config']
+    overall = results['summary']['overall']
+    print(f"\n{config['server']} (workers={config['workers']}), concurrency {config['concurrency']}, "
+          f"{overall['requests']} requests in {results['seconds']:.1f}s")
+    print(f"{'scenario':<28} {'n':>5} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>7}")
+    rows = list(results['summary']['scenarios'].items()) + [('overall', overall)]
+    for name, stats in rows:
+        print(f"{name:<28} {stats['requests']:>5} {stats['errors']:>4} "
+              f"{stats.get('latency_ms_p50', float('nan')):>9.1f} "
+              f"{stats.get('latency_ms_p95', float('nan')):>9.1f} "
+              f"{stats.get('latency_ms_p99', float('nan')):>9.1f} "
+              f"{stats['requests_per_second']:>7.2f}")
+    print(f"Throughput: {overall['requests_per_second']:.2f} req/s, "
+          f"{overall['megapixels_per_second']:.1f} MP/s")
+    memory = results.get('memory')
+    if memory:
+        print(f"Peak RSS: {memory['max_worker_peak_rss_mb']:.0f} MB per worker, "
+              f"{memory['total_peak_rss_mb']:.0f} MB total ({len(memory['processes'])} processes)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HTTP load test of the tissue masking service')
+    parser.add_argument('--server', default='runserver', choices=['runserver', 'gunicorn'],
+                        help='How to start the service locally')
+    parser.add_argument('--url', default=None, help='Test an already running service instead')
+    parser.add_argument('--workers', type=int, default=2, help='Gunicorn worker processes')
+    parser.add_argument('--concurrency', type=int, default=4, help='Concurrent clients')
+    parser.add_argument('--requests', type=int, default=100, help='Measured requests')
+    parser.add_argument('--duration', type=float, default=None,
+                        help='Measure for this many seconds instead of --requests')
+    parser.add_argument('--warmup', type=int, default=None,
+                        help='Unmeasured requests first (default: scenarios x concurrency)')
+    parser.add_argument('--mix', default=None, help='JSON file with the scenario mix')
+    parser.add_argument('--seed', type=int, default=0, help='Scenario sequence seed')
+    parser.add_argument('--output', default=None,
+                        help='Results JSON (default: data/load_tests/load_test_<timestamp>.json)')
+    parser.add_argument('--compare', default=None, help='Baseline results JSON to compare against')
+    args = parser.parse_args()
+
+    mix = None
+    if args.mix:
+        with open(args.mix) as f:
+            mix = json.load(f)
+
+    results = run_load_test(
+        mix=mix, server=args.server, url=args.url, workers=args.workers,
+        concurrency=args.concurrency, num_requests=args.requests, duration=args.duration,
+        warmup_requests=args.warmup, seed=args.seed,
+    )
+    print_report(results)
+
+    output = args.output
+    if output is None:
+        stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        output = os.path.join(DEFAULT_OUTPUT_DIR, f'load_test_{stamp}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {args.compare}:")
+        for scope, metric, before, now, change in compare_results(results, baseline):
+            print(f"  {scope:<28} {metric:<24} {before:>10.2f} -> {now:>10.2f} ({change:+.1f}%)")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,48 +2,51 @@
 """
 Generate reference stain profiles from a set of good quality images.
 
+Images are streamed: each worker loads one image at a time and folds its
+stain concentrations into running statistics, which are merged at the end.
+Memory use does not depend on the number of images.
+
 Usage:
     python setup_reference_profiles.py --stain_type HE --image_dir /path/to/good/he/images
+    python setup_reference_profiles.py --stain_type HE --image_dir /path/to/images --workers 8
 """
 import argparse
 import os
 import json
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from PIL import Image
 from pipeline.od import rgb_to_od
 from pipeline.stain import estimate_stain_vectors_macenko, extract_stain_concentrations
-from pipeline.normalize import generate_reference_profile
+from pipeline.normalize import RunningStats, reference_profile_from_stats, sample_tissue_concentrations
 
+VALID_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.tif', '.tiff'}
 
-def load_images_from_directory(image_dir):
-    """Load all images from directory"""
-    images = []
-    valid_extensions = {'.jpg', '.jpeg', '.png', '.tif', '.tiff'}
-    
-    for filename in os.listdir(image_dir):
-        if any(filename.lower().endswith(ext) for ext in valid_extensions):
-            filepath = os.path.join(image_dir, filename)
-            try:
-                img = Image.open(filepath)
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                img_array = np.array(img)
-                images.append(img_array)
-                print(f"Loaded: {filename}")
-            except Exception as e:
-                print(f"Error loading {filename}: {e}")
-    
-    return images
 
+def iter_image_paths(image_dir):
+    """Yield image file paths in the directory, without loading them"""
+    for filename in sorted(os.listdir(image_dir)):
+        if any(filename.lower().endswith(ext) for ext in VALID_EXTENSIONS):
+            yield os.path.join(image_dir, filename)
 
-def generate_profile_from_images(images, stain_type):
-    """Generate reference profile from images"""
-    print(f"Processing {len(images)} images for {stain_type} stain...")
-    
-    concentrations_list = []
+
+def load_image(filepath):
+    """Load one image as (H, W, 3) uint8 RGB"""
+    img = Image.open(filepath)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    return np.array(img)
+
+
+def image_concentration_stats(filepath):
+    """
+    Concentration statistics for one image (runs in a worker process).
     
-    for i, rgb_image in enumerate(images):
-        print(f"Processing image {i+1}/{len(images)}...")
+    Returns:
+        (filepath, RunningStats or None, error message or None)
+    """
+    try:
+        rgb_image = load_image(filepath)
         
         # Convert to OD
         od_image = rgb_to_od(rgb_image)
@@ -53,11 +56,49 @@ def generate_profile_from_images(images, stain_type):
         
         # Extract concentrations
         concentrations = extract_stain_concentrations(od_image, stain_vectors)
-        concentrations_list.append(concentrations)
+        
+        # Tissue-only sample, matching how the pipeline measures images
+        stats = RunningStats(channels=2)
+        stats.update(sample_tissue_concentrations(concentrations, od_image))
+        return filepath, stats, None
+    except Exception as e:
+        return filepath, None, str(e)
+
+
+def generate_profile_from_images(image_paths, stain_type, workers=None):
+    """
+    Generate reference profile from images.
+    
+    Args:
+        image_paths: iterable of image file paths
+        stain_type: 'HE', 'IHC', or 'PAP'
+        workers: int, worker processes (default: all cores)
+    
+    Returns:
+        reference_stats: dict, or None if no image could be processed
+    """
+    print(f"Processing images for {stain_type} stain...")
+    
+    total = RunningStats(channels=2)
+    processed = 0
+    
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for filepath, stats, error in pool.map(image_concentration_stats, image_paths):
+            filename = os.path.basename(filepath)
+            if error is not None:
+                print(f"Error processing {filename}: {error}")
+                continue
+            total.merge(stats)
+            processed += 1
+            print(f"Processed {processed}: {filename}")
+    
+    if processed == 0:
+        return None
     
     # Generate reference statistics
-    reference_stats = generate_reference_profile(concentrations_list)
+    reference_stats = reference_profile_from_stats(total)
     reference_stats['stain_type'] = stain_type
+    reference_stats['num_images'] = processed
     
     return reference_stats
 
@@ -70,19 +111,20 @@ def main():
                         help='Directory containing good quality images')
     parser.add_argument('--output_dir', default='configs/reference_stain_profiles',
                         help='Output directory for reference profiles')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes (default: all cores)')
     
     args = parser.parse_args()
     
-    # Load images
-    images = load_images_from_directory(args.image_dir)
+    # Generate profile
+    reference_stats = generate_profile_from_images(
+        iter_image_paths(args.image_dir), args.stain_type, workers=args.workers
+    )
     
-    if len(images) == 0:
+    if reference_stats is None:
         print(f"Error: No images found in {args.image_dir}")
         return
     
-    # Generate profile
-    reference_stats = generate_profile_from_images(images, args.stain_type)
-    
     # Save profile
     os.makedirs(args.output_dir, exist_ok=True)
     output_file = os.path.join(args.output_dir, f'{args.stain_type.lower()}_reference.json')
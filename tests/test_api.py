@@ -41,6 +41,17 @@ class TissueMaskAPITest(TestCase):
         data = json.loads(response.content)
         self.assertEqual(data['status'], 'healthy')
     
+    def test_readiness_check(self):
+        """Test readiness endpoint reports ready after warm-up"""
+        from pipeline import runtime
+        runtime.warm_up(size=64)
+        
+        response = self.client.get('/api/v1/health/ready/')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data['status'], 'ready')
+        self.assertIsNotNone(data['warmup_seconds'])
+    
     def test_tissue_mask_endpoint(self):
         """Test tissue masking endpoint"""
         img_io = self.create_test_image()
@@ -57,14 +68,733 @@ class TissueMaskAPITest(TestCase):
         self.assertIn('mask_png_base64', data)
         self.assertIn('metrics', data)
     
+    def test_tissue_mask_overlay_preview(self):
+        """Test overlay and mask thumbnail previews are downsampled on request"""
+        response = self.client.post(
+            '/api/v1/tissue/mask/',
+            {'image': self.create_test_image(), 'return_overlay': 'true',
+             'return_mask_thumbnail': 'true', 'preview_max_dimension': '100',
+             'preview_format': 'jpeg'},
+            format='multipart'
+        )
+        
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data['preview']['width'], 100)
+        self.assertEqual(data['preview']['scale_factor'], 2.0)
+        overlay = Image.open(io.BytesIO(base64.b64decode(data['overlay_jpeg_base64'])))
+        self.assertEqual((overlay.format, overlay.size), ('JPEG', (100, 100)))
+        thumbnail = Image.open(io.BytesIO(base64.b64decode(data['mask_thumbnail_png_base64'])))
+        self.assertEqual(thumbnail.size, (100, 100))
+        mask = Image.open(io.BytesIO(base64.b64decode(data['mask_png_base64'])))
+        self.assertEqual(mask.size, (200, 200))
+        
+        # Full size unless a preview size is requested
+        response = self.client.post(
+            '/api/v1/tissue/mask/',
+            {'image': self.create_test_image(), 'return_overlay': 'true'},
+            format='multipart'
+        )
+        data = json.loads(response.content)
+        self.assertEqual(data['preview']['scale_factor'], 1.0)
+        overlay = Image.open(io.BytesIO(base64.b64decode(data['overlay_png_base64'])))
+        self.assertEqual(overlay.size, (200, 200))
+    
+    def test_tissue_mask_color_lut(self):
+        """Test per-color evaluation returns the same mask"""
+        masks = []
+        for color_lut in ('none', 'unique'):
+            response = self.client.post(
+                '/api/v1/tissue/mask/',
+                {'image': self.create_test_image(), 'color_lut': color_lut},
+                format='multipart'
+            )
+            self.assertEqual(response.status_code, 200)
+            masks.append(json.loads(response.content)['mask_png_base64'])
+        self.assertEqual(masks[0], masks[1])
+    
+    def test_tissue_mask_regions(self):
+        """Test region geometry and the region index are returned"""
+        from pipeline.regions import RegionIndex
+        
+        response = self.client.post(
+            '/api/v1/tissue/mask/',
+            {'image': self.create_test_image(), 'stain_method': 'none',
+             'return_regions': 'true', 'return_region_index': 'true'},
+            format='multipart'
+        )
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        
+        self.assertEqual(len(data['regions']), 1)
+        region = data['regions'][0]
+        x, y, width, height = region['bbox']
+        self.assertAlmostEqual(x + width / 2, 100, delta=3)
+        self.assertAlmostEqual(y + height / 2, 100, delta=3)
+        self.assertGreater(region['mean_od'], 0.1)
+        
+        index = RegionIndex.from_bytes(base64.b64decode(data['region_index_npz_base64']))
+        self.assertTrue(index.contains_point(100, 100))
+        self.assertFalse(index.contains_point(10, 10))
+    
+    def test_tissue_mask_tile_occupancy(self):
+        """Test the per-tile tissue fraction grid"""
+        response = self.client.post(
+            '/api/v1/tissue/mask/',
+            {'image': self.create_test_image(), 'stain_method': 'none',
+             'tile_size': '50', 'stride': '25', 'tile_dtype': 'float32'},
+            format='multipart'
+        )
+        self.assertEqual(response.status_code, 200)
+        occupancy = json.loads(response.content)['tile_occupancy']
+        
+        self.assertEqual((occupancy['rows'], occupancy['cols']), (7, 7))
+        grid = np.frombuffer(base64.b64decode(occupancy['data_base64']), dtype='<f4').reshape(7, 7)
+        self.assertGreater(grid[3, 3], 0.9)  # Tile at (75, 75), inside the tissue
+        self.assertEqual(grid[0, 0], 0.0)
+        
+        for fields in ({'tile_size': '0'}, {'tile_size': '-50'},
+                       {'tile_size': '50', 'stride': '0'}, {'tile_size': '50', 'stride': '-25'}):
+            with self.subTest(fields=fields):
+                response = self.client.post(
+                    '/api/v1/tissue/mask/',
+                    dict({'image': self.create_test_image()}, **fields),
+                    format='multipart'
+                )
+                self.assertEqual(response.status_code, 400)
+    
+    def test_tissue_mask_batch(self):
+        """Test batch results in request order, and streamed as NDJSON"""
+        def batch_images():
+            broken = io.BytesIO(b'not an image')
+            broken.name = 'broken.png'
+            images = [self.create_test_image(), broken, self.create_test_image((120, 80))]
+            images[0].name, images[2].name = 'a.jpg', 'b.jpg'
+            return images
+        
+        response = self.client.post(
+            '/api/v1/tissue/mask/batch/', {'images': batch_images()}, format='multipart'
+        )
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertFalse(data['success'])
+        self.assertEqual([record['index'] for record in data['results']], [0, 1, 2])
+        self.assertEqual([record['success'] for record in data['results']], [True, False, True])
+        self.assertEqual(data['results'][1]['filename'], 'broken.png')
+        mask = Image.open(io.BytesIO(base64.b64decode(data['results'][2]['mask_png_base64'])))
+        self.assertEqual(mask.size, (120, 80))
+        
+        response = self.client.post(
+            '/api/v1/tissue/mask/batch/', {'images': batch_images(), 'stream': 'true'},
+            format='multipart'
+        )
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        records = sorted((json.loads(line) for line in lines), key=lambda record: record['index'])
+        self.assertEqual(len(records), 3)
+        for streamed, expected in zip(records, data['results']):
+            self.assertEqual(streamed.get('mask_png_base64'), expected.get('mask_png_base64'))
+        
+        response = self.client.post('/api/v1/tissue/mask/batch/', {}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+    
+    def test_tissue_mask_batch_stream_rejected_under_asgi(self):
+        """Test stream=true is rejected when served through ASGI"""
+        from django.test import AsyncRequestFactory
+        from api.views.tissue_views import tissue_mask_batch_view
+        
+        request = AsyncRequestFactory().post(
+            '/api/v1/tissue/mask/batch/', 'stream=true', content_type='application/x-www-form-urlencoded'
+        )
+        response = tissue_mask_batch_view(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('WSGI', json.loads(response.content)['error'])
+    
+    def test_tissue_mask_batch_archive(self):
+        """Test archive entries are masked and streamed after the uploaded images"""
+        import zipfile
+        
+        archive_io = io.BytesIO()
+        with zipfile.ZipFile(archive_io, 'w') as archive:
+            archive.writestr('tiles/tile_0.jpg', self.create_test_image().getvalue())
+            archive.writestr('tiles/notes.txt', 'not an image')
+            archive.writestr('tiles/tile_1.jpg', self.create_test_image((100, 60)).getvalue())
+        archive_io.seek(0)
+        archive_io.name = 'tiles.zip'
+        image = self.create_test_image()
+        image.name = 'single.jpg'
+        
+        response = self.client.post(
+            '/api/v1/tissue/mask/batch/',
+            {'images': image, 'archive': archive_io, 'stream': 'true'},
+            format='multipart'
+        )
+        self.assertEqual(response.status_code, 200)
+        records = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        records.sort(key=lambda record: record['index'])
+        self.assertEqual([record['filename'] for record in records],
+                         ['single.jpg', 'tiles/tile_0.jpg', 'tiles/tile_1.jpg'])
+        self.assertTrue(all(record['success'] for record in records))
+        mask = Image.open(io.BytesIO(base64.b64decode(records[2]['mask_png_base64'])))
+        self.assertEqual(mask.size, (100, 60))
+        
+        not_archive = io.BytesIO(b'plain bytes')
+        not_archive.name = 'tiles.zip'
+        response = self.client.post(
+            '/api/v1/tissue/mask/batch/', {'archive': not_archive}, format='multipart'
+        )
+        self.assertEqual(response.status_code, 400)
+    
+    def test_tissue_mask_tiff_output(self):
+        """Test mask_output=tiff writes a tiled TIFF served by the download endpoint"""
+        import tempfile
+        import tifffile
+        from django.test import override_settings
+        
+        expected = json.loads(self.client.post(
+            '/api/v1/tissue/mask/', {'image': self.create_test_image()}, format='multipart'
+        ).content)['mask_png_base64']
+        expected = np.array(Image.open(io.BytesIO(base64.b64decode(expected))))
+        
+        with tempfile.TemporaryDirectory() as directory, override_settings(MASK_FILE_DIR=directory):
+            response = self.client.post(
+                '/api/v1/tissue/mask/',
+                {'image': self.create_test_image(), 'mask_output': 'tiff',
+                 'mask_tile_size': '64', 'mask_pyramid': 'true'},
+                format='multipart'
+            )
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.content)
+            self.assertNotIn('mask_png_base64', data)
+            info = data['mask_tiff']
+            self.assertEqual(info['levels'], [[200, 200], [100, 100], [50, 50]])
+            
+            download = self.client.get(info['url'])
+            self.assertEqual(download.status_code, 200)
+            self.assertEqual(download['Content-Type'], 'image/tiff')
+            body = b''.join(download.streaming_content)
+            download.close()
+            self.assertEqual(len(body), info['bytes'])
+            np.testing.assert_array_equal(tifffile.imread(io.BytesIO(body)), expected)
+            
+            missing = self.client.get('/api/v1/tissue/mask/files/' + '0' * 32 + '/')
+            self.assertEqual(missing.status_code, 404)
+    
+    def test_flat_field_registry(self):
+        """Test registering a flat field and referencing it by id"""
+        import tempfile
+        from django.test import override_settings
+        
+        flat = np.full((100, 100, 3), 200, dtype=np.uint8)
+        flat_io = io.BytesIO()
+        Image.fromarray(flat).save(flat_io, format='PNG')
+        flat_io.seek(0)
+        
+        with tempfile.TemporaryDirectory() as directory, override_settings(FLAT_FIELD_DIR=directory):
+            response = self.client.post(
+                '/api/v1/flat-fields/', {'image': flat_io, 'scanner_id': 'scanner-a'}, format='multipart'
+            )
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(json.loads(response.content)['width'], 100)
+            
+            response = self.client.get('/api/v1/flat-fields/')
+            self.assertEqual(json.loads(response.content)['scanner_ids'], ['scanner-a'])
+            
+            corrupt = io.BytesIO(b'not an image')
+            corrupt.name = 'corrupt.png'
+            response = self.client.post(
+                '/api/v1/flat-fields/', {'image': corrupt, 'scanner_id': 'scanner-c'}, format='multipart'
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertFalse(json.loads(response.content)['success'])
+            self.assertNotIn('traceback', json.loads(response.content))
+            
+            response = self.client.post(
+                '/api/v1/tissue/mask/',
+                {'image': self.create_test_image(), 'flat_field_id': 'scanner-a'},
+                format='multipart'
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(json.loads(response.content)['success'])
+            
+            response = self.client.post(
+                '/api/v1/tissue/mask/',
+                {'image': self.create_test_image(), 'flat_field_id': 'scanner-b'},
+                format='multipart'
+            )
+            self.assertEqual(response.status_code, 404)
+    
+    def test_tissue_mask_pyramidal_tiff(self):
+        """Test masking a pyramidal TIFF at a reduced level"""
+        from tests.test_pipeline import write_pyramidal_tiff
+        
+        img = np.ones((400, 400, 3), dtype=np.uint8) * 255
+        img[100:300, 100:300, :] = [180, 120, 80]
+        tiff_io = io.BytesIO()
+        write_pyramidal_tiff(tiff_io, img)
+        tiff_io.seek(0)
+        tiff_io.name = 'slide.tif'
+        
+        response = self.client.post(
+            '/api/v1/tissue/mask/',
+            {'image': tiff_io, 'max_dimension': '150'},
+            format='multipart'
+        )
+        
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['slide']['level'], 2)
+        self.assertEqual(data['slide']['scale_factor'], [4.0, 4.0])
+        mask = Image.open(io.BytesIO(base64.b64decode(data['mask_png_base64'])))
+        self.assertEqual(mask.size, (100, 100))
+    
+    def test_tissue_mask_session_reuse(self):
+        """Test tiles with the same session_id reuse slide parameters"""
+        import tempfile
+        from unittest import mock
+        from django.test import override_settings
+        from pipeline.session import TTLCache
+        
+        def post_tile(**options):
+            response = self.client.post(
+                '/api/v1/tissue/mask/',
+                dict({'image': self.create_test_image(), 'session_id': 'slide-api-test',
+                      'threshold_method': 'otsu'}, **options),
+                format='multipart'
+            )
+            self.assertEqual(response.status_code, 200)
+            return json.loads(response.content)
+        
+        with tempfile.TemporaryDirectory() as directory, override_settings(SLIDE_SESSION_DIR=directory):
+            responses = [post_tile(), post_tile()]
+            # Another worker process: empty in-process cache, same session directory
+            with mock.patch('api.sessions.get_session_cache', return_value=TTLCache()):
+                other_worker = post_tile()
+            # Options that change the parameters get a session of their own
+            changed = [post_tile(white_reference_percentile='90'), post_tile(color_lut='unique')]
+        
+        self.assertFalse(responses[0]['session']['reused'])
+        self.assertTrue(responses[0]['session']['established'])
+        self.assertTrue(responses[1]['session']['reused'])
+        self.assertEqual(responses[1]['session']['tiles_processed'], 2)
+        self.assertTrue(other_worker['session']['reused'])
+        self.assertEqual(other_worker['session']['tiles_processed'], 1)
+        for response in changed:
+            self.assertFalse(response['session']['reused'])
+    
+    def test_tissue_mask_roi_edit(self):
+        """Test re-masking a region of a cached result"""
+        import tempfile
+        from unittest import mock
+        from django.test import override_settings
+        
+        with tempfile.TemporaryDirectory() as directory, override_settings(RESULT_CACHE_DIR=directory):
+            response = self.client.post(
+                '/api/v1/tissue/mask/',
+                {'image': self.create_test_image(), 'cache_result': 'true'},
+                format='multipart'
+            )
+            data = json.loads(response.content)
+            self.assertIn('result_id', data)
+            
+            # Served by another worker process: its own store, same directory
+            with mock.patch.dict('api.sessions._result_stores', clear=True):
+                response = self.client.post('/api/v1/tissue/mask/roi/', {
+                    'result_id': data['result_id'],
+                    'roi': '0,0,100,200',
+                    'threshold': '1000',
+                    'return_full_mask': 'true',
+                })
+            self.assertEqual(response.status_code, 200)
+            roi_data = json.loads(response.content)
+            self.assertEqual(roi_data['roi'], [0, 0, 100, 200])
+            mask = np.array(Image.open(io.BytesIO(base64.b64decode(roi_data['mask_png_base64']))))
+            self.assertFalse(mask[:, :100].any())
+            self.assertAlmostEqual(
+                roi_data['metrics']['tissue_area_fraction'], np.count_nonzero(mask) / mask.size
+            )
+            self.assertLess(
+                roi_data['metrics']['tissue_area_fraction'], data['metrics']['tissue_area_fraction']
+            )
+            
+            # Edits accumulate
+            response = self.client.post('/api/v1/tissue/mask/roi/', {
+                'result_id': data['result_id'],
+                'roi': '100,0,100,200',
+                'threshold': '1000',
+            })
+            self.assertEqual(json.loads(response.content)['metrics']['tissue_area_fraction'], 0.0)
+            
+            response = self.client.post('/api/v1/tissue/mask/roi/', {'result_id': 'missing', 'roi': '0,0,1,1'})
+            self.assertEqual(response.status_code, 404)
+            response = self.client.post('/api/v1/tissue/mask/roi/', {'result_id': data['result_id'], 'roi': '0,0'})
+            self.assertEqual(response.status_code, 400)
+            response = self.client.post('/api/v1/tissue/mask/roi/', {
+                'result_id': data['result_id'], 'roi': '0,0,10,10', 'halo': '-5',
+            })
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('halo', json.loads(response.content)['error'])
+    
     def test_tissue_mask_missing_image(self):
         """Test endpoint with missing image"""
         response = self.client.post('/api/v1/tissue/mask/')
-        self.assertEqual(response.status_code, 200)  # Returns JSON error
+        self.assertEqual(response.status_code, 400)
         data = json.loads(response.content)
         self.assertFalse(data['success'])
         self.assertIn('error', data)
 
+    def test_tissue_mask_client_errors(self):
+        """Test malformed parameters and unreadable uploads are rejected with 400"""
+        import tifffile
+        
+        flat_tiff = io.BytesIO()
+        tifffile.imwrite(flat_tiff, np.full((64, 64, 3), 255, dtype=np.uint8), photometric='rgb')
+        flat_tiff.seek(0)
+        flat_tiff.name = 'flat.tif'
+        corrupt = io.BytesIO(b'not an image')
+        corrupt.name = 'corrupt.png'
+        cases = [
+            ({'image': corrupt}, 'corrupt.png'),
+            ({'image': flat_tiff, 'target_mpp': '1.0'}, 'resolution'),
+            ({'preview_format': 'gif'}, 'preview_format'),
+            ({'color_lut': 'fast'}, 'color_lut'),
+            ({'flat_field_id': '../scanner'}, 'flat_field_id'),
+            ({'tile_dtype': 'int64'}, 'tile_dtype'),
+            ({'mask_output': 'zarr'}, 'mask_output'),
+            ({'mask_compression': 'lzw'}, 'mask_compression'),
+            ({'mask_tile_size': '100'}, 'mask_tile_size'),
+            ({'min_area': 'many'}, 'min_area'),
+        ]
+        for fields, expected in cases:
+            with self.subTest(fields=fields):
+                fields = dict({'image': self.create_test_image()}, **fields)
+                response = self.client.post('/api/v1/tissue/mask/', fields, format='multipart')
+                self.assertEqual(response.status_code, 400)
+                data = json.loads(response.content)
+                self.assertFalse(data['success'])
+                self.assertIn(expected, data['error'])
+                self.assertNotIn('traceback', data)
+    
+    def test_tissue_mask_explicit_zero_params(self):
+        """Test min_area=0 and kernel_size=0 are honored, not replaced by defaults"""
+        img = np.ones((200, 200, 3), dtype=np.uint8) * 255
+        img[50:150, 50:150, :] = [180, 120, 80]
+        img[10:15, 180:185, :] = [180, 120, 80]  # 25-pixel speck
+        
+        def speck_kept(fields):
+            img_io = io.BytesIO()
+            Image.fromarray(img).save(img_io, format='PNG')
+            img_io.seek(0)
+            response = self.client.post(
+                '/api/v1/tissue/mask/', dict({'image': img_io}, **fields), format='multipart'
+            )
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.content)
+            mask = np.array(Image.open(io.BytesIO(base64.b64decode(data['mask_png_base64']))))
+            return bool(mask[10:15, 180:185].any())
+        
+        self.assertFalse(speck_kept({}))
+        self.assertTrue(speck_kept({'min_area': '0', 'kernel_size': '0'}))
+        
+        response = self.client.post(
+            '/api/v1/tissue/mask/',
+            {'image': self.create_test_image(), 'kernel_size': '-1'},
+            format='multipart'
+        )
+        self.assertEqual(response.status_code, 400)
+    
+    def test_tissue_mask_async_endpoint(self):
+        """Test async tissue masking endpoint"""
+        img_io = self.create_test_image()
+        
+        response = self.client.post(
+            '/api/v1/tissue/mask/async/',
+            {'image': img_io, 'threshold_method': 'otsu'},
+            format='multipart'
+        )
+        
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertTrue(data['success'])
+        self.assertIn('mask_png_base64', data)
+    
+    def test_tissue_mask_async_sheds_load(self):
+        """Test async endpoint returns 429 with Retry-After when the queue is full"""
+        import threading
+        from unittest import mock
+        from api.executor import PipelineExecutor
+        
+        executor = PipelineExecutor(max_workers=1, max_pending_pixels=50_000)
+        release = threading.Event()
+        executor.submit(release.wait, 40_000)
+        try:
+            with mock.patch('api.views.tissue_views.get_executor', return_value=executor):
+                response = self.client.post(
+                    '/api/v1/tissue/mask/async/',
+                    {'image': self.create_test_image()},
+                    format='multipart'
+                )
+        finally:
+            release.set()
+        
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertFalse(json.loads(response.content)['success'])
+    
+    def test_tissue_mask_blank_fast_path(self):
+        """Test a blank image returns an empty mask flagged BLANK_IMAGE and is counted"""
+        blank_io = io.BytesIO()
+        Image.fromarray(np.full((200, 200, 3), 245, dtype=np.uint8)).save(blank_io, format='PNG')
+        blank_io.seek(0)
+        
+        before = json.loads(self.client.get('/api/v1/tissue/status/').content)['fast_paths']
+        response = self.client.post('/api/v1/tissue/mask/', {'image': blank_io, 'fast_paths': 'true'},
+                                    format='multipart')
+        after = json.loads(self.client.get('/api/v1/tissue/status/').content)['fast_paths']
+        
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data['metrics']['tissue_area_fraction'], 0.0)
+        self.assertIn('BLANK_IMAGE', data['metrics']['qc_flags'])
+        self.assertEqual(after['blank'] - before['blank'], 1)
+    
+    def test_tissue_mask_png_response(self):
+        """Test response_format=png streams the same mask as the JSON response"""
+        json_response = self.client.post(
+            '/api/v1/tissue/mask/', {'image': self.create_test_image()}, format='multipart'
+        )
+        response = self.client.post(
+            '/api/v1/tissue/mask/',
+            {'image': self.create_test_image(), 'response_format': 'png'},
+            format='multipart'
+        )
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        body = b''.join(response.streaming_content)
+        self.assertEqual(int(response['Content-Length']), len(body))
+        expected = json.loads(json_response.content)
+        self.assertEqual(body, base64.b64decode(expected['mask_png_base64']))
+        info = json.loads(response['X-Tissue-Mask-Info'])
+        self.assertEqual(info['metrics'], expected['metrics'])
+        
+        rejected = self.client.post(
+            '/api/v1/tissue/mask/',
+            {'image': self.create_test_image(), 'response_format': 'png', 'return_overlay': 'true'},
+            format='multipart'
+        )
+        self.assertEqual(rejected.status_code, 400)
+        self.assertIn('response_format', json.loads(rejected.content)['error'])
+    
+    def test_tissue_mask_records_metrics(self):
+        """Test processed requests are persisted by the write-behind recorder"""
+        from unittest import mock
+        from api.models import TissueMaskRecord
+        from api.recorder import MetricsRecorder
+        
+        recorder = MetricsRecorder(flush_interval=3600, flush_size=100)
+        try:
+            with mock.patch('api.views.tissue_views.get_recorder', return_value=recorder):
+                response = self.client.post(
+                    '/api/v1/tissue/mask/',
+                    {'image': self.create_test_image(), 'threshold_method': 'otsu'},
+                    format='multipart'
+                )
+            self.assertEqual(response.status_code, 200)
+            # Buffered, not yet written
+            self.assertEqual(TissueMaskRecord.objects.count(), 0)
+            self.assertEqual(recorder.flush(), 1)
+        finally:
+            recorder.close()
+        
+        record = TissueMaskRecord.objects.get()
+        metrics = json.loads(response.content)['metrics']
+        self.assertEqual(record.endpoint, 'mask')
+        self.assertEqual((record.width, record.height), (200, 200))
+        self.assertEqual(record.params['threshold_method'], 'otsu')
+        self.assertEqual(record.qc_flags, metrics['qc_flags'])
+        self.assertAlmostEqual(record.tissue_area_fraction, metrics['tissue_area_fraction'])
+        self.assertEqual(set(record.timings), {'decode', 'pipeline', 'postprocess', 'total'})
+
+
+class MigrationsTest(TestCase):
+    """Test the shipped migrations cover the models"""
+    
+    def test_no_missing_migrations(self):
+        """Test makemigrations has nothing to add"""
+        from django.core.management import call_command
+        
+        out = io.StringIO()
+        call_command('makemigrations', 'api', '--check', '--dry-run', stdout=out)
+        self.assertIn('No changes detected', out.getvalue())
+
+
+class PipelineExecutorTest(unittest.TestCase):
+    """Test bounded pipeline executor"""
+    
+    def test_rejects_over_budget(self):
+        """Test jobs beyond the pixel budget are rejected while busy"""
+        import threading
+        from api.executor import PipelineExecutor, QueueFullError
+        
+        executor = PipelineExecutor(max_workers=1, max_pending_pixels=1000)
+        release = threading.Event()
+        running = executor.submit(release.wait, 800)
+        
+        with self.assertRaises(QueueFullError) as ctx:
+            executor.submit(lambda: None, 300)
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+        
+        # Fits alongside the running job
+        small = executor.submit(lambda: 'done', 100)
+        release.set()
+        running.result(timeout=5)
+        self.assertEqual(small.result(timeout=5), 'done')
+        
+        stats = executor.stats()
+        self.assertEqual(stats['pending_pixels'], 0)
+        self.assertEqual(stats['rejected_jobs'], 1)
+    
+    def test_admits_oversized_job_when_idle(self):
+        """Test a job larger than the budget still runs on an idle executor"""
+        from api.executor import PipelineExecutor
+        
+        executor = PipelineExecutor(max_workers=1, max_pending_pixels=10)
+        
+        self.assertEqual(executor.submit(lambda: 42, 1000).result(timeout=5), 42)
+
+    def test_batch_runs_bounded_in_completion_order(self):
+        """Test batch jobs are pulled lazily, bounded in flight and yielded as they finish"""
+        import threading
+        from api.batch import iter_completed
+        from api.executor import PipelineExecutor
+        
+        executor = PipelineExecutor(max_workers=4, max_pending_pixels=250)
+        lock = threading.Lock()
+        state = {'pulled': 0, 'running': 0, 'peak': 0}
+        # Item 0 finishes last: it waits until item 3 has started
+        item3_started = threading.Event()
+        
+        def items():
+            for index in range(6):
+                with lock:
+                    state['pulled'] += 1
+                yield index
+        
+        def job(index):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            if index == 3:
+                item3_started.set()
+            if index == 0:
+                item3_started.wait(5)
+            with lock:
+                state['running'] -= 1
+            return index
+        
+        # 100 pixels per job: the budget also caps concurrency at two jobs
+        results = iter_completed(items(), job, lambda index: 100, executor, max_in_flight=3)
+        first = next(results)
+        self.assertLessEqual(state['pulled'], 4)
+        rest = list(results)
+        
+        self.assertEqual(sorted([first] + rest), list(range(6)))
+        self.assertNotEqual(first, 0)
+        self.assertLessEqual(state['peak'], 2)
+        self.assertEqual(executor.stats()['pending_jobs'], 0)
+    
+    def test_closed_batch_releases_queued_budget(self):
+        """Test jobs cancelled when a streamed batch is closed give back their budget"""
+        import threading
+        import time
+        from api.batch import iter_completed
+        from api.executor import PipelineExecutor
+        
+        executor = PipelineExecutor(max_workers=1, max_pending_pixels=1000)
+        started = threading.Event()
+        release = threading.Event()
+        
+        def job(index):
+            if index > 0:
+                started.set()
+                release.wait(5)
+            return index
+        
+        results = iter_completed(range(6), job, lambda index: 100, executor, max_in_flight=3)
+        self.assertEqual(next(results), 0)
+        self.assertTrue(started.wait(5))
+        # Item 1 running, item 2 queued behind it
+        results.close()
+        self.assertEqual(executor.stats()['pending_jobs'], 1)
+        
+        release.set()
+        deadline = time.monotonic() + 5
+        while executor.stats()['pending_jobs'] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        stats = executor.stats()
+        self.assertEqual(stats['pending_jobs'], 0)
+        self.assertEqual(stats['pending_pixels'], 0)
+        # Idle again: an oversized job is admitted
+        self.assertEqual(executor.submit(lambda: 'done', 5000).result(timeout=5), 'done')
+
+
+
+class MetricsRecorderTest(unittest.TestCase):
+    """Test write-behind metrics recorder"""
+    
+    def test_flushes_on_size_threshold(self):
+        """Test a full batch is written by the background thread without waiting for the timer"""
+        import threading
+        from api.recorder import MetricsRecorder
+        
+        batches = []
+        written = threading.Event()
+        
+        def writer(batch):
+            batches.append(batch)
+            written.set()
+        
+        recorder = MetricsRecorder(flush_interval=3600, flush_size=3, writer=writer)
+        for i in range(3):
+            self.assertTrue(recorder.record({'i': i}))
+        self.assertTrue(written.wait(timeout=5))
+        recorder.close()
+        
+        self.assertEqual(batches, [[{'i': 0}, {'i': 1}, {'i': 2}]])
+        stats = recorder.stats()
+        self.assertEqual((stats['written'], stats['flushes'], stats['dropped']), (3, 1, 0))
+    
+    def test_drops_only_when_buffer_full(self):
+        """Test records beyond the buffer limit are dropped and failed batches retried"""
+        from api.recorder import MetricsRecorder
+        
+        failures = [RuntimeError('database is locked')]
+        written = []
+        
+        def writer(batch):
+            if failures:
+                raise failures.pop()
+            written.extend(batch)
+        
+        recorder = MetricsRecorder(flush_interval=3600, flush_size=100, max_buffered=4, writer=writer)
+        accepted = [recorder.record({'i': i}) for i in range(6)]
+        self.assertEqual(accepted, [True] * 4 + [False] * 2)
+        
+        # Failed batch stays buffered for the next flush
+        self.assertEqual(recorder.flush(), 0)
+        self.assertEqual(recorder.stats()['buffered'], 4)
+        self.assertEqual(recorder.flush(), 4)
+        recorder.close()
+        
+        self.assertEqual(written, [{'i': i} for i in range(4)])
+        stats = recorder.stats()
+        self.assertEqual(stats['dropped'], 2)
+        self.assertEqual(stats['failed_flushes'], 1)
+        self.assertIn('database is locked', stats['last_error'])
+
 
 if __name__ == '__main__':
     unittest.main()
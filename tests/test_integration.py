@@ -1,10 +1,40 @@
 """
 End-to-end integration tests.
 """
+import importlib
+import json
+import os
+import sys
+import tempfile
 import unittest
 import numpy as np
+from PIL import Image
 from pipeline.pipeline import TissueMaskingPipeline
 
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_script(name):
+    """Import a module from scripts/ (not a package) so pool workers can unpickle it."""
+    scripts_dir = os.path.join(REPO_ROOT, 'scripts')
+    if scripts_dir not in sys.path:
+        sys.path.insert(0, scripts_dir)
+    return importlib.import_module(name)
+
+
+def write_test_images(directory, count, size=(120, 160)):
+    """Write synthetic tissue images into `directory` and a nested subdirectory."""
+    paths = []
+    for i in range(count):
+        subdir = directory if i % 2 == 0 else os.path.join(directory, 'nested')
+        os.makedirs(subdir, exist_ok=True)
+        rgb = np.ones(size + (3,), dtype=np.uint8) * 255
+        rgb[20:80, 30 + i * 5:100 + i * 5] = [180, 120, 80]
+        path = os.path.join(subdir, f'slide_{i}.png')
+        Image.fromarray(rgb).save(path)
+        paths.append(path)
+    return paths
+
 
 class IntegrationTest(unittest.TestCase):
     """End-to-end integration tests"""
@@ -53,5 +83,153 @@ class IntegrationTest(unittest.TestCase):
         np.testing.assert_array_equal(result1['mask'], result2['mask'])
 
 
+class BatchMaskCLITest(unittest.TestCase):
+    """Test the local batch masking CLI"""
+    
+    def test_batch_mask_resumes(self):
+        """Test outputs and manifest are written and finished files are skipped"""
+        batch_mask = load_script('batch_mask')
+        options = {
+            'normalize': False, 'stain_method': 'none', 'threshold_method': 'otsu',
+            'stain_type': 'HE', 'target_mpp': None, 'max_dimension': None,
+        }
+        
+        with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as output_dir:
+            write_test_images(input_dir, 3)
+            
+            summary = batch_mask.run_batch(input_dir, output_dir, options, workers=2)
+            self.assertEqual(summary['processed'], 3)
+            self.assertEqual(summary['failed'], 0)
+            self.assertGreater(summary['megapixels_per_second'], 0.0)
+            
+            mask_path, metrics_path = batch_mask.output_paths(output_dir, os.path.join('nested', 'slide_1.png'))
+            self.assertEqual(Image.open(mask_path).size, (160, 120))
+            with open(metrics_path) as f:
+                self.assertIn('tissue_area_fraction', json.load(f)['metrics'])
+            
+            # Second run: everything already in the manifest
+            summary = batch_mask.run_batch(input_dir, output_dir, options, workers=2)
+            self.assertEqual(summary['processed'], 0)
+            self.assertEqual(summary['skipped'], 3)
+
+    def test_batch_mask_archive(self):
+        """Test a tar.gz is masked entry by entry, unsafe names fail and reruns skip"""
+        import io
+        import tarfile
+        batch_mask = load_script('batch_mask')
+        options = {
+            'normalize': False, 'stain_method': 'none', 'threshold_method': 'otsu',
+            'stain_type': 'HE', 'target_mpp': None, 'max_dimension': None,
+        }
+        
+        with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as output_dir:
+            paths = write_test_images(input_dir, 3)
+            archive_path = os.path.join(input_dir, 'tiles.tar.gz')
+            with tarfile.open(archive_path, 'w:gz') as archive:
+                for path in paths:
+                    archive.add(path, arcname=os.path.relpath(path, input_dir))
+                unsafe = tarfile.TarInfo('../escape.png')
+                unsafe.size = 4
+                archive.addfile(unsafe, io.BytesIO(b'data'))
+            
+            summary = batch_mask.run_batch(archive_path, output_dir, options, workers=2)
+            self.assertEqual(summary['processed'], 3)
+            self.assertEqual(summary['failed'], 1)
+            mask_path, _ = batch_mask.output_paths(output_dir, os.path.join('nested', 'slide_1.png'))
+            self.assertEqual(Image.open(mask_path).size, (160, 120))
+            self.assertFalse(os.path.exists(os.path.join(os.path.dirname(output_dir), 'escape_mask.png')))
+            
+            summary = batch_mask.run_batch(archive_path, output_dir, options, workers=2)
+            self.assertEqual(summary['processed'], 0)
+            self.assertEqual(summary['skipped'], 3)
+            
+            # Oversized entries fail without being read
+            with tempfile.TemporaryDirectory() as small_output_dir:
+                summary = batch_mask.run_batch(archive_path, small_output_dir, options, workers=2,
+                                               max_entry_bytes=16)
+                self.assertEqual(summary['processed'], 0)
+                self.assertEqual(summary['failed'], 4)
+            
+            # A file that is not an archive is rejected up front
+            with self.assertRaises(ValueError):
+                batch_mask.run_batch(paths[0], os.path.join(output_dir, 'rejected'), options, workers=2)
+            self.assertFalse(os.path.exists(os.path.join(output_dir, 'rejected')))
+
+
+class ReferenceProfileScriptTest(unittest.TestCase):
+    """Test streaming reference profile generation"""
+    
+    def test_profile_matches_in_memory_statistics(self):
+        """Test pooled streaming statistics equal statistics over all tissue samples"""
+        setup_reference_profiles = load_script('setup_reference_profiles')
+        from pipeline.normalize import sample_tissue_concentrations
+        from pipeline.od import rgb_to_od
+        from pipeline.stain import estimate_stain_vectors_macenko, extract_stain_concentrations
+        
+        with tempfile.TemporaryDirectory() as image_dir:
+            paths = write_test_images(image_dir, 4)
+            image_paths = list(setup_reference_profiles.iter_image_paths(image_dir))
+            
+            profile = setup_reference_profiles.generate_profile_from_images(image_paths, 'HE', workers=2)
+            
+            all_concentrations = []
+            for path in image_paths:
+                od = rgb_to_od(np.array(Image.open(path).convert('RGB')))
+                concentrations = extract_stain_concentrations(od, estimate_stain_vectors_macenko(od))
+                all_concentrations.append(sample_tissue_concentrations(concentrations, od))
+            flat = np.concatenate(all_concentrations).astype(np.float64)
+        
+        # iter_image_paths only lists the top level directory
+        self.assertEqual(profile['num_images'], len([p for p in paths if 'nested' not in p]))
+        self.assertAlmostEqual(profile['stain_0_mean'], float(flat[:, 0].mean()), places=8)
+        self.assertAlmostEqual(profile['stain_0_std'], float(flat[:, 0].std()), places=8)
+        self.assertAlmostEqual(profile['stain_1_std'], float(flat[:, 1].std()), places=8)
+
+
+
+class LoadTestScriptTest(unittest.TestCase):
+    """Test the load-test harness statistics"""
+    
+    def test_summary_percentiles_and_errors(self):
+        """Test latency percentiles match numpy and failed requests are excluded"""
+        load_test = load_script('load_test')
+        latencies = [float(v) for v in np.random.default_rng(0).uniform(10, 500, 200)]
+        records = [{'scenario': 'a' if i % 2 else 'b', 'status': 200, 'latency_ms': v, 'response_bytes': 1}
+                   for i, v in enumerate(latencies)]
+        records.append({'scenario': 'a', 'status': 500, 'latency_ms': 10000.0, 'response_bytes': 1})
+        
+        summary = load_test.summarize(records, 10.0, {'a': 0.25, 'b': 1.0})
+        
+        overall = summary['overall']
+        self.assertEqual(overall['requests'], 201)
+        self.assertEqual(overall['errors'], 1)
+        self.assertEqual(overall['status_counts'], {'200': 200, '500': 1})
+        for q in (50, 95, 99):
+            self.assertAlmostEqual(overall[f'latency_ms_p{q}'], float(np.percentile(latencies, q)))
+        self.assertAlmostEqual(overall['requests_per_second'], 20.0)
+        self.assertAlmostEqual(overall['megapixels_per_second'], (100 * 0.25 + 100 * 1.0) / 10.0)
+        self.assertEqual(summary['scenarios']['a']['errors'], 1)
+        self.assertEqual(summary['scenarios']['b']['requests'], 100)
+    
+    def test_compare_results(self):
+        """Test relative changes against a baseline run"""
+        load_test = load_script('load_test')
+        stats = {'requests_per_second': 10.0, 'latency_ms_p50': 100.0,
+                 'latency_ms_p95': 200.0, 'latency_ms_p99': 400.0}
+        baseline = {'summary': {'overall': stats, 'scenarios': {'a': stats}},
+                    'memory': {'max_worker_peak_rss_mb': 500.0}}
+        faster = {key: value / 2 for key, value in stats.items()}
+        current = {'summary': {'overall': faster, 'scenarios': {'a': faster, 'new': faster}},
+                   'memory': {'max_worker_peak_rss_mb': 400.0}}
+        
+        rows = load_test.compare_results(current, baseline)
+        
+        self.assertEqual(len(rows), 2 * 4 + 1)
+        changes = {(scope, metric): change for scope, metric, _, _, change in rows}
+        self.assertAlmostEqual(changes[('overall', 'latency_ms_p99')], -50.0)
+        self.assertAlmostEqual(changes[('a', 'requests_per_second')], -50.0)
+        self.assertAlmostEqual(changes[('overall', 'max_worker_peak_rss_mb')], -20.0)
+
+
 if __name__ == '__main__':
     unittest.main()
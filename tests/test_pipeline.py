@@ -8,6 +8,8 @@ from pipeline.stain import estimate_stain_vectors_macenko, extract_stain_concent
 from pipeline.threshold import apply_threshold
 from pipeline.morphology import morphological_cleanup
 from pipeline.pipeline import TissueMaskingPipeline
+from pipeline import runtime
+from pipeline.parallel import row_bands, map_row_bands
 
 
 class TestOD(unittest.TestCase):
@@ -35,6 +37,44 @@ class TestOD(unittest.TestCase):
         
         self.assertEqual(total.shape, (2, 2))
         self.assertAlmostEqual(total[0, 0], 0.6, places=5)
+    
+    def test_od_lut_matches_formula(self):
+        """Test the uint8 lookup path is bit-identical to the direct formula"""
+        rgb = np.random.default_rng(0).integers(0, 256, (50, 70, 3), dtype=np.uint8)
+        white = np.array([231.0, 240.0, 252.0], dtype=np.float32)
+        
+        for image in (rgb, rgb[::2, ::3], rgb.reshape(-1, 3), np.stack([rgb, rgb])):
+            for white_reference in (255.0, white):
+                np.testing.assert_array_equal(
+                    rgb_to_od(image, white_reference=white_reference),
+                    rgb_to_od(image.astype(np.float32), white_reference=white_reference)
+                )
+    
+    def test_adaptive_white_reference(self):
+        """Test the histogram white reference follows dim, tinted illumination"""
+        from pipeline.od import channel_histograms, estimate_white_reference
+        
+        rng = np.random.default_rng(1)
+        rgb = np.clip(rng.normal([212, 220, 232], 2, (200, 200, 3)), 0, 255).astype(np.uint8)
+        rgb[50:150, 50:150] = np.clip(rng.normal([150, 90, 140], 8, (100, 100, 3)), 0, 255)
+        
+        histograms = channel_histograms(rgb)
+        for c in range(3):
+            np.testing.assert_array_equal(histograms[c], np.bincount(rgb[:, :, c].ravel(), minlength=256))
+        white = estimate_white_reference(rgb, histograms=histograms)
+        np.testing.assert_allclose(white, [212, 220, 232], atol=10)
+        self.assertTrue(np.all(white >= rgb[0:50].reshape(-1, 3).mean(axis=0)))
+        
+        pipeline = TissueMaskingPipeline(stain_method='none', threshold_method='otsu',
+                                         adaptive_white_reference=True)
+        result = pipeline.process(rgb)
+        
+        np.testing.assert_array_equal(result['slide_parameters']['white_reference'], white)
+        # Glass OD against its own white is a fraction of that against 255
+        glass_od = np.median(result['od_image'][0:50].sum(axis=2))
+        self.assertLess(glass_od, 0.25 * np.median(rgb_to_od(rgb[0:50]).sum(axis=2)))
+        self.assertGreater(result['mask'][60:140, 60:140].mean(), 250)
+        self.assertEqual(result['mask'][0:40].max(), 0)
 
 
 class TestStain(unittest.TestCase):
@@ -68,6 +108,20 @@ class TestThreshold(unittest.TestCase):
         # Should separate background and tissue
         self.assertLess(np.sum(mask[0:50, :] > 0), np.sum(mask[50:, :] > 0))
 
+    def test_threshold_batch_matches_per_channel(self):
+        """Test batched thresholds equal per-channel thresholds"""
+        from pipeline.threshold import compute_threshold, compute_threshold_batch
+        
+        rng = np.random.default_rng(0)
+        channels = np.concatenate([
+            rng.gamma(2.0, 0.1, (6, 64, 32)), rng.gamma(9.0, 0.1, (6, 64, 32))
+        ], axis=2).astype(np.float32)
+        channels[1] = 0.5  # Constant channel
+        
+        for method in ('otsu', 'auto'):
+            expected = [compute_threshold(channel, method=method) for channel in channels]
+            np.testing.assert_array_equal(compute_threshold_batch(channels, method=method), expected)
+
 
 class TestPipeline(unittest.TestCase):
     """Test complete pipeline"""
@@ -93,6 +147,1068 @@ class TestPipeline(unittest.TestCase):
         # Mask should be binary
         self.assertTrue(np.all(np.isin(result['mask'], [0, 255])))
 
+    def test_pipeline_threaded_bit_identical(self):
+        """Test row-band threading matches serial output exactly"""
+        rng = np.random.default_rng(0)
+        rgb = np.full((400, 300, 3), 240, dtype=np.uint8)
+        rgb[100:300, 50:250] = rng.integers(60, 200, (200, 200, 3), dtype=np.uint8)
+        
+        for stain_method in ('macenko', 'none'):
+            serial = TissueMaskingPipeline(stain_method=stain_method, num_threads=1).process(rgb)
+            threaded = TissueMaskingPipeline(stain_method=stain_method, num_threads=4).process(rgb)
+            
+            np.testing.assert_array_equal(serial['od_image'], threaded['od_image'])
+            np.testing.assert_array_equal(serial['mask'], threaded['mask'])
+
+    def test_remask_roi_matches_full_run(self):
+        """Test ROI re-masking with unchanged parameters reproduces the full mask"""
+        from pipeline.roi import splice_roi
+        
+        rgb = np.full((300, 300, 3), 240, dtype=np.uint8)
+        rgb[60:240, 40:200] = [180, 120, 80]
+        rgb[100:120, 220:280] = [170, 110, 90]
+        pipeline = TissueMaskingPipeline(threshold_method='otsu')
+        result = pipeline.process(rgb)
+        
+        roi_mask, roi = pipeline.remask_roi(rgb, (150, 80, 200, 100), result['slide_parameters'])
+        self.assertEqual(roi, (150, 80, 150, 100))  # Clipped to the image
+        np.testing.assert_array_equal(roi_mask, result['mask'][80:180, 150:300])
+        
+        # A higher threshold removes tissue inside the ROI only
+        mask = result['mask'].copy()
+        strict_mask, _ = pipeline.remask_roi(rgb, roi, result['slide_parameters'], threshold=1e6)
+        changed = splice_roi(mask, strict_mask, roi)
+        self.assertEqual(changed, -int((result['mask'][80:180, 150:300] > 0).sum()))
+        self.assertFalse(mask[80:180, 150:300].any())
+        np.testing.assert_array_equal(mask[:80], result['mask'][:80])
+        
+        with self.assertRaises(ValueError):
+            pipeline.remask_roi(rgb, roi, result['slide_parameters'], halo=-1)
+
+    def test_process_batch_matches_process(self):
+        """Test batched processing matches processing tile by tile"""
+        rng = np.random.default_rng(0)
+        tiles = np.full((4, 128, 128, 3), 240, dtype=np.uint8)
+        for i in range(3):
+            tiles[i, 20:100, 10 + i * 8:90 + i * 8] = rng.integers(60, 200, (80, 80, 3), dtype=np.uint8)
+        # Last tile is blank
+        
+        for kwargs in ({'threshold_method': 'otsu', 'fast_paths': True},
+                       {'stain_method': 'none', 'threshold_method': 'auto'}):
+            pipeline = TissueMaskingPipeline(**kwargs)
+            batch = pipeline.process_batch(tiles)
+            
+            self.assertEqual(batch['masks'].shape, (4, 128, 128))
+            for i, tile in enumerate(tiles):
+                result = pipeline.process(tile)
+                np.testing.assert_array_equal(batch['masks'][i], result['mask'])
+                self.assertEqual(batch['fast_paths'][i], result.get('fast_path'))
+                if i < 3:
+                    self.assertAlmostEqual(batch['thresholds'][i], result['slide_parameters']['threshold'],
+                                           places=4)
+                self.assertEqual(batch['metrics'][i]['qc_flags'], result['metrics']['qc_flags'])
+                self.assertAlmostEqual(batch['metrics'][i]['mean_total_od'],
+                                       result['metrics']['mean_total_od'], places=4)
+                if i < 3 and kwargs.get('stain_method') != 'none':
+                    np.testing.assert_allclose(batch['stain_vectors'][i],
+                                               result['slide_parameters']['stain_vectors'], atol=1e-3)
+
+    def test_fast_paths(self):
+        """Test blank, fully covered and degenerate images skip thresholding"""
+        from pipeline.precheck import fast_path_counts
+        
+        rng = np.random.default_rng(0)
+        blank = np.clip(rng.normal(240, 3, (256, 256, 3)), 0, 255).astype(np.uint8)
+        full = np.clip(rng.normal([150, 90, 140], 20, (256, 256, 3)), 0, 255).astype(np.uint8)
+        partial = blank.copy()
+        partial[64:192, 64:192] = full[64:192, 64:192]
+        pipeline = TissueMaskingPipeline(fast_paths=True)
+        before = fast_path_counts()
+        
+        result = pipeline.process(blank)
+        self.assertEqual(result['fast_path'], 'blank')
+        self.assertEqual(result['mask'].max(), 0)
+        self.assertIn('BLANK_IMAGE', result['metrics']['qc_flags'])
+        self.assertIn('LOW_TISSUE_AREA', result['metrics']['qc_flags'])
+        
+        result = pipeline.process(full)
+        self.assertEqual(result['fast_path'], 'full')
+        self.assertEqual(result['mask'].min(), 255)
+        self.assertEqual(result['metrics']['tissue_area_fraction'], 1.0)
+        self.assertAlmostEqual(result['metrics']['mean_total_od'],
+                               float(result['od_image'].sum(axis=2).mean()), places=4)
+        self.assertIn('FULL_TISSUE_COVERAGE', result['metrics']['qc_flags'])
+        
+        result = pipeline.process(full[:8, :8])
+        self.assertEqual(result['fast_path'], 'degenerate')
+        self.assertEqual(result['mask'].shape, (8, 8))
+        self.assertIn('DEGENERATE_IMAGE', result['metrics']['qc_flags'])
+        
+        result = pipeline.process(partial)
+        self.assertNotIn('fast_path', result)
+        self.assertIsNotNone(result['slide_parameters']['stain_vectors'])
+        
+        # Disabled (the default), or while parameters are being established for a context
+        self.assertNotIn('fast_path', TissueMaskingPipeline().process(blank))
+        self.assertNotIn('fast_path', pipeline.process(full, allow_fast_path=False))
+        with self.assertRaises(ValueError):
+            pipeline.process(blank[:0])
+        
+        after = fast_path_counts()
+        self.assertEqual(after['checked'] - before['checked'], 4)
+        for kind in ('blank', 'full', 'degenerate'):
+            self.assertEqual(after[kind] - before[kind], 1)
+        
+        # ROI edits of a fast-path result estimate what was skipped
+        result = pipeline.process(blank)
+        roi_mask, roi = pipeline.remask_roi(partial, (32, 32, 192, 192), result['slide_parameters'])
+        self.assertGreater(roi_mask.mean(), 50)
+    
+    def test_fast_paths_dim_background(self):
+        """Test a background darker than the white reference is not taken for full coverage"""
+        from pipeline.precheck import classify_image
+        
+        rng = np.random.default_rng(0)
+        dim = np.full((400, 400, 3), 215, dtype=np.uint8)
+        tissue = dim.copy()
+        tissue[:200, :200] = np.clip(rng.normal([150, 90, 140], 20, (200, 200, 3)), 0, 255)
+        
+        self.assertIsNone(classify_image(dim))
+        self.assertIsNone(classify_image(tissue))
+        
+        result = TissueMaskingPipeline(fast_paths=True).process(tissue)
+        self.assertNotIn('fast_path', result)
+        self.assertNotIn('FULL_TISSUE_COVERAGE', result['metrics']['qc_flags'])
+        self.assertAlmostEqual(result['metrics']['tissue_area_fraction'], 0.25, delta=0.05)
+    
+    def test_process_batch_shared_stain_vectors(self):
+        """Test shared stain vectors are used for every tile"""
+        tiles = np.full((2, 64, 64, 3), 240, dtype=np.uint8)
+        tiles[:, 10:50, 10:50] = [180, 120, 80]
+        stain_vectors = np.array([[0.65, 0.70, 0.29], [0.07, 0.99, 0.11]])
+        
+        batch = TissueMaskingPipeline(threshold_method='otsu').process_batch(tiles, stain_vectors=stain_vectors)
+        
+        np.testing.assert_array_equal(batch['stain_vectors'], np.stack([stain_vectors] * 2))
+        with self.assertRaises(ValueError):
+            TissueMaskingPipeline().process_batch(tiles[0])
+
+
+class TestFlatField(unittest.TestCase):
+    """Test flat-field gain maps and the registry"""
+    
+    def setUp(self):
+        rng = np.random.default_rng(6)
+        self.flat = rng.integers(150, 256, (64, 96, 3), dtype=np.uint8)
+        self.rgb = rng.integers(0, 256, (64, 96, 3), dtype=np.uint8)
+    
+    def test_gain_matches_division(self):
+        from pipeline.preprocess import flat_field_correction
+        
+        expected = np.clip(
+            self.rgb.astype(np.float32) / np.clip(self.flat.astype(np.float32) / 255.0, 0.01, 1.0), 0, 255
+        ).astype(np.uint8)
+        corrected = flat_field_correction(self.rgb, self.flat)
+        
+        self.assertEqual(corrected.dtype, np.uint8)
+        self.assertLessEqual(np.abs(corrected.astype(int) - expected).max(), 1)
+    
+    def test_registry_persists_and_caches_resolutions(self):
+        import tempfile
+        from pipeline.preprocess import FlatFieldRegistry, UnknownFlatFieldError
+        
+        with tempfile.TemporaryDirectory() as directory:
+            registry = FlatFieldRegistry(directory)
+            self.assertEqual(registry.register('scanner-1', self.flat), (64, 96))
+            
+            resized = registry.get_gain('scanner-1', (128, 192, 3))
+            self.assertEqual(resized.shape, (128, 192, 3))
+            self.assertIs(registry.get_gain('scanner-1', (128, 192)), resized)
+            
+            # Another process (fresh registry) sees the stored gain map
+            other = FlatFieldRegistry(directory)
+            self.assertEqual(other.scanner_ids(), ['scanner-1'])
+            np.testing.assert_array_equal(
+                other.get_gain('scanner-1', self.flat.shape), registry.get_gain('scanner-1', self.flat.shape)
+            )
+            
+            with self.assertRaises(UnknownFlatFieldError):
+                registry.get_gain('scanner-2', self.flat.shape)
+            with self.assertRaises(ValueError):
+                registry.register('../escape', self.flat)
+
+
+class TestColorLUT(unittest.TestCase):
+    """Test per-color evaluation of the per-pixel stages"""
+    
+    def setUp(self):
+        rng = np.random.default_rng(5)
+        self.rgb = np.full((256, 256, 3), 235, dtype=np.uint8)
+        self.rgb[64:192, 40:200] = [170, 110, 150]
+        self.rgb = np.clip(self.rgb + rng.normal(0, 10, self.rgb.shape), 0, 255).astype(np.uint8)
+    
+    def test_unique_index_round_trip(self):
+        from pipeline.lut import index_unique_colors, scatter
+        
+        color_index = index_unique_colors(self.rgb)
+        
+        np.testing.assert_array_equal(scatter(color_index.colors, color_index), self.rgb)
+        self.assertEqual(color_index.counts.sum(), 256 * 256)
+        self.assertEqual(len(color_index.colors), len(np.unique(self.rgb.reshape(-1, 3), axis=0)))
+    
+    def test_quantized_index_cell_centers(self):
+        from pipeline.lut import index_quantized_colors, scatter
+        
+        color_index = index_quantized_colors(self.rgb, bits=6)
+        
+        self.assertEqual(len(color_index.colors), 1 << 18)
+        self.assertLessEqual(np.abs(scatter(color_index.colors, color_index).astype(int) - self.rgb).max(), 2)
+    
+    def test_weighted_macenko_matches_per_pixel(self):
+        from pipeline.lut import index_unique_colors
+        from pipeline.od import rgb_to_od
+        
+        color_index = index_unique_colors(self.rgb)
+        
+        per_pixel = estimate_stain_vectors_macenko(rgb_to_od(self.rgb))
+        weighted = estimate_stain_vectors_macenko(rgb_to_od(color_index.colors), weights=color_index.counts)
+        np.testing.assert_allclose(weighted, per_pixel, atol=1e-4)
+    
+    def test_unique_mode_matches_per_pixel(self):
+        for stain_method in ('macenko', 'none'):
+            exact = TissueMaskingPipeline(stain_method=stain_method).process(self.rgb)
+            result = TissueMaskingPipeline(stain_method=stain_method, color_lut='unique').process(self.rgb)
+            
+            np.testing.assert_array_equal(result['od_image'], exact['od_image'])
+            np.testing.assert_array_equal(result['mask'], exact['mask'])
+            self.assertEqual(result['color_lut']['mode'], 'unique')
+    
+    def test_quantized_mode_falls_back_when_inaccurate(self):
+        result = TissueMaskingPipeline(color_lut='quantized', lut_bits=3, lut_tolerance=1e-6).process(self.rgb)
+        self.assertEqual(result['color_lut']['mode'], 'unique')
+        
+        result = TissueMaskingPipeline(color_lut='quantized', lut_tolerance=1.0).process(self.rgb)
+        self.assertEqual(result['color_lut']['mode'], 'quantized')
+        self.assertLessEqual(result['color_lut']['max_error'], 1.0)
+
+
+class TestPreview(unittest.TestCase):
+    """Test downsampled preview rendering"""
+    
+    def test_preview_size(self):
+        from pipeline.preview import preview_size
+        
+        self.assertEqual(preview_size((4000, 3000, 3), 1000), (750, 1000))
+        self.assertEqual(preview_size((400, 300), 1000), (300, 400))
+        self.assertEqual(preview_size((400, 300), 0), (300, 400))
+    
+    def test_blend_matches_float_overlay(self):
+        """Test in-place uint8 blending matches the float32 formula"""
+        from pipeline.preview import blend_overlay
+        
+        rng = np.random.default_rng(0)
+        image = rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)
+        mask = np.zeros((64, 64), dtype=np.uint8)
+        mask[16:48] = 255
+        
+        expected = image.astype(np.float32)
+        expected[mask > 0] = expected[mask > 0] * 0.7 + np.array([0, 255, 0]) * 0.3
+        blended = blend_overlay(image.copy(), mask)
+        
+        self.assertLessEqual(np.abs(blended.astype(int) - expected.astype(np.uint8)).max(), 1)
+        np.testing.assert_array_equal(blended[mask == 0], image[mask == 0])
+    
+    def test_render_previews(self):
+        from pipeline.preview import render_previews
+        
+        image = np.full((800, 400, 3), 240, dtype=np.uint8)
+        mask = np.zeros((800, 400), dtype=np.uint8)
+        mask[200:600, 100:300] = 255
+        
+        previews = render_previews(image, mask, normalized_rgb=image, max_dimension=200,
+                                   mask_thumbnail=True)
+        
+        self.assertEqual(previews['overlay'].shape, (200, 100, 3))
+        self.assertEqual(previews['normalized_rgb'].shape, (200, 100, 3))
+        thumbnail = previews['mask_thumbnail']
+        self.assertTrue(np.all(np.isin(thumbnail, [0, 255])))
+        self.assertEqual(np.count_nonzero(thumbnail), 100 * 50)
+
+        bgr = render_previews(image, mask, normalized_rgb=image, max_dimension=200,
+                              channel_order='bgr')
+        np.testing.assert_array_equal(bgr['overlay'], previews['overlay'][..., ::-1])
+
+
+class TestImageIO(unittest.TestCase):
+    """Test the decode/encode data path allocates no full-image copies"""
+    
+    def setUp(self):
+        y, x = np.mgrid[0:1000, 0:1200]
+        self.image = np.stack([x % 256, y % 256, (x + y) % 256], axis=-1).astype(np.uint8)
+        self.mask = np.where((x - 600) ** 2 + (y - 500) ** 2 < 300 ** 2, 255, 0).astype(np.uint8)
+    
+    def full_image_allocations(self, func, *args, **kwargs):
+        """Run func; return its result and peak traced memory in full-image units."""
+        import tracemalloc
+        # Imported outside the trace so the first import is not counted
+        import cv2  # noqa: F401
+        
+        tracemalloc.start()
+        try:
+            result = func(*args, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return result, peak / self.image.nbytes
+    
+    def test_decode_allocates_only_the_output(self):
+        import io
+        from PIL import Image
+        from pipeline.io import decode_image
+        
+        for image_format in ('PNG', 'JPEG'):
+            upload = io.BytesIO()
+            Image.fromarray(self.image).save(upload, format=image_format)
+            upload.seek(0)
+            expected = np.array(Image.open(io.BytesIO(upload.getvalue())))
+            
+            decoded, allocations = self.full_image_allocations(decode_image, upload)
+            
+            self.assertLess(allocations, 1.05)
+            np.testing.assert_array_equal(decoded, expected)
+            # The upload's buffer was released
+            upload.close()
+    
+    def test_decode_without_imread_color_rgb(self):
+        """Test OpenCV before 4.10 (no IMREAD_COLOR_RGB) still decodes to RGB in place"""
+        import io
+        import cv2
+        from PIL import Image
+        from pipeline.io import decode_image
+        
+        upload = io.BytesIO()
+        Image.fromarray(self.image).save(upload, format='PNG')
+        upload.seek(0)
+        rgb_flag = cv2.IMREAD_COLOR_RGB
+        del cv2.IMREAD_COLOR_RGB
+        try:
+            decoded, allocations = self.full_image_allocations(decode_image, upload)
+        finally:
+            cv2.IMREAD_COLOR_RGB = rgb_flag
+        
+        self.assertLess(allocations, 1.05)
+        np.testing.assert_array_equal(decoded, self.image)
+    
+    def test_encoders_do_not_copy_owned_images(self):
+        import base64
+        import io
+        from PIL import Image
+        from pipeline.io import encode_image, encode_mask_png, rgb_to_bgr_inplace
+        
+        encoded_mask, allocations = self.full_image_allocations(encode_mask_png, self.mask)
+        self.assertLess(allocations, 0.1)
+        decoded_mask = np.array(Image.open(io.BytesIO(base64.b64decode(encoded_mask))))
+        np.testing.assert_array_equal(decoded_mask, self.mask)
+        
+        # RGB input costs one converted copy; an owned image swapped in place none
+        _, allocations = self.full_image_allocations(encode_image, self.image)
+        self.assertGreaterEqual(allocations, 1.0)
+        owned = self.image.copy()
+        encoded, allocations = self.full_image_allocations(
+            lambda: encode_image(rgb_to_bgr_inplace(owned), channel_order='bgr')
+        )
+        self.assertLess(allocations, 0.5)
+        np.testing.assert_array_equal(np.array(Image.open(io.BytesIO(encoded))), self.image)
+    
+    def test_full_size_overlay_allocates_one_image(self):
+        from pipeline.preview import render_overlay
+        
+        overlay, allocations = self.full_image_allocations(render_overlay, self.image, self.mask)
+        
+        # Overlay itself, its mask and a band temporary
+        self.assertLess(allocations, 1.0 + 1 / 3 + 0.3)
+        np.testing.assert_array_equal(overlay[0, 0], self.image[0, 0])
+        self.assertFalse(np.array_equal(overlay[500, 600], self.image[500, 600]))
+
+
+class TestSharedMemory(unittest.TestCase):
+    """Test the shared-memory process pool transport"""
+    
+    def test_pool_matches_process_and_releases_segments(self):
+        """Test pooled masks match in-process masks and no segment outlives its job"""
+        from pipeline.shm import SharedMemoryPipelinePool
+        
+        rgb = np.full((120, 160, 3), 240, dtype=np.uint8)
+        rgb[20:100, 30:130] = [180, 120, 80]
+        options = {'stain_method': 'none', 'threshold_method': 'otsu'}
+        expected = TissueMaskingPipeline(**options).process(rgb)
+        
+        with SharedMemoryPipelinePool(workers=1, pipeline_options=options, threads=1) as pool:
+            results = list(pool.map([rgb, rgb]))
+            
+            # Decoded straight into shared memory, mask handed back uncopied
+            shared_image = pool.allocate_image(rgb.shape)
+            shared_image.array[...] = rgb
+            shared_result = pool.submit(shared_image, copy_mask=False).result()
+            np.testing.assert_array_equal(shared_result['mask'].array, expected['mask'])
+            pool.release(shared_result['mask'])
+            pool.release(shared_image)
+            
+            # A failing job still releases its segments
+            with self.assertRaises(Exception):
+                pool.submit(np.zeros((0, 0, 3), dtype=np.uint8)).result()
+            
+            stats = pool.stats()
+        
+        for result in results:
+            np.testing.assert_array_equal(result['mask'], expected['mask'])
+            self.assertEqual(result['metrics'], expected['metrics'])
+        self.assertEqual(stats['live_segments'], 0)
+        self.assertEqual(stats['created'], stats['released'])
+    
+    def test_registry_reports_and_unlinks_leaks(self):
+        """Test unreleased segments are reported on close and removed"""
+        from pipeline.shm import SharedArray, SharedMemoryRegistry
+        
+        registry = SharedMemoryRegistry()
+        kept = registry.put(np.arange(12, dtype=np.float32).reshape(3, 4), label='kept')
+        released = registry.create((8,), np.uint8)
+        self.assertTrue(registry.release(released))
+        self.assertFalse(registry.release(released))
+        
+        # Other processes attach by handle
+        with SharedArray.attach(kept.handle) as attached:
+            np.testing.assert_array_equal(attached.array, np.arange(12).reshape(3, 4))
+        
+        with self.assertWarns(ResourceWarning):
+            leaked = registry.close()
+        
+        self.assertEqual([segment['label'] for segment in leaked], ['kept'])
+        with self.assertRaises(FileNotFoundError):
+            SharedArray.attach(kept.handle)
+
+
+class TestRegions(unittest.TestCase):
+    """Test region geometry and the region spatial index"""
+    
+    def create_mask(self):
+        """Ring with an island in its hole, a rectangle and a single pixel"""
+        import cv2
+        
+        mask = np.zeros((300, 400), dtype=np.uint8)
+        cv2.circle(mask, (100, 100), 80, 255, -1)
+        cv2.circle(mask, (100, 100), 40, 0, -1)
+        cv2.circle(mask, (100, 100), 10, 255, -1)
+        mask[150:280, 250:380] = 255
+        mask[290, 20] = 255
+        return mask
+    
+    def test_extract_regions(self):
+        """Test per-component areas, holes and mean OD"""
+        from pipeline.regions import extract_regions
+        
+        mask = self.create_mask()
+        od_image = np.zeros(mask.shape + (3,), dtype=np.float32)
+        od_image[150:280, 250:380] = 0.2
+        
+        regions = extract_regions(mask, od_image)
+        
+        self.assertEqual(len(regions), 4)
+        self.assertEqual(sum(region['area'] for region in regions), int((mask > 0).sum()))
+        by_area = sorted(regions, key=lambda region: region['area'])
+        self.assertEqual(by_area[0]['bbox'], [20, 290, 1, 1])
+        self.assertEqual(len(by_area[2]['holes']), 1)  # Ring
+        self.assertEqual(len(by_area[3]['holes']), 0)  # Rectangle
+        self.assertAlmostEqual(by_area[3]['mean_od'], 0.6, places=5)
+    
+    def test_index_matches_mask(self):
+        """Test exact polygons answer point and box queries like the mask"""
+        from pipeline.regions import RegionIndex, extract_regions
+        
+        mask = self.create_mask()
+        index = RegionIndex.build(extract_regions(mask, epsilon=0), mask.shape, cell_size=32)
+        index = RegionIndex.from_bytes(index.to_bytes())
+        
+        rng = np.random.default_rng(0)
+        for x, y in rng.integers(0, [400, 300], (2000, 2)):
+            self.assertEqual(index.contains_point(x, y), bool(mask[y, x]), (x, y))
+        for x, y, width, height in np.column_stack([rng.integers(-20, 400, (500, 2)),
+                                                    rng.integers(1, 40, (500, 2))]):
+            expected = mask[max(0, y):max(0, y + height), max(0, x):max(0, x + width)].any()
+            self.assertEqual(index.intersects_box(x, y, width, height), expected, (x, y, width, height))
+        
+        self.assertEqual(index.region_at(100, 100), index.region_at(105, 100))
+        self.assertNotEqual(index.region_at(100, 100), index.region_at(100, 40))
+        self.assertIsNone(index.region_at(100, 75))  # In the hole
+        self.assertEqual(len(index.regions_in_box(0, 0, 400, 300)), 4)
+
+
+class TestOccupancy(unittest.TestCase):
+    """Test tile-occupancy grids"""
+    
+    def test_occupancy_matches_direct_sums(self):
+        """Test integral-image fractions equal per-tile sums"""
+        from pipeline.occupancy import tile_occupancy
+        
+        rng = np.random.default_rng(0)
+        mask = (rng.random((130, 210)) > 0.6).astype(np.uint8) * 255
+        
+        occupancy = tile_occupancy(mask, 32, stride=24)
+        
+        self.assertEqual(occupancy.shape, (5, 8))
+        for i in range(5):
+            for j in range(8):
+                tile = mask[i * 24:i * 24 + 32, j * 24:j * 24 + 32]
+                self.assertAlmostEqual(occupancy[i, j], np.mean(tile > 0), places=6)
+        self.assertEqual(tile_occupancy(mask, 256).shape, (0, 0))
+    
+    def test_occupancy_encoding_round_trip(self):
+        """Test uint8 and float32 serializations"""
+        from pipeline.occupancy import decode_occupancy, encode_occupancy
+        
+        occupancy = np.array([[0.0, 0.25], [0.5, 1.0]], dtype=np.float32)
+        
+        data = encode_occupancy(occupancy, 'uint8')
+        self.assertEqual(len(data), 4)
+        np.testing.assert_allclose(decode_occupancy(data, (2, 2), 'uint8'), occupancy, atol=1 / 255)
+        np.testing.assert_array_equal(
+            decode_occupancy(encode_occupancy(occupancy, 'float32'), (2, 2), 'float32'), occupancy
+        )
+
+
+class TestArchive(unittest.TestCase):
+    """Test streaming image entries out of archives"""
+    
+    def setUp(self):
+        self.entries = {
+            'tiles/a.png': b'a' * 10,
+            'tiles/big.jpg': b'b' * 100,
+            'tiles/.hidden.png': b'h',
+            '__MACOSX/tiles/._a.png': b'm',
+            'README.txt': b'r',
+            'B.TIF': b'c' * 20,
+        }
+    
+    def check_entries(self, archive_io):
+        from pipeline.archive import iter_archive_images
+        
+        entries = list(iter_archive_images(archive_io, max_entry_bytes=50))
+        
+        self.assertEqual([entry.name for entry in entries], ['tiles/a.png', 'tiles/big.jpg', 'B.TIF'])
+        self.assertEqual(entries[0].file.read(), self.entries['tiles/a.png'])
+        self.assertEqual(entries[0].file.name, 'tiles/a.png')
+        self.assertIsNone(entries[1].file)
+        self.assertIn('larger than 50', entries[1].error)
+        self.assertEqual(entries[2].size, 20)
+    
+    def test_zip_entries(self):
+        import io
+        import zipfile
+        
+        archive_io = io.BytesIO()
+        with zipfile.ZipFile(archive_io, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for name, data in self.entries.items():
+                archive.writestr(name, data)
+        archive_io.seek(0)
+        
+        self.check_entries(archive_io)
+    
+    def test_tar_entries(self):
+        import io
+        import tarfile
+        from pipeline.archive import archive_format, iter_archive_images
+        
+        for mode in ('w', 'w:gz', 'w:bz2', 'w:xz'):
+            archive_io = io.BytesIO()
+            with tarfile.open(fileobj=archive_io, mode=mode) as archive:
+                for name, data in self.entries.items():
+                    info = tarfile.TarInfo(name)
+                    info.size = len(data)
+                    archive.addfile(info, io.BytesIO(data))
+            archive_io.seek(0)
+            
+            self.assertEqual(archive_format(archive_io), 'tar')
+            self.check_entries(archive_io)
+        
+        with self.assertRaises(ValueError):
+            list(iter_archive_images(io.BytesIO(b'not an archive')))
+
+
+class TestMaskTiff(unittest.TestCase):
+    """Test tiled TIFF mask output"""
+    
+    def setUp(self):
+        self.mask = np.zeros((300, 500), dtype=np.uint8)
+        self.mask[40:260, 90:410] = 255
+        self.mask[100:110, 200:210] = 0
+    
+    def test_pyramid_round_trip(self):
+        import io
+        import tifffile
+        from pipeline.mask_tiff import halve_mask, iter_mask_tiles, write_mask_tiff
+        
+        for compression in ('deflate', 'packbits', 'none'):
+            target = io.BytesIO()
+            info = write_mask_tiff(target, iter_mask_tiles(self.mask, 128), self.mask.shape,
+                                   tile_size=128, compression=compression, pyramid=True)
+            
+            self.assertEqual(info['levels'], [[500, 300], [250, 150], [125, 75]])
+            target.seek(0)
+            with tifffile.TiffFile(target) as tif:
+                self.assertTrue(tif.pages[0].is_tiled)
+                levels = [level.asarray() for level in tif.series[0].levels]
+            np.testing.assert_array_equal(levels[0], self.mask)
+            np.testing.assert_array_equal(levels[1], halve_mask(self.mask))
+            np.testing.assert_array_equal(levels[2], halve_mask(halve_mask(self.mask)))
+        
+        with self.assertRaises(ValueError):
+            write_mask_tiff(io.BytesIO(), iter_mask_tiles(self.mask, 100), self.mask.shape, tile_size=100)
+    
+    def test_file_store(self):
+        import os
+        import tempfile
+        import tifffile
+        from pipeline.mask_tiff import MaskFileStore, iter_mask_tiles
+        
+        with tempfile.TemporaryDirectory() as directory:
+            store = MaskFileStore(directory, ttl_seconds=60)
+            info = store.write(iter_mask_tiles(self.mask, 256), self.mask.shape, tile_size=256)
+            
+            path = store.path(info['file_id'])
+            self.assertEqual(os.path.getsize(path), info['bytes'])
+            np.testing.assert_array_equal(tifffile.imread(path), self.mask)
+            for file_id in ('../' + info['file_id'], '0' * 32):
+                with self.assertRaises(KeyError):
+                    store.path(file_id)
+            
+            os.utime(path, (0, 0))
+            self.assertEqual(store.prune(), 1)
+            with self.assertRaises(KeyError):
+                store.path(info['file_id'])
+
+
+class TestParallel(unittest.TestCase):
+    """Test row-band helpers"""
+    
+    def test_row_bands_cover_rows(self):
+        """Test bands are contiguous and cover every row once"""
+        bands = row_bands(103, 4)
+        
+        self.assertEqual(len(bands), 4)
+        self.assertEqual(bands[0].start, 0)
+        self.assertEqual(bands[-1].stop, 103)
+        for previous, current in zip(bands, bands[1:]):
+            self.assertEqual(previous.stop, current.start)
+    
+    def test_map_row_bands(self):
+        """Test banded map matches the whole-array result"""
+        array = np.arange(512 * 4, dtype=np.float32).reshape(512, 4)
+        
+        result = map_row_bands(lambda band: np.sqrt(band), array, num_threads=4)
+        
+        np.testing.assert_array_equal(result, np.sqrt(array))
+
+
+class TestSession(unittest.TestCase):
+    """Test slide session context reuse"""
+    
+    def make_tile(self, offset, tissue=True):
+        rgb = np.full((128, 128, 3), 240, dtype=np.uint8)
+        if tissue:
+            rng = np.random.default_rng(offset)
+            rgb[20:100, 10 + offset:90 + offset] = rng.integers(90, 190, (80, 80, 3), dtype=np.uint8)
+        return rgb
+    
+    def test_first_tissue_tile_establishes_context(self):
+        """Test later tiles reuse stain vectors and threshold"""
+        from pipeline.session import SlideContext
+        
+        pipeline = TissueMaskingPipeline(stain_method='macenko', threshold_method='otsu')
+        context = SlideContext()
+        
+        # A blank tile is not trusted for the whole slide
+        pipeline.process(self.make_tile(0, tissue=False), context=context)
+        self.assertFalse(context.is_established)
+        
+        first = pipeline.process(self.make_tile(0), context=context)
+        self.assertTrue(context.is_established)
+        second = pipeline.process(self.make_tile(20), context=context)
+        
+        np.testing.assert_array_equal(
+            first['slide_parameters']['stain_vectors'],
+            second['slide_parameters']['stain_vectors']
+        )
+        self.assertEqual(first['slide_parameters']['threshold'], second['slide_parameters']['threshold'])
+        self.assertEqual(context.tiles_processed, 3)
+    
+    def test_establish_from_thumbnail(self):
+        """Test a thumbnail establishes the context explicitly"""
+        from pipeline.session import SlideContext
+        
+        pipeline = TissueMaskingPipeline(stain_method='none', threshold_method='otsu')
+        context = SlideContext()
+        
+        self.assertTrue(pipeline.establish_context(context, self.make_tile(5)))
+        self.assertFalse(pipeline.establish_context(context, self.make_tile(10)))
+        self.assertIsNotNone(context.get('threshold'))
+    
+    def test_parameter_store_shares_first_saved(self):
+        """Test stored parameters round-trip exactly and the first save wins"""
+        import tempfile
+        from pipeline.session import SlideContext, SlideParameterStore
+        
+        pipeline = TissueMaskingPipeline(stain_method='macenko', threshold_method='otsu', normalize=True)
+        first, second = SlideContext(), SlideContext()
+        pipeline.process(self.make_tile(0), context=first)
+        pipeline.process(self.make_tile(20), context=second)
+        
+        with tempfile.TemporaryDirectory() as directory:
+            store = SlideParameterStore(directory)
+            key = ('slide-1', 'macenko', 'otsu', True, False)
+            self.assertIsNone(store.load(key))
+            self.assertEqual(store.save(key, first.parameters), (first.parameters, True))
+            stored, saved = store.save(key, second.parameters)
+            self.assertFalse(saved)
+            
+            loaded = store.load(key)
+            self.assertEqual(set(loaded), set(first.parameters))
+            for name, value in first.parameters.items():
+                if isinstance(value, dict):
+                    self.assertEqual(loaded[name], value)
+                else:
+                    np.testing.assert_array_equal(loaded[name], value)
+                    self.assertEqual(np.asarray(loaded[name]).dtype, np.asarray(value).dtype)
+            
+            # Another worker restoring the parameters masks exactly as this one
+            restored = SlideContext()
+            restored.establish(**loaded)
+            from_store = pipeline.process(self.make_tile(30), context=restored)
+            from_first = pipeline.process(self.make_tile(30), context=first)
+            np.testing.assert_array_equal(from_store['mask'], from_first['mask'])
+    
+    def test_result_store_edits_persist(self):
+        """Test stored results are shared across store instances and edits are saved"""
+        import tempfile
+        from pipeline.result_store import ResultStore
+        from pipeline.roi import splice_roi
+        
+        pipeline = TissueMaskingPipeline(stain_method='macenko', threshold_method='otsu')
+        rgb = self.make_tile(0)
+        result = pipeline.process(rgb)
+        
+        with tempfile.TemporaryDirectory() as directory:
+            result_id = ResultStore(directory).add(
+                rgb, result['mask'], result['slide_parameters'], {'min_area': 100}
+            )
+            # A second worker process opens its own store on the same directory
+            entry = ResultStore(directory).get(result_id)
+            np.testing.assert_array_equal(entry.image, rgb)
+            self.assertEqual(entry.params, {'min_area': 100})
+            self.assertEqual(entry.slide_parameters['threshold'], result['slide_parameters']['threshold'])
+            with entry.lock():
+                entry.tissue_pixels += splice_roi(entry.mask, np.zeros((128, 64), np.uint8), (0, 0, 64, 128))
+            
+            edited = ResultStore(directory).get(result_id)
+            self.assertFalse(edited.mask[:, :64].any())
+            self.assertEqual(edited.tissue_pixels, np.count_nonzero(edited.mask))
+            self.assertIsNone(ResultStore(directory).get('0' * 32))
+            
+            store = ResultStore(directory, max_entries=1)
+            newest = store.add(rgb, result['mask'], result['slide_parameters'], {})
+            self.assertIsNone(store.get(result_id))
+            self.assertIsNotNone(store.get(newest))
+            self.assertIsNone(ResultStore(directory, ttl_seconds=-1).get(newest))
+    
+    def test_ttl_cache_expiry(self):
+        """Test entries expire after the TTL and are refreshed on access"""
+        from pipeline.session import TTLCache
+        
+        now = [0.0]
+        cache = TTLCache(ttl_seconds=10, max_entries=2, clock=lambda: now[0])
+        cache.set('a', 1)
+        now[0] = 8.0
+        self.assertEqual(cache.get('a'), 1)  # Refreshes expiry to 18
+        now[0] = 15.0
+        self.assertEqual(cache.get('a'), 1)
+        now[0] = 30.0
+        self.assertIsNone(cache.get('a'))
+        
+        value, created = cache.get_or_create('b', lambda: 'new')
+        self.assertTrue(created)
+        cache.set('c', 3)
+        cache.set('d', 4)  # Evicts least recently used 'b'
+        self.assertIsNone(cache.get('b'))
+
+
+class TestNormalize(unittest.TestCase):
+    """Test stain normalization statistics"""
+    
+    def test_running_stats_merge_matches_concatenation(self):
+        """Test merged running statistics equal statistics of all samples"""
+        from pipeline.normalize import RunningStats
+        
+        rng = np.random.default_rng(2)
+        batches = [rng.gamma(2.0, 0.3, (n, 2)) for n in (10, 2500, 1)]
+        
+        left = RunningStats(channels=2)
+        left.update(batches[0])
+        right = RunningStats(channels=2)
+        right.update(batches[1])
+        right.update(batches[2])
+        left.merge(right)
+        
+        everything = np.concatenate(batches)
+        self.assertEqual(left.count, len(everything))
+        np.testing.assert_allclose(left.mean, everything.mean(axis=0), rtol=1e-12)
+        np.testing.assert_allclose(left.std, everything.std(axis=0), rtol=1e-10)
+    
+    def test_generate_reference_profile_streams(self):
+        """Test reference profiles can be built from a generator"""
+        from pipeline.normalize import generate_reference_profile
+        
+        rng = np.random.default_rng(3)
+        maps = [rng.random((20, 30, 2)) for _ in range(3)]
+        
+        profile = generate_reference_profile(m for m in maps)
+        
+        self.assertEqual(profile['profile_version'], 2)
+        flat = np.concatenate([m.reshape(-1, 2) for m in maps])
+        self.assertAlmostEqual(profile['stain_0_mean'], float(flat[:, 0].mean()), places=10)
+        self.assertAlmostEqual(profile['stain_1_std'], float(flat[:, 1].std()), places=10)
+    
+    def test_reference_profile_version_checked(self):
+        """Test whole-image (unversioned) profiles are ignored with a warning"""
+        import json
+        import os
+        import tempfile
+        import warnings
+        from unittest import mock
+        from pipeline.normalize import REFERENCE_PROFILE_VERSION, load_reference_profile
+        
+        profile = {'stain_0_mean': 0.5, 'stain_0_std': 0.2, 'stain_1_mean': 0.4, 'stain_1_std': 0.15}
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch('pipeline.normalize.reference_profiles_dir', return_value=directory):
+            path = os.path.join(directory, 'he_reference.json')
+            with open(path, 'w') as f:
+                json.dump(profile, f)
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                self.assertIsNone(load_reference_profile('HE'))
+            self.assertIn('regenerate', str(caught[0].message))
+            
+            with open(path, 'w') as f:
+                json.dump(dict(profile, profile_version=REFERENCE_PROFILE_VERSION), f)
+            self.assertEqual(load_reference_profile('HE')['stain_0_mean'], 0.5)
+    
+    def test_tissue_statistics_ignore_background(self):
+        """Test sampled statistics come from tissue pixels only"""
+        from pipeline.normalize import tissue_concentration_statistics
+        
+        concentrations = np.zeros((400, 400, 2), dtype=np.float32)
+        concentrations[100:300, 100:300] = [0.6, 0.3]
+        od_image = np.zeros((400, 400, 3), dtype=np.float32)
+        od_image[100:300, 100:300] = 0.5
+        
+        stats = tissue_concentration_statistics(concentrations, od_image, max_samples=10_000)
+        
+        self.assertAlmostEqual(stats['stain_0_mean'], 0.6, places=6)
+        self.assertAlmostEqual(stats['stain_1_mean'], 0.3, places=6)
+        self.assertAlmostEqual(stats['stain_0_std'], 0.0, places=6)
+    
+    def test_fused_reconstruction_matches_reference(self):
+        """Test float32 chunked reconstruction matches the float64 matmul path"""
+        from pipeline.normalize import (
+            normalization_affine, apply_normalization, concentrations_to_rgb,
+            RECONSTRUCTION_CHUNK_PIXELS
+        )
+        
+        rng = np.random.default_rng(4)
+        height = RECONSTRUCTION_CHUNK_PIXELS // 50 + 7  # Several chunks plus a remainder
+        concentrations = rng.gamma(2.0, 0.2, (height, 100, 2)).astype(np.float32)
+        stain_vectors = np.array([[0.65, 0.70, 0.29], [0.07, 0.99, 0.11]])
+        reference = {'stain_0_mean': 0.5, 'stain_0_std': 0.2, 'stain_1_mean': 0.4, 'stain_1_std': 0.15}
+        current = {'stain_0_mean': 0.4, 'stain_0_std': 0.25, 'stain_1_mean': 0.3, 'stain_1_std': 0.3}
+        
+        expected = np.zeros(concentrations.shape, dtype=np.float64)
+        for i in range(2):
+            expected[..., i] = np.maximum(
+                (concentrations[..., i] - current[f'stain_{i}_mean'])
+                * (reference[f'stain_{i}_std'] / current[f'stain_{i}_std'])
+                + reference[f'stain_{i}_mean'], 0)
+        expected_rgb = np.clip(
+            255.0 * np.power(10.0, -(expected.reshape(-1, 2) @ stain_vectors)), 0, 255
+        ).astype(np.uint8).reshape(height, 100, 3)
+        
+        normalized = apply_normalization(concentrations, *normalization_affine(reference, current))
+        np.testing.assert_allclose(normalized, expected, atol=1e-5)
+        rgb = concentrations_to_rgb(normalized, stain_vectors)
+        self.assertLessEqual(np.abs(rgb.astype(int) - expected_rgb).max(), 1)
+    
+    def test_pipeline_normalized_rgb(self):
+        """Test normalize=True returns a reconstruction and tissue-only statistics"""
+        rgb = np.full((200, 200, 3), 240, dtype=np.uint8)
+        rgb[50:150, 50:150] = [150, 80, 160]
+        
+        for num_threads in (1, 4):
+            result = TissueMaskingPipeline(normalize=True, num_threads=num_threads).process(rgb)
+            self.assertEqual(result['normalized_rgb'].shape, rgb.shape)
+            self.assertEqual(result['normalized_rgb'].dtype, np.uint8)
+            stats = result['slide_parameters']['concentration_stats']
+            self.assertIsNotNone(stats)
+
+
+def write_pyramidal_tiff(target, rgb, levels=3, mpp=0.25, tile=64):
+    """Write `rgb` as a tiled pyramidal TIFF with 2x downsampled levels."""
+    import tifffile
+    
+    pixels_per_cm = 10000.0 / mpp
+    with tifffile.TiffWriter(target) as tif:
+        tif.write(rgb, tile=(tile, tile), subifds=levels - 1, photometric='rgb',
+                  compression='zlib', resolution=(pixels_per_cm, pixels_per_cm),
+                  resolutionunit='CENTIMETER')
+        for level in range(1, levels):
+            factor = 2 ** level
+            tif.write(rgb[::factor, ::factor], tile=(tile, tile), subfiletype=1,
+                      photometric='rgb', compression='zlib')
+
+
+class TestSlide(unittest.TestCase):
+    """Test pyramidal TIFF reader"""
+    
+    def setUp(self):
+        import io
+        
+        rng = np.random.default_rng(1)
+        self.rgb = rng.integers(0, 255, (300, 400, 3), dtype=np.uint8)
+        self.tiff = io.BytesIO()
+        write_pyramidal_tiff(self.tiff, self.rgb)
+        self.tiff.seek(0)
+    
+    def test_levels_and_resolution(self):
+        """Test level geometry and microns-per-pixel are read"""
+        from pipeline.slide import SlideReader
+        
+        with SlideReader(self.tiff) as reader:
+            self.assertEqual(len(reader.levels), 3)
+            self.assertEqual((reader.levels[2].width, reader.levels[2].height), (100, 75))
+            self.assertAlmostEqual(reader.levels[0].mpp[0], 0.25, places=4)
+            self.assertAlmostEqual(reader.levels[2].mpp[0], 1.0, places=4)
+    
+    def test_select_level(self):
+        """Test level selection by resolution and by size"""
+        from pipeline.slide import SlideReader
+        
+        with SlideReader(self.tiff) as reader:
+            self.assertEqual(reader.select_level(target_mpp=0.6), 1)
+            self.assertEqual(reader.select_level(target_mpp=0.1), 0)
+            self.assertEqual(reader.select_level(max_dimension=250), 1)
+            self.assertEqual(reader.select_level(max_dimension=10), 2)
+            self.assertEqual(reader.select_level(), 0)
+    
+    def test_read_region_matches_source(self):
+        """Test tile-wise decoding reproduces the stored pixels"""
+        from pipeline.slide import SlideReader
+        
+        with SlideReader(self.tiff) as reader:
+            np.testing.assert_array_equal(reader.read_level(1), self.rgb[::2, ::2])
+            np.testing.assert_array_equal(
+                reader.read_region(0, x=50, y=70, width=100, height=90),
+                self.rgb[70:160, 50:150]
+            )
+    
+    def test_read_region_sparse_tiles(self):
+        """Test tiles stored empty (byte count 0) read as white background"""
+        import io
+        import tifffile
+        from pipeline.slide import SlideReader
+        
+        def tiles():
+            yield self.rgb[:64, :64]
+            yield None
+            yield None
+            yield self.rgb[64:128, 64:128]
+        
+        sparse = io.BytesIO()
+        tifffile.imwrite(sparse, tiles(), shape=(128, 128, 3), dtype=np.uint8, tile=(64, 64),
+                         photometric='rgb')
+        sparse.seek(0)
+        
+        with SlideReader(sparse) as reader:
+            region = reader.read_region(0, x=32, y=32, width=64, height=64)
+        np.testing.assert_array_equal(region[:32, :32], self.rgb[32:64, 32:64])
+        self.assertTrue((region[:32, 32:] == 255).all())
+        self.assertTrue((region[32:, :32] == 255).all())
+        np.testing.assert_array_equal(region[32:, 32:], self.rgb[64:96, 64:96])
+    
+    def test_read_slide_for_masking(self):
+        """Test the selected level is returned with its scale factor"""
+        from pipeline.slide import read_slide_for_masking
+        
+        rgb, info = read_slide_for_masking(self.tiff, max_dimension=120)
+        
+        self.assertEqual(rgb.shape, (75, 100, 3))
+        self.assertEqual(info['level'], 2)
+        self.assertEqual(info['scale_factor'], [4.0, 4.0])
+
+
+class TestLazyImports(unittest.TestCase):
+    """Test cold-start import cost stays low"""
+    
+    def test_import_pipeline_skips_heavy_dependencies(self):
+        """Test `import pipeline` loads no OpenCV/scikit-image/SciPy/Django"""
+        import json
+        import os
+        import subprocess
+        import sys
+        
+        repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONPATH=repo_root)
+        env.pop('DJANGO_SETTINGS_MODULE', None)
+        code = (
+            "import sys, json, pipeline; "
+            "print(json.dumps([m for m in ('cv2', 'skimage', 'scipy', 'django') if m in sys.modules]))"
+        )
+        output = subprocess.run(
+            [sys.executable, '-c', code], cwd=repo_root, env=env,
+            capture_output=True, text=True, check=True
+        ).stdout
+        
+        self.assertEqual(json.loads(output), [])
+    
+    def test_reference_profile_loads_outside_django(self):
+        """Test reference profiles resolve without Django settings"""
+        from pipeline.normalize import load_reference_profile
+        
+        profile = load_reference_profile('HE')
+        
+        self.assertIsNotNone(profile)
+        self.assertIn('stain_0_mean', profile)
+
+
+class TestRuntime(unittest.TestCase):
+    """Test serving runtime setup"""
+    
+    def test_threads_per_worker(self):
+        """Test native threads are split across workers"""
+        self.assertEqual(runtime.threads_per_worker(4, cpu_count=16), 4)
+        self.assertEqual(runtime.threads_per_worker(3, cpu_count=8), 2)
+        # Never below one thread, even with more workers than cores
+        self.assertEqual(runtime.threads_per_worker(8, cpu_count=2), 1)
+    
+    def test_warm_up_marks_ready(self):
+        """Test warm-up runs the pipeline and marks the process ready"""
+        seconds = runtime.warm_up(size=64)
+        
+        self.assertGreater(seconds, 0.0)
+        self.assertTrue(runtime.is_ready())
+    
+    def test_warmup_image_has_tissue(self):
+        """Test the warm-up image exercises the tissue path"""
+        rgb = runtime.create_warmup_image(128)
+        result = TissueMaskingPipeline(stain_method='macenko').process(rgb)
+        
+        self.assertGreater(result['metrics']['tissue_area_fraction'], 0.0)
+
 
 if __name__ == '__main__':
     unittest.main()
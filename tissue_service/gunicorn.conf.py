@@ -0,0 +1,68 @@
+"""
+Gunicorn configuration for production serving.
+
+Usage (from the repository root):
+    gunicorn -c tissue_service/gunicorn.conf.py
+
+Environment:
+    WEB_CONCURRENCY: number of worker processes (default: available cores)
+    PIPELINE_THREADS: native threads per worker (default: cores // workers)
+    PORT: listen port (default: 8000)
+    GUNICORN_TIMEOUT: worker timeout in seconds (default: 120)
+    SERVER_INTERFACE: 'wsgi' (default) or 'asgi' (uvicorn workers; needed for
+        the async endpoint to receive uploads without blocking the worker)
+"""
+import os
+import sys
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(PROJECT_DIR)
+
+# Make `pipeline`, `api` and the settings package importable before anything
+# heavy is loaded
+for path in (REPO_ROOT, PROJECT_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from pipeline import runtime  # noqa: E402  (stdlib-only import, no numpy yet)
+
+workers = int(os.environ.get('WEB_CONCURRENCY', runtime.available_cpu_count()))
+pipeline_threads = int(os.environ.get(
+    'PIPELINE_THREADS',
+    runtime.threads_per_worker(workers)
+))
+
+# Must run before numpy/cv2 are imported by the preloaded application
+runtime.configure_thread_limits(pipeline_threads)
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tissue_service.settings')
+
+chdir = PROJECT_DIR
+if os.environ.get('SERVER_INTERFACE', 'wsgi') == 'asgi':
+    wsgi_app = 'tissue_service.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'tissue_service.wsgi:application'
+    worker_class = 'sync'
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = 30
+keepalive = 5
+
+# Import Django, the pipeline and cv2/skimage/scipy once in the master so
+# workers share the pages copy-on-write
+preload_app = True
+
+
+def post_fork(server, worker):
+    """Re-apply the OpenCV thread limit; thread pools do not survive fork."""
+    runtime.configure_thread_limits(pipeline_threads, override=True)
+
+
+def post_worker_init(worker):
+    """Warm the pipeline up before the worker starts accepting requests."""
+    seconds = runtime.warm_up()
+    worker.log.info(
+        "Pipeline warmed up in %.2fs (%d threads per worker)",
+        seconds, pipeline_threads
+    )
@@ -59,6 +59,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'tissue_service.wsgi.application'
+ASGI_APPLICATION = 'tissue_service.asgi.application'
 
 # Database (optional - for job tracking)
 DATABASES = {
@@ -100,3 +101,56 @@ DATA_UPLOAD_MAX_MEMORY_SIZE = 50 * 1024 * 1024  # 50 MB
 # Pipeline configuration paths
 PIPELINE_CONFIG_DIR = os.path.join(BASE_DIR.parent, 'configs')
 REFERENCE_PROFILES_DIR = os.path.join(PIPELINE_CONFIG_DIR, 'reference_stain_profiles')
+
+# Serving: warm the pipeline up when the app loads (gunicorn does this per
+# worker in post_worker_init; enable for other servers such as runserver)
+PIPELINE_WARMUP_ON_STARTUP = os.environ.get('PIPELINE_WARMUP', '0') == '1'
+
+# Threads per request for the per-pixel pipeline stages (row-band parallelism)
+PIPELINE_INTRA_IMAGE_THREADS = int(os.environ.get('PIPELINE_INTRA_IMAGE_THREADS', '1'))
+
+# Async endpoint executor: concurrent pipeline jobs and the pending-work budget
+# (sum of width * height of queued and running images) before returning 429
+PIPELINE_EXECUTOR_WORKERS = int(os.environ.get('PIPELINE_EXECUTOR_WORKERS', '2'))
+PIPELINE_MAX_PENDING_PIXELS = int(os.environ.get('PIPELINE_MAX_PENDING_PIXELS', str(200_000_000)))
+
+# Slide sessions: parameters shared by tiles with the same session_id
+SLIDE_SESSION_TTL_SECONDS = int(os.environ.get('SLIDE_SESSION_TTL_SECONDS', '1800'))
+SLIDE_SESSION_MAX_ENTRIES = int(os.environ.get('SLIDE_SESSION_MAX_ENTRIES', '1000'))
+# Established session parameters, shared by all workers
+SLIDE_SESSION_DIR = os.environ.get('SLIDE_SESSION_DIR', os.path.join(BASE_DIR.parent, 'data', 'slide_sessions'))
+
+# Results kept for incremental ROI re-masking (image + mask per entry, on
+# disk and shared by all workers)
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', os.path.join(BASE_DIR.parent, 'data', 'results'))
+RESULT_CACHE_TTL_SECONDS = int(os.environ.get('RESULT_CACHE_TTL_SECONDS', '600'))
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', '16'))
+
+# Default maximum width/height of overlay and normalized-RGB previews (0 = full
+# size, as before previews could be downsampled)
+PREVIEW_MAX_DIMENSION = int(os.environ.get('PREVIEW_MAX_DIMENSION', '0'))
+
+# Flat-field gain maps per scanner id (shared by all workers)
+FLAT_FIELD_DIR = os.environ.get('FLAT_FIELD_DIR', os.path.join(BASE_DIR.parent, 'data', 'flat_fields'))
+# Resized gain maps cached per worker process
+FLAT_FIELD_CACHE_ENTRIES = int(os.environ.get('FLAT_FIELD_CACHE_ENTRIES', '32'))
+
+# Per-request metrics persisted as TissueMaskRecord rows by a write-behind
+# recorder (table created by `manage.py migrate`)
+METRICS_RECORDER_ENABLED = os.environ.get('METRICS_RECORDER_ENABLED', '0') == '1'
+# Bulk insert every interval, or as soon as this many records are buffered
+METRICS_FLUSH_INTERVAL_SECONDS = float(os.environ.get('METRICS_FLUSH_INTERVAL_SECONDS', '5'))
+METRICS_FLUSH_SIZE = int(os.environ.get('METRICS_FLUSH_SIZE', '200'))
+# Records held in memory before new ones are dropped (and counted)
+METRICS_BUFFER_SIZE = int(os.environ.get('METRICS_BUFFER_SIZE', '10000'))
+
+# Masks written as tiled TIFFs (mask_output=tiff), shared by all workers and
+# downloadable from /api/v1/tissue/mask/files/<file_id>/ until they expire
+MASK_FILE_DIR = os.environ.get('MASK_FILE_DIR', os.path.join(BASE_DIR.parent, 'data', 'mask_files'))
+MASK_FILE_TTL_SECONDS = int(os.environ.get('MASK_FILE_TTL_SECONDS', '3600'))
+
+# Batch endpoint: images of one batch decoded or processed at the same time
+# (on the shared executor); bounds batch memory to this many images
+BATCH_MAX_IN_FLIGHT = int(os.environ.get('BATCH_MAX_IN_FLIGHT', '4'))
+# Archive entries larger than this (encoded bytes) are reported, not read
+BATCH_MAX_ENTRY_BYTES = int(os.environ.get('BATCH_MAX_ENTRY_BYTES', str(256 * 1024 * 1024)))